@@ -1,5 +1,5 @@
-from fastapi import FastAPI, File, UploadFile, Form, Query
-from fastapi.responses import JSONResponse, Response
+from fastapi import FastAPI, File, UploadFile, Form, Query, Header
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Literal
@@ -8,12 +8,27 @@ import torch.nn.functional as F
 import torchvision.transforms as T
 from torchcam.methods import SmoothGradCAMpp, GradCAM, XGradCAM
 from torchcam.utils import overlay_mask
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
 import io
 import base64
 import time
 import numpy as np
 import os
+import asyncio
+import threading
+import queue
+import concurrent.futures
+import contextlib
+import functools
+import itertools
+import hashlib
+import re
+import uuid
+import zipfile
+import zlib
+import shutil
+import tempfile
+from collections import deque, OrderedDict
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
@@ -21,6 +36,15 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RL
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 import json
+from rendering import OverlayRenderer
+from lesion_mask import generate_lesion_mask, create_professional_mask_overlay, lesion_regions
+import transport
+import quantization
+import model_cache
+import backends
+import model_registry
+from video import FrameSampler, TemporalSmoother, build_segments
+from preprocessing import PreparedImage, adjust_image, decode_working_copy
 
 # ------------------------------------------------------------
 # CONFIGURATION
@@ -56,101 +80,524 @@ CLASS_MAPPING = {
 IMG_SIZE = 384
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 NUM_MC_SAMPLES = 10  # For uncertainty estimation
+MC_CHUNK_SIZE = int(os.environ.get("MC_CHUNK_SIZE", "5"))  # Max noisy samples per forward pass
+MC_ADAPTIVE_STEP = 2  # Samples added between convergence checks in adaptive mode
+MC_MIN_SAMPLES = 4  # Never stop adaptive sampling before this many samples
+MC_CONVERGENCE_TOL = float(os.environ.get("MC_CONVERGENCE_TOL", "0.01"))
+
+# Micro-batching: concurrent /predict calls are stacked into one forward per model
+ENABLE_MICRO_BATCHING = os.environ.get("ENABLE_MICRO_BATCHING", "1") == "1"
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+
+# Concurrency: CPU-bound stages run on a dedicated executor behind an admission queue.
+# Requests keep their slot while they wait for the batcher, so by default as many may
+# hold one as fit in a batch; CPU_WORKERS still bounds the stages running at once.
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", "2"))
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", str(max(CPU_WORKERS, BATCH_MAX_SIZE))))
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", "16"))
+QUEUE_TIMEOUT_S = float(os.environ.get("QUEUE_TIMEOUT_S", "30"))
+RETRY_AFTER_S = int(os.environ.get("RETRY_AFTER_S", "5"))
+
+# Pre-fork serving (see gunicorn_conf.py): models are loaded once in the master and
+# shared with the workers, either copy-on-write ("cow") or via shared memory ("shm")
+PREFORK = os.environ.get("GI_PREFORK") == "1"
+WEIGHT_SHARING = os.environ.get("WEIGHT_SHARING", "cow")
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", "0"))  # 0 keeps torch's default
+
+# Result cache: identical uploads with identical preprocessing reuse model results
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_MB", "256")) * 1024 ** 2
+RESULT_CACHE_DISK = os.environ.get("RESULT_CACHE_DISK", "0") == "1"
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "uploads/result_cache")
+RESULT_CACHE_DISK_BYTES = int(os.environ.get("RESULT_CACHE_DISK_MB", "2048")) * 1024 ** 2
+
+# Ensemble: each model runs on its own worker thread with MODEL_THREADS intra-op threads
+# (0 splits the torch thread pool evenly); ENSEMBLE_WEIGHTS looks like "deit3:0.4,vit:0.6"
+MODEL_THREADS = int(os.environ.get("MODEL_THREADS", "0"))
+ENSEMBLE_WEIGHTS = os.environ.get("ENSEMBLE_WEIGHTS", "")
+
+# TorchScript graphs: "freeze" serves frozen graphs for everything, "optimize" serves frozen
+# graphs run through optimize_for_inference and keeps the unfrozen model for gradients (a
+# second copy of the weights), "off" serves the files as they are. Frozen graphs are cached
+# next to the originals.
+JIT_MODE = os.environ.get("JIT_MODE", "freeze")
+WARMUP_BATCHES = int(os.environ.get("WARMUP_BATCHES", "3"))  # Synthetic forwards per model before serving
+WARMUP_BATCH_SIZE = int(os.environ.get("WARMUP_BATCH_SIZE", "1"))
+
+# Classification backends: each listed backend is benchmarked per model when a worker
+# starts and the fastest classifies; gradient-based maps always run on TorchScript.
+# ONNX_SESSION_OPTIONS sets per-model ONNX Runtime options, e.g.
+# "vit:threads=4,optimization=extended;deit3:threads=2" (default threads: the model's share)
+INFERENCE_BACKENDS = [
+    name.strip() for name in os.environ.get("INFERENCE_BACKENDS", "torchscript,onnxruntime").split(",")
+    if name.strip()
+]
+ONNX_SESSION_OPTIONS = os.environ.get("ONNX_SESSION_OPTIONS", "")
+# A backend other than TorchScript only serves a model if, on BACKEND_CHECK_SAMPLES synthetic
+# images, it picks the same top-1 class every time and no softmax value differs by more than
+# BACKEND_MAX_PROB_DIFF from the TorchScript output
+BACKEND_CHECK_SAMPLES = int(os.environ.get("BACKEND_CHECK_SAMPLES", "4"))
+BACKEND_MAX_PROB_DIFF = float(os.environ.get("BACKEND_MAX_PROB_DIFF", "1e-3"))
+
+# INT8 variants ("deit3-int8", "vit-int8", "ensemble-int8"): dynamically quantized for CPU,
+# cached next to the FP32 files and compared with FP32 outputs at load (see quantization.py)
+ENABLE_INT8 = os.environ.get("ENABLE_INT8", "1") == "1"
+INT8_CHECK_SAMPLES = int(os.environ.get("INT8_CHECK_SAMPLES", "8"))  # 0 skips the check
+INT8_CHECK_IMAGES = os.environ.get("INT8_CHECK_IMAGES", "")  # Validation images; synthetic if unset
+
+# /predict/batch: images per forward pass, per-image size cap (uploaded files and archive
+# entries) and cap on the total size of a request's uploads
+PREDICT_BATCH_SIZE = int(os.environ.get("PREDICT_BATCH_SIZE", "16"))
+MAX_BATCH_ENTRY_BYTES = int(os.environ.get("MAX_BATCH_ENTRY_MB", "50")) * 1024 ** 2
+MAX_BATCH_UPLOAD_BYTES = int(os.environ.get("MAX_BATCH_UPLOAD_MB", "1024")) * 1024 ** 2
+
+# /predict/video defaults: sampling rate, duplicate threshold (mean abs difference of 32x32
+# grayscale thumbnails, 0-255), EMA weight of the newest sample, shortest segment kept
+VIDEO_SAMPLE_FPS = float(os.environ.get("VIDEO_SAMPLE_FPS", "2"))
+VIDEO_DUPLICATE_THRESHOLD = float(os.environ.get("VIDEO_DUPLICATE_THRESHOLD", "2.0"))
+VIDEO_SMOOTHING_ALPHA = float(os.environ.get("VIDEO_SMOOTHING_ALPHA", "0.4"))
+VIDEO_MIN_SEGMENT_S = float(os.environ.get("VIDEO_MIN_SEGMENT_S", "1.0"))
+
+# Overlays, the lesion mask included, are rendered on one copy of the adjusted upload with at
+# most this many pixels on its longest side (0 = original resolution); a request's
+# max_image_side can lower it
+DISPLAY_MAX_SIDE = int(os.environ.get("DISPLAY_MAX_SIDE", "1280"))
+
+# Overlay images are encoded on their own thread pool, in the format each request asks for
+ENCODE_WORKERS = int(os.environ.get("ENCODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "6"))  # PIL's default
+
+# Preview sessions: POST /preprocess/sessions keeps an upload with a working copy decoded at
+# most PREVIEW_WORKING_SIDE pixels on its longer side; previews are rendered from that copy
+PREVIEW_TTL_S = float(os.environ.get("PREVIEW_TTL_S", "900"))
+PREVIEW_STORE_BYTES = int(os.environ.get("PREVIEW_STORE_MB", "256")) * 1024 ** 2
+PREVIEW_WORKING_SIDE = int(os.environ.get("PREVIEW_WORKING_SIDE", "1024"))
+PREVIEW_MAX_SIDE = int(os.environ.get("PREVIEW_MAX_SIDE", "512"))  # Default preview size
+PREVIEW_QUALITY = int(os.environ.get("PREVIEW_QUALITY", "80"))
+
+# Model registry (see model_registry.py): models are declared in MODEL_REGISTRY (the
+# MODEL_PATHS built-ins when the file is missing) and, unless declared with "preload": false,
+# loaded and warmed up before serving (before any fork). Idle models are evicted when the loaded ones exceed MODEL_MEMORY_MB
+# (0 = no budget), and a model whose file changes is reloaded without dropping requests.
+MODEL_REGISTRY = os.environ.get("MODEL_REGISTRY", "models.json")
+MODEL_MEMORY_BYTES = int(os.environ.get("MODEL_MEMORY_MB", "0")) * 1024 ** 2
+MODEL_IDLE_S = float(os.environ.get("MODEL_IDLE_S", "60"))  # Unused this long before it may be evicted
+MODEL_RELOAD_INTERVAL_S = float(os.environ.get("MODEL_RELOAD_INTERVAL_S", "5"))  # 0 disables reloading
+MODEL_PRELOAD = os.environ.get("MODEL_PRELOAD", "1") == "1"  # Default for "preload"
+
+# Lazy artifacts: /predict?lazy_artifacts=true defers explainability to GET /artifacts/...
+# Sessions are per worker unless ARTIFACT_DIR is set (default when pre-forked)
+ARTIFACT_TTL_S = float(os.environ.get("ARTIFACT_TTL_S", "600"))
+ARTIFACT_STORE_BYTES = int(os.environ.get("ARTIFACT_STORE_MB", "256")) * 1024 ** 2
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", "uploads/artifacts" if PREFORK else "")
 
 # ------------------------------------------------------------
 # LOAD MODELS
 # ------------------------------------------------------------
 print("🧠 Loading TorchScript models...")
-models_loaded = False
-deit_model = None
-vit_model = None
+models_loaded = False  # At least one declared model file exists
+in_worker = False  # Set once this process serves requests (after any fork)
+startup_report = {"jit_mode": JIT_MODE}  # Cold-start timing; per-model reports are in registry.stats()
+first_request_ms = {}  # Latency of the first real inference per model in this worker
+
+class LoadedModel(model_registry.ModelState):
+    """Everything loaded for one registry model; a reload replaces it as a whole."""
+    
+    def __init__(self):
+        super().__init__()
+        self.graph = None  # Served TorchScript graph, at the model's own input size
+        self.explain_graph = None  # Unfrozen model, when the served graph can't backpropagate
+        self.model = None  # `graph` taking IMG_SIZE batches (see InputResizer)
+        self.explain_model = None
+        self.classifier = None  # Fastest classification backend, opened in the serving process
+        self.int8_model = None
+        self.capabilities = None  # Saliency methods that work on the model, probed once at load
+
+class InputResizer:
+    """Calls a model declared with another input size on IMG_SIZE batches, resizing them first."""
+    
+    def __init__(self, model, size):
+        self.model = model
+        self.size = size
+    
+    def __call__(self, batch):
+        batch = F.interpolate(batch, size=(self.size, self.size), mode="bilinear", align_corners=False)
+        return self.model(batch)
+
+def at_input_size(model, entry):
+    """`model` wrapped to take IMG_SIZE batches if the registry entry declares another input size."""
+    if model is None or entry.input_size == IMG_SIZE:
+        return model
+    return InputResizer(model, entry.input_size)
+
+def load_model_state(entry, previous=None):
+    """Registry loader: serving graph (per JIT_MODE), capabilities, ONNX export, backend and warm-up."""
+    state = LoadedModel()
+    state.graph, state.explain_graph, state.info["load"] = load_torchscript(entry.name, entry.path)
+    state.model = at_input_size(state.graph, entry)
+    state.explain_model = at_input_size(state.explain_graph, entry)
+    # Estimated from the file size, once per TorchScript copy held in memory
+    state.nbytes = os.path.getsize(entry.path) * (1 if state.explain_graph is None else 2)
+    
+    state.capabilities = probe_model_capabilities(
+        state.explain_model if state.explain_model is not None else state.model
+    )
+    print(f"🔎 {entry.name} saliency method: {state.capabilities['saliency_method']}")
+    if "onnxruntime" in backend_candidates(entry):
+        export_onnx_model(entry)
+    if in_worker:
+        # ONNX Runtime sessions don't survive a fork; models preloaded in the master get theirs in init_worker
+        open_backend(entry, state)
+    state.info["warmup"] = warm_up_model(entry, state.classifier if state.classifier is not None else state.model)
+    if previous is not None and previous.int8_model is not None:
+        load_int8_variant(entry, state)  # A reload keeps the INT8 variant
+    return state
+
+def load_torchscript(model_name, path):
+    """Load the model served as `model_name` per JIT_MODE, as `(model, explain_model or None, info)`."""
+    started = time.perf_counter()
+    info = {"jit_mode": JIT_MODE}
+    model = explain_model = None
+    if JIT_MODE in ("freeze", "optimize"):
+        try:
+            model, cache_info = model_cache.load_or_build(
+                path, "frozen",
+                lambda: torch.jit.freeze(torch.jit.load(path, map_location=DEVICE).eval()),
+                map_location=DEVICE, device=DEVICE
+            )
+            info["frozen_cached"] = cache_info["cached"]
+            if JIT_MODE == "optimize":
+                # Its output can be neither saved nor backpropagated through, so it is rebuilt
+                # at every load and gradients use the unfrozen model
+                model = torch.jit.optimize_for_inference(model)
+                explain_model = torch.jit.load(path, map_location=DEVICE).eval()
+        except Exception as e:
+            print(f"⚠️  Could not {JIT_MODE} {model_name}, serving the original graph: {e}")
+            info["error"] = str(e)
+            model = explain_model = None
+    if model is None:
+        model = torch.jit.load(path, map_location=DEVICE).eval()
+    info["load_s"] = round(time.perf_counter() - started, 2)
+    return model, explain_model, info
+
+def warm_up_model(entry, model):
+    """Run WARMUP_BATCHES synthetic forwards (at least one, which checks the class count) before serving."""
+    batch = torch.randn(
+        (WARMUP_BATCH_SIZE, 3, IMG_SIZE, IMG_SIZE), generator=torch.Generator().manual_seed(0)
+    ).to(DEVICE)
+    times = []
+    with torch.no_grad():
+        for _ in range(max(1, WARMUP_BATCHES)):
+            forward_started = time.perf_counter()
+            output = model(batch)
+            times.append(round((time.perf_counter() - forward_started) * 1000, 2))
+    if output.shape[-1] != len(entry.class_names):
+        raise ValueError(f"{entry.name} outputs {output.shape[-1]} classes "
+                         f"but its class map has {len(entry.class_names)}")
+    if WARMUP_BATCHES <= 0:
+        return None
+    print(f"🔥 {entry.name} warm-up: first forward {times[0]:.0f} ms, warm {times[-1]:.0f} ms")
+    return {
+        "batches": WARMUP_BATCHES,
+        "batch_size": WARMUP_BATCH_SIZE,
+        "first_ms": times[0],
+        "warm_ms": times[-1]
+    }
+
+def backend_candidates(entry):
+    """Backends benchmarked for a model: its declared one, or INFERENCE_BACKENDS for "auto"."""
+    return INFERENCE_BACKENDS if entry.backend == "auto" else [entry.backend]
+
+def export_onnx_model(entry):
+    """Export a model to ONNX as it loads, so pre-forked workers only open sessions."""
+    if backends.ort is None or DEVICE != "cpu":
+        return
+    try:
+        onnx_path, info = backends.export_onnx(entry.path, entry.input_size)
+        print(f"✅ {entry.name} ONNX export {'loaded from cache' if info['cached'] else 'written'}: {onnx_path}")
+    except Exception as e:
+        print(f"⚠️  ONNX export of {entry.name} failed: {e}")
+
+def open_backend(entry, state):
+    """Open the backend candidates of a loaded model and keep the fastest as its classifier."""
+    if state.classifier is not None:
+        return
+    num_threads = model_thread_count()
+    # ONNX_SESSION_OPTIONS overrides the registry's per-model session_options
+    options = {"threads": num_threads, "input_size": entry.input_size, "device": DEVICE,
+               **entry.session_options,
+               **backends.parse_session_options(ONNX_SESSION_OPTIONS).get(entry.name, {})}
+    options["threads"] = options["threads"] or num_threads
+    candidates, errors = {}, {}
+    for backend_name in backend_candidates(entry):
+        try:
+            candidates[backend_name] = backends.create_backend(
+                backend_name, entry.name, entry.path, state.graph, options
+            )
+        except Exception as e:
+            errors[backend_name] = str(e)
+    agreement = check_backend_agreement(entry, state, candidates, errors)
+    if not candidates:
+        print(f"⚠️  No inference backend for {entry.name}, using TorchScript: {errors}")
+        state.info["backend"] = {"selected": None, "agreement": agreement, "errors": errors}
+        return
+    
+    batch = torch.randn(
+        (1, 3, entry.input_size, entry.input_size), generator=torch.Generator().manual_seed(0)
+    ).to(DEVICE)
+    selected, backend, latencies = backends.select_fastest(candidates, batch, num_threads=num_threads)
+    state.classifier = at_input_size(backend, entry)
+    if selected == "onnxruntime":
+        # Sessions can't be shared across a fork, so every worker holds its own copy
+        state.nbytes += os.path.getsize(backend.info["path"])
+    state.info["backend"] = {
+        "selected": selected,
+        "latency_ms": latencies,
+        "agreement": agreement,
+        "options": {name: candidate.info for name, candidate in candidates.items()},
+        "errors": errors
+    }
+    timings = ", ".join(f"{name} {ms:.1f} ms" for name, ms in latencies.items())
+    print(f"⚙️  {entry.name} classifies with {selected}{f' ({timings})' if timings else ''}")
+
+def check_backend_agreement(entry, state, candidates, errors):
+    """Drop the non-TorchScript candidates whose outputs don't match the TorchScript graph's."""
+    agreement = {}
+    if BACKEND_CHECK_SAMPLES <= 0:
+        return agreement
+    inputs = quantization.synthetic_inputs(BACKEND_CHECK_SAMPLES, entry.input_size).to(DEVICE)
+    for backend_name in [name for name in candidates if name != "torchscript"]:
+        try:
+            report = backends.agreement_check(state.graph, candidates[backend_name], inputs)
+            report["passed"] = report["top1_agreement"] == 1.0 and \
+                report["max_abs_prob_diff"] <= BACKEND_MAX_PROB_DIFF
+        except Exception as e:
+            report = {"passed": False, "error": str(e)}
+        agreement[backend_name] = report
+        if not report["passed"]:
+            del candidates[backend_name]
+            errors[backend_name] = "outputs disagree with TorchScript"
+            print(f"⚠️  {entry.name} on {backend_name} disagrees with TorchScript, not using it: {report}")
+    return agreement
+
+def load_int8_variant(entry, state):
+    """Load (or build and cache) the INT8 variant of a loaded model and check it against FP32."""
+    if "int8" in state.info:
+        return
+    int8_name = f"{entry.name}-int8"
+    if DEVICE != "cpu":
+        state.info["int8"] = {"error": f"INT8 models are CPU-only, not loading {int8_name} on {DEVICE}"}
+        return
+    try:
+        # Served FP32 graphs may be frozen, so quantize from the file on a cache miss
+        int8_model, info = quantization.load_or_quantize(entry.path)
+        int8_model = at_input_size(int8_model, entry)
+        if INT8_CHECK_SAMPLES > 0:
+            check_inputs, source = int8_check_inputs()
+            info.update(quantization.agreement_check(state.model, int8_model, check_inputs),
+                        inputs=source, threads=torch.get_num_threads())
+        info["warmup"] = warm_up_model(entry, int8_model)
+        state.int8_model = int8_model
+        state.nbytes += os.path.getsize(info["path"])
+        summary = (f", top-1 agreement {info['top1_agreement']:.1%}, {info['speedup']}x faster"
+                   if "speedup" in info else "")
+        print(f"✅ {int8_name} {'loaded from cache' if info['cached'] else 'quantized'} "
+              f"in {info['prepare_s']}s{summary}")
+    except Exception as e:
+        info = {"error": str(e)}
+        print(f"⚠️  {int8_name} unavailable: {e}")
+    state.info["int8"] = info
+
+@functools.lru_cache(maxsize=1)
+def int8_check_inputs():
+    """Inputs for the INT8 agreement check and where they came from."""
+    if INT8_CHECK_IMAGES:
+        try:
+            return quantization.image_inputs(INT8_CHECK_IMAGES, transform, INT8_CHECK_SAMPLES), "images"
+        except Exception as e:
+            print(f"⚠️  Could not read INT8_CHECK_IMAGES, using synthetic inputs: {e}")
+    return quantization.synthetic_inputs(INT8_CHECK_SAMPLES, IMG_SIZE), "synthetic"
+
+registry = model_registry.ModelRegistry(
+    MODEL_REGISTRY, load_model_state,
+    defaults={"input_size": IMG_SIZE, "class_names": CLASS_MAPPING, "preload": MODEL_PRELOAD},
+    fallback_config={
+        "default": "vit",
+        "ensemble": list(MODEL_PATHS),
+        "models": {name: {"path": path} for name, path in MODEL_PATHS.items()}
+    },
+    max_bytes=MODEL_MEMORY_BYTES, idle_s=MODEL_IDLE_S, reload_interval_s=MODEL_RELOAD_INTERVAL_S
+)
 
 def load_models():
-    global deit_model, vit_model, models_loaded
+    """Load the models declared with `preload` (all of them by default)."""
+    global models_loaded
     if models_loaded:
         return
+    started = time.perf_counter()
+    
+    if PREFORK:
+        # Keep the master single-threaded so no OpenMP pool exists when workers are forked
+        torch.set_num_threads(1)
     
     try:
-        deit_path = MODEL_PATHS["deit3"]
-        vit_path = MODEL_PATHS["vit"]
-        
-        if os.path.exists(deit_path):
-            deit_model = torch.jit.load(deit_path, map_location=DEVICE).eval()
-            print(f"✅ DeiT3 model loaded from {deit_path}")
-        else:
-            print(f"⚠️  Warning: DeiT3 model not found at {deit_path}")
-        
-        if os.path.exists(vit_path):
-            vit_model = torch.jit.load(vit_path, map_location=DEVICE).eval()
-            print(f"✅ ViT model loaded from {vit_path}")
-        else:
-            print(f"⚠️  Warning: ViT model not found at {vit_path}")
-        
-        if deit_model is None and vit_model is None:
+        for name, entry in registry.entries.items():
+            if not entry.available:
+                print(f"⚠️  Warning: {name} model not found at {entry.path}")
+        if not registry.available_names():
             print("❌ Error: No models found! Please add model files to backend/models/")
-        else:
-            models_loaded = True
-            print(f"✅ Models loaded successfully on: {DEVICE}")
+            return
+        models_loaded = True
+        
+        preloaded = [name for name in registry.available_names() if registry.entries[name].preload]
+        for name in preloaded:
+            if registry.get(name) is not None and ENABLE_INT8:
+                registry.update(name, load_int8_variant)
+        startup_report["cold_start_s"] = round(time.perf_counter() - started, 2)
+        print(f"🚀 {len(preloaded)} of {len(registry.entries)} models preloaded on {DEVICE} in "
+              f"{startup_report['cold_start_s']}s (JIT_MODE={JIT_MODE}); the rest load on first use")
+        
+        if PREFORK and WEIGHT_SHARING == "shm":
+            share_model_memory()
     except Exception as e:
         print(f"❌ Error loading models: {e}")
 
-load_models()
+def share_model_memory():
+    """Move model parameters and buffers into shared memory before workers are forked."""
+    total_bytes = 0
+    # Frozen graphs hold their weights as constants, which stay copy-on-write
+    for state in registry.loaded().values():
+        for model in (state.graph, state.explain_graph):
+            if model is None:
+                continue
+            for tensor in list(model.parameters()) + list(model.buffers()):
+                tensor.share_memory_()
+                total_bytes += tensor.numel() * tensor.element_size()
+    print(f"✅ Shared {total_bytes / 1024 ** 2:.1f} MB of model weights via shared memory")
+
+def init_worker():
+    """Per-process setup; runs in every serving process after any fork."""
+    global in_worker
+    if TORCH_THREADS > 0:
+        torch.set_num_threads(TORCH_THREADS)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # Can only be set before the first inter-op parallel call
+    in_worker = True
+    for model_name in registry.loaded():
+        registry.update(model_name, open_backend)
+    init_batch_schedulers()
+    # Each worker watches the files itself; a reloaded model is private to that worker
+    registry.start_watcher()
+    print(f"👷 Worker {os.getpid()} ready ({torch.get_num_threads()} torch threads)")
 
 # ------------------------------------------------------------
 # IMAGE TRANSFORMS
 # ------------------------------------------------------------
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
 transform = T.Compose([
     T.Resize((IMG_SIZE, IMG_SIZE)),
     T.ToTensor(),
-    T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    T.Normalize(IMAGENET_MEAN, IMAGENET_STD)
 ])
 
 # ------------------------------------------------------------
 # IMAGE PREPROCESSING
 # ------------------------------------------------------------
 def preprocess_image_custom(file_bytes, brightness=1.0, contrast=1.0, rotation=0, 
-                           flip_h=False, flip_v=False, crop_box=None, enhance=False, sharpen=False):
-    """Preprocess image with custom adjustments."""
-    img = Image.open(io.BytesIO(file_bytes)).convert("RGB")
-    
-    # Crop if specified
-    if crop_box:
-        img = img.crop(crop_box)
-    
-    # Rotate
-    if rotation != 0:
-        img = img.rotate(rotation, expand=True)
-    
-    # Flip
-    if flip_h:
-        img = img.transpose(Image.FLIP_LEFT_RIGHT)
-    if flip_v:
-        img = img.transpose(Image.FLIP_TOP_BOTTOM)
-    
-    # Brightness and contrast
-    if brightness != 1.0:
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(brightness)
-    
-    if contrast != 1.0:
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(contrast)
-    
-    # Filters
-    if enhance:
-        img = img.filter(ImageFilter.EDGE_ENHANCE)
-    if sharpen:
-        img = img.filter(ImageFilter.SHARPEN)
-    
-    # Convert to tensor
-    tensor = transform(img).unsqueeze(0).to(DEVICE)
-    return img, tensor
+                           flip_h=False, flip_v=False, crop_box=None, enhance=False, sharpen=False,
+                           source=None):
+    """Preprocess image with custom adjustments into `(PreparedImage, model tensor)` (see preprocessing.py)."""
+    image = PreparedImage(
+        file_bytes, source=source, brightness=brightness, contrast=contrast, rotation=rotation,
+        flip_h=flip_h, flip_v=flip_v, crop_box=crop_box, enhance=enhance, sharpen=sharpen
+    )
+    return image, image.tensor(IMG_SIZE, IMAGENET_MEAN, IMAGENET_STD).to(DEVICE)
 
 def preprocess_image(file_bytes):
     """Standard preprocessing."""
-    img = Image.open(io.BytesIO(file_bytes)).convert("RGB")
-    tensor = transform(img).unsqueeze(0).to(DEVICE)
-    return img, tensor
+    return preprocess_image_custom(file_bytes)
+
+def frames_to_tensor(frames):
+    """Normalized [N, 3, IMG_SIZE, IMG_SIZE] batch from RGB uint8 frames already at IMG_SIZE."""
+    batch = torch.from_numpy(np.stack(frames)).permute(0, 3, 1, 2).float().div_(255)
+    return T.functional.normalize(batch, IMAGENET_MEAN, IMAGENET_STD).to(DEVICE)
+
+# ------------------------------------------------------------
+# REQUEST COMPUTATION CONTEXT
+# ------------------------------------------------------------
+class ExplainContext:
+    """Request-scoped cache of the logits and saliency maps shared by the explainability functions."""
+    
+    def __init__(self, model, input_tensor, pred_idx=None):
+        self.model = model
+        self.input_tensor = input_tensor
+        self._pred_idx = int(pred_idx) if pred_idx is not None else None
+        self._logits = None
+        self._cache = {}
+        self.counters = {"forward": 0, "backward": 0}
+        self.stages = {}
+    
+    def _on_backward(self, grad):
+        self.counters["backward"] += 1
+    
+    def forward(self, x):
+        """Counted model forward; also captures the logits of the request input."""
+        self.counters["forward"] += 1
+        output = self.model(x)
+        if output.requires_grad:
+            output.register_hook(self._on_backward)
+        if self._logits is None and x.shape == self.input_tensor.shape:
+            self._logits = output.detach()
+        return output
+    
+    def seed(self, stage, value):
+        """Provide a value computed by an earlier request for the same input."""
+        self._cache[stage] = value
+    
+    def cached(self, stage):
+        """Value computed or seeded for `stage`, or None."""
+        return self._cache.get(stage)
+    
+    def memo(self, stage, compute):
+        """Return the cached value for `stage`, computing it on first use."""
+        counter = self.stages.setdefault(stage, {"computed": 0, "cached": 0})
+        if stage in self._cache:
+            counter["cached"] += 1
+            return self._cache[stage]
+        counter["computed"] += 1
+        value = compute()
+        self._cache[stage] = value
+        return value
+    
+    def logits(self):
+        def compute():
+            if self._logits is None:
+                with torch.no_grad():
+                    self.forward(self.input_tensor)
+            return self._logits
+        return self.memo("logits", compute)
+    
+    @property
+    def pred_idx(self):
+        if self._pred_idx is None:
+            self._pred_idx = int(self.logits().argmax())
+        return self._pred_idx
+    
+    def base_saliency(self):
+        """Input-gradient saliency for the predicted class (one forward + one backward)."""
+        def compute():
+            capabilities = capabilities_for(self.model)
+            if capabilities is not None and not capabilities["input_gradient"]:
+                return gaussian_saliency()
+            return apply_gradcam_custom(self.forward, self.input_tensor, self.pred_idx)
+        return self.memo("saliency", compute)
+    
+    def stats(self):
+        return {"passes": dict(self.counters), "stages": {k: dict(v) for k, v in self.stages.items()}}
 
 # ------------------------------------------------------------
 # GRAD-CAM UTILITIES
@@ -236,31 +683,43 @@ def apply_gradcam_custom(model, input_tensor, pred_idx):
                 raise ValueError("No gradients")
         except Exception as e2:
             print(f"Fallback Grad-CAM also failed: {e2}, using gaussian")
-            # Last resort: return a centered gaussian to show something
-            y, x = torch.meshgrid(
-                torch.linspace(-2, 2, IMG_SIZE),
-                torch.linspace(-2, 2, IMG_SIZE),
-                indexing='ij'
-            )
-            gaussian = torch.exp(-(x**2 + y**2) / 2.0)
-            gaussian = (gaussian - gaussian.min()) / (gaussian.max() - gaussian.min())
-            return gaussian
+            return gaussian_saliency()
+
+def gaussian_saliency():
+    """Centered gaussian map, the last resort when no saliency method works."""
+    y, x = torch.meshgrid(
+        torch.linspace(-2, 2, IMG_SIZE),
+        torch.linspace(-2, 2, IMG_SIZE),
+        indexing='ij'
+    )
+    gaussian = torch.exp(-(x**2 + y**2) / 2.0)
+    gaussian = (gaussian - gaussian.min()) / (gaussian.max() - gaussian.min())
+    return gaussian
 
-def apply_gradcam(model, input_tensor, pred_idx, method="smoothgradcampp"):
-    """Apply Grad-CAM - tries torchcam first, falls back to custom implementation."""
+CAM_EXTRACTORS = {
+    "smoothgradcampp": SmoothGradCAMpp,
+    "gradcam": GradCAM,
+    "xgradcam": XGradCAM
+}
+
+def apply_gradcam(model, input_tensor, pred_idx, method="smoothgradcampp", ctx=None):
+    """Apply Grad-CAM with torchcam where the model supports it, otherwise input-gradient saliency."""
+    if method not in CAM_EXTRACTORS:
+        method = "smoothgradcampp"
+    ctx = ctx or ExplainContext(model, input_tensor, pred_idx)
+    return ctx.memo(f"gradcam:{method}", lambda: _compute_gradcam(ctx, method))
+
+def _compute_gradcam(ctx, method):
+    # Skip torchcam entirely when the load-time probe showed it can't hook this model
+    capabilities = capabilities_for(ctx.model)
+    if capabilities is not None and not capabilities["torchcam"].get(method, False):
+        return ctx.base_saliency()
+    
     try:
-        # Try torchcam first (won't work with TorchScript but worth trying)
-        if method == "smoothgradcampp":
-            cam_extractor = SmoothGradCAMpp(model)
-        elif method == "gradcam":
-            cam_extractor = GradCAM(model)
-        elif method == "xgradcam":
-            cam_extractor = XGradCAM(model)
-        else:
-            cam_extractor = SmoothGradCAMpp(model)
+        cam_extractor = CAM_EXTRACTORS[method](ctx.model, input_shape=(3, IMG_SIZE, IMG_SIZE))
         
-        scores = model(input_tensor)
-        activation_map = cam_extractor(pred_idx, scores)
+        scores = ctx.forward(ctx.input_tensor)
+        activation_map = cam_extractor(ctx.pred_idx, scores)
         cam_extractor.remove_hooks()
         result = activation_map[0][0].detach().cpu()
         
@@ -269,20 +728,25 @@ def apply_gradcam(model, input_tensor, pred_idx, method="smoothgradcampp"):
             return result
         else:
             print("⚠️  torchcam returned empty map, using custom Grad-CAM")
-            return apply_gradcam_custom(model, input_tensor, pred_idx)
+            return ctx.base_saliency()
     except Exception as e:
         print(f"⚠️  torchcam failed ({e}), using custom Grad-CAM")
-        return apply_gradcam_custom(model, input_tensor, pred_idx)
+        return ctx.base_saliency()
+
+MULTILAYER_LAYERS = ["early", "middle", "final"]
 
-def apply_multilayer_gradcam(model, input_tensor, pred_idx, layers=None):
+def apply_multilayer_gradcam(model, input_tensor, pred_idx, layers=None, ctx=None):
     """Apply Grad-CAM to multiple layers with distinct visualizations."""
     if layers is None:
-        layers = ["early", "middle", "final"]
-    
+        layers = MULTILAYER_LAYERS
+    ctx = ctx or ExplainContext(model, input_tensor, pred_idx)
+    return ctx.memo(f"multilayer:{','.join(layers)}", lambda: _compute_multilayer_gradcam(ctx, layers))
+
+def _compute_multilayer_gradcam(ctx, layers):
     maps = {}
     try:
-        # Get base activation map using custom Grad-CAM
-        base_map = apply_gradcam_custom(model, input_tensor, pred_idx)
+        # Reuse the request's base activation map instead of recomputing it
+        base_map = ctx.base_saliency()
         
         # Create distinct visualizations for different "layers"
         # Since we can't access actual layers in TorchScript, we create meaningful variations
@@ -354,35 +818,23 @@ def apply_multilayer_gradcam(model, input_tensor, pred_idx, layers=None):
         traceback.print_exc()
         return {layer: torch.zeros((IMG_SIZE, IMG_SIZE)) for layer in layers}
 
-def apply_attention_rollout(model, input_tensor):
+def apply_attention_rollout(model, input_tensor, ctx=None):
     """Apply attention rollout visualization using efficient patch-based importance scoring."""
+    ctx = ctx or ExplainContext(model, input_tensor)
+    return ctx.memo("attention_rollout", lambda: _compute_attention_rollout(ctx))
+
+def _compute_attention_rollout(ctx):
     try:
         # Fast method: Use gradient-based attention with patch aggregation
         # This simulates attention rollout by computing importance per patch
         
-        output = model(input_tensor)
-        pred_idx = output.argmax()
-        
         # Use gradient-based method for speed (much faster than occlusion)
-        attention_map = apply_gradcam_custom(model, input_tensor, pred_idx)
+        attention_map = ctx.base_saliency()
         
         if attention_map.max() <= 0:
-            print("⚠️  Grad-CAM returned empty, trying alternative method")
-            # Alternative: Use input gradients with patch aggregation
-            input_tensor_grad = input_tensor.clone().detach().requires_grad_(True)
-            output = model(input_tensor_grad)
-            score = output[0, pred_idx]
-            score.backward()
-            
-            if input_tensor_grad.grad is not None:
-                gradients = input_tensor_grad.grad.data[0].abs().mean(dim=0)
-                attention_map = F.relu(gradients)
-                
-                # Normalize
-                if attention_map.max() > 0:
-                    attention_map = (attention_map - attention_map.min()) / (attention_map.max() - attention_map.min() + 1e-8)
-                else:
-                    attention_map = torch.ones_like(attention_map) * 0.5
+            # Recomputing the same input gradients would give the same empty map
+            print("⚠️  Grad-CAM returned empty, using uniform attention")
+            attention_map = torch.ones_like(attention_map) * 0.5
         
         # Convert to numpy for patch processing
         attention_np = attention_map.numpy() if isinstance(attention_map, torch.Tensor) else attention_map
@@ -437,441 +889,1483 @@ def apply_attention_rollout(model, input_tensor):
         traceback.print_exc()
         # Fallback to Grad-CAM
         try:
-            output = model(input_tensor)
-            pred_idx = output.argmax()
-            return apply_gradcam_custom(model, input_tensor, pred_idx)
+            return ctx.base_saliency()
         except:
             return torch.zeros((IMG_SIZE, IMG_SIZE))
 
-def generate_lesion_mask(activation_map, threshold=0.35, smooth=True, use_morphology=True):
-    """Generate improved binary lesion mask from activation map with smoothing and morphological filtering."""
+# ------------------------------------------------------------
+# CAPABILITY PROBING
+# ------------------------------------------------------------
+def probe_model_capabilities(model):
+    """Check once which saliency methods work on `model` and which one /predict dispatches to."""
+    probe_input = torch.zeros((1, 3, IMG_SIZE, IMG_SIZE), device=DEVICE)
+    capabilities = {
+        "eager": isinstance(model, torch.nn.Module) and not isinstance(model, torch.jit.ScriptModule),
+        "torchcam": {},
+        "input_gradient": False
+    }
+    
+    for method, extractor_cls in CAM_EXTRACTORS.items():
+        cam_extractor = None
+        try:
+            cam_extractor = extractor_cls(model, input_shape=(3, IMG_SIZE, IMG_SIZE))
+            cam_extractor(0, model(probe_input))
+            capabilities["torchcam"][method] = True
+        except Exception:
+            capabilities["torchcam"][method] = False
+        finally:
+            if cam_extractor is not None:
+                try:
+                    cam_extractor.remove_hooks()
+                except Exception:
+                    pass
+    
     try:
-        import cv2
-        cv2_available = True
-    except ImportError:
-        print("⚠️  OpenCV not available, using scipy for mask generation")
-        cv2_available = False
-        from scipy import ndimage
+        probe_grad = probe_input.clone().requires_grad_(True)
+        model(probe_grad)[0, 0].backward()
+        capabilities["input_gradient"] = probe_grad.grad is not None
+    except Exception as e:
+        print(f"⚠️  Input-gradient saliency unavailable: {e}")
     
-    # Convert to numpy if tensor
-    if isinstance(activation_map, torch.Tensor):
-        activation_np = activation_map.numpy()
-    else:
-        activation_np = activation_map
-    
-    # Ensure we have a valid activation map
-    if activation_np.max() <= activation_np.min():
-        print("⚠️  Activation map has no variation, creating default mask")
-        # Return a small centered region as fallback
-        mask = np.zeros((IMG_SIZE, IMG_SIZE), dtype=np.float32)
-        center = IMG_SIZE // 2
-        y, x = np.ogrid[:IMG_SIZE, :IMG_SIZE]
-        mask[(x - center)**2 + (y - center)**2 < (IMG_SIZE // 4)**2] = 0.5
-        if isinstance(activation_map, torch.Tensor):
-            return torch.from_numpy(mask).float()
-        return mask
-    
-    # Normalize to [0, 1]
-    normalized = (activation_np - activation_np.min()) / (activation_np.max() - activation_np.min() + 1e-8)
-    
-    # Convert to uint8 for operations
-    normalized_uint8 = (normalized * 255).astype(np.uint8)
-    
-    # 1. Smooth activations with Gaussian blur to remove grid-like artifacts
-    if smooth:
-        if cv2_available:
-            # Use larger kernel for better smoothing
-            kernel_size = 15
-            sigma = 4.0
-            smoothed = cv2.GaussianBlur(normalized_uint8, (kernel_size, kernel_size), sigma)
-        else:
-            # Fallback to scipy
-            smoothed = ndimage.gaussian_filter(normalized_uint8.astype(np.float32), sigma=4.0).astype(np.uint8)
+    working = [method for method, ok in capabilities["torchcam"].items() if ok]
+    if working:
+        capabilities["saliency_method"] = working[0]
+    elif capabilities["input_gradient"]:
+        capabilities["saliency_method"] = "input_gradient"
     else:
-        smoothed = normalized_uint8
-    
-    # 2. Use adaptive threshold - more conservative for professional results
-    threshold_value = int(threshold * 255)
-    
-    # Ensure threshold is reasonable
-    if threshold_value < 30:
-        threshold_value = 30  # Minimum threshold - more conservative
-    if threshold_value > 200:
-        threshold_value = 200  # Maximum threshold
-    
-    lesion_mask = (smoothed > threshold_value).astype(np.uint8) * 255
-    
-    # Check if mask has any content
-    if lesion_mask.sum() == 0:
-        print(f"⚠️  Mask is empty at threshold {threshold}, using adaptive threshold")
-        # Use adaptive threshold - top 20% of activations
-        flat_smoothed = smoothed.flatten()
-        top_20_percent = int(len(flat_smoothed) * 0.20)
-        if top_20_percent > 0:
-            threshold_value = np.partition(flat_smoothed, -top_20_percent)[-top_20_percent]
-            lesion_mask = (smoothed > threshold_value).astype(np.uint8) * 255
-    
-    # 3. Morphological filtering to remove noise and fill holes
-    if use_morphology and cv2_available:
-        try:
-            # Remove small noise regions (area < 100 pixels)
-            num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(lesion_mask, connectivity=8)
-            filtered_mask = np.zeros_like(lesion_mask)
-            min_area = 100  # Minimum area threshold
-            
-            for i in range(1, num_labels):  # Skip background (label 0)
-                area = stats[i, cv2.CC_STAT_AREA]
-                if area >= min_area:
-                    filtered_mask[labels == i] = 255
-            
-            lesion_mask = filtered_mask
-            
-            # Create kernel for morphological operations
-            kernel_size = 5
-            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
-            
-            # Opening: removes small specks/noise
-            lesion_mask = cv2.morphologyEx(lesion_mask, cv2.MORPH_OPEN, kernel, iterations=1)
-            
-            # Closing: fills holes and gaps in lesion regions
-            lesion_mask = cv2.morphologyEx(lesion_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-            
-        except Exception as e:
-            print(f"⚠️  Advanced morphological operations failed: {e}, using basic operations")
-            try:
-                kernel = np.ones((5, 5), np.uint8)
-                lesion_mask = cv2.morphologyEx(lesion_mask, cv2.MORPH_OPEN, kernel)
-                lesion_mask = cv2.morphologyEx(lesion_mask, cv2.MORPH_CLOSE, kernel)
-            except:
-                pass
-    elif use_morphology:
-        # Fallback morphological operations using scipy
-        try:
-            from scipy.ndimage import binary_opening, binary_closing, label
-            binary_mask = lesion_mask > 0
-            # Remove small regions
-            labeled_mask, num_features = label(binary_mask)
-            for i in range(1, num_features + 1):
-                region_size = np.sum(labeled_mask == i)
-                if region_size < 100:
-                    binary_mask[labeled_mask == i] = False
-            # Apply opening and closing
-            binary_mask = binary_opening(binary_mask, structure=np.ones((5, 5)))
-            binary_mask = binary_closing(binary_mask, structure=np.ones((5, 5)))
-            lesion_mask = (binary_mask.astype(np.uint8)) * 255
-        except Exception as e:
-            print(f"⚠️  Fallback morphology failed: {e}")
+        capabilities["saliency_method"] = "gaussian"
+    return capabilities
+
+def capabilities_for(model):
+    """Probed capabilities of a loaded model, or None if it was never probed."""
+    for state in registry.loaded().values():
+        if model is state.model or model is state.explain_model:
+            return state.capabilities
+    return None
+
+def blend_heatmap(original_pil, activation_map, alpha=0.4, smooth=True, sigma=2.0, 
+                  show_contours=True, contour_threshold=0.7, colormap='jet', renderer=None):
+    """Blend activation map with original image using vivid colormap and optional contours (`renderer` shares one base image)."""
+    renderer = renderer or OverlayRenderer(original_pil, alpha=alpha)
+    return renderer.render(
+        activation_map,
+        colormap=colormap,
+        smooth=smooth,
+        sigma=sigma,
+        show_contours=show_contours,
+        contour_threshold=contour_threshold
+    )
+
+# ------------------------------------------------------------
+# UNCERTAINTY ESTIMATION
+# ------------------------------------------------------------
+def _summarize_mc_predictions(predictions):
+    """Mean confidence and entropy of stacked softmax samples [N, C]."""
+    mean_pred = predictions.mean(dim=0, keepdim=True)
+    entropy = -torch.sum(mean_pred * torch.log(mean_pred + 1e-8), dim=1)
+    return mean_pred, float(mean_pred.max()), float(entropy.item())
+
+def _forward_mc_chunk(model, noisy_inputs):
+    """Softmax for a chunk of noisy inputs, one by one if the model rejects batches."""
+    try:
+        return F.softmax(model(noisy_inputs), dim=1)
+    except Exception as e:
+        if noisy_inputs.shape[0] == 1:
+            raise
+        print(f"⚠️  Batched MC forward failed ({e}), running samples one by one")
+        return torch.cat([F.softmax(model(sample.unsqueeze(0)), dim=1) for sample in noisy_inputs])
+
+def estimate_uncertainty(model, input_tensor, num_samples=NUM_MC_SAMPLES, clean_output=None,
+                         adaptive=False, tolerance=MC_CONVERGENCE_TOL, chunk_size=MC_CHUNK_SIZE):
+    """Estimate prediction uncertainty from noisy input samples (adaptive mode stops once they converge)."""
+    num_samples = max(1, int(num_samples))
+    chunk_size = max(1, int(chunk_size))
+    step = min(chunk_size, MC_ADAPTIVE_STEP) if adaptive else chunk_size
     
-    # Final check - ensure mask has content
-    if lesion_mask.sum() == 0:
-        print("⚠️  Mask still empty after processing, using top 15% of activations")
-        # Use top 15% of activations
-        flat_smoothed = smoothed.flatten()
-        top_15_percent = int(len(flat_smoothed) * 0.15)
-        if top_15_percent > 0:
-            threshold_value = np.partition(flat_smoothed, -top_15_percent)[-top_15_percent]
-            lesion_mask = (smoothed > threshold_value).astype(np.uint8) * 255
+    predictions = []
+    used = 0
+    if clean_output is not None:
+        # The softmax already computed for the un-noised input is the first sample
+        predictions.append(clean_output.detach().reshape(1, -1).to(input_tensor.device))
+        used = 1
     
-    # Convert back to float tensor if needed
-    mask_float = (lesion_mask / 255.0).astype(np.float32)
+    sample_shape = tuple(input_tensor.shape[1:])
+    previous = None
+    converged = False
     
-    coverage = mask_float.sum() / (IMG_SIZE * IMG_SIZE) * 100
-    print(f"✅ Lesion mask generated: {coverage:.2f}% coverage")
+    with torch.no_grad():
+        while used < num_samples:
+            n = min(step, num_samples - used)
+            # Add small noise to simulate uncertainty
+            noise = torch.randn((n,) + sample_shape, device=input_tensor.device, dtype=input_tensor.dtype)
+            noisy_inputs = input_tensor.expand(n, *sample_shape) + noise * 0.01
+            predictions.append(_forward_mc_chunk(model, noisy_inputs))
+            used += n
+            
+            if adaptive and used >= MC_MIN_SAMPLES:
+                _, confidence, entropy = _summarize_mc_predictions(torch.cat(predictions))
+                if previous is not None and \
+                        abs(confidence - previous[0]) < tolerance and abs(entropy - previous[1]) < tolerance:
+                    converged = True
+                    break
+                previous = (confidence, entropy)
     
-    if isinstance(activation_map, torch.Tensor):
-        return torch.from_numpy(mask_float).float()
-    return mask_float
+    return _uncertainty_result(torch.cat(predictions), adaptive, converged)
 
-def create_professional_mask_overlay(mask, original_image, overlay_alpha=0.4, contour_thickness=2):
-    """
-    Create a professional medical-grade mask overlay with contours and smooth edges.
-    
-    Args:
-        mask: Binary mask (numpy array, 0-1 or 0-255)
-        original_image: PIL Image of the original medical image
-        overlay_alpha: Transparency of the overlay (0.0-1.0)
-        contour_thickness: Thickness of contour lines in pixels
+def _uncertainty_result(predictions, adaptive=False, converged=False):
+    """Uncertainty summary of one image's stacked softmax samples [N, C]."""
+    mean_pred, mean_confidence, uncertainty = _summarize_mc_predictions(predictions)
+    std_pred = predictions.std(dim=0) if predictions.shape[0] > 1 else torch.zeros_like(mean_pred)
     
-    Returns:
-        PIL Image with professional overlay
-    """
-    try:
-        import cv2
-        cv2_available = True
-    except ImportError:
-        print("⚠️  OpenCV not available, using basic overlay")
-        cv2_available = False
-    
-    # Convert mask to numpy array
-    if isinstance(mask, torch.Tensor):
-        mask_np = mask.numpy()
-    else:
-        mask_np = mask
+    return {
+        "mean_confidence": mean_confidence,
+        "std_confidence": float(std_pred.max()),
+        "entropy": uncertainty,
+        "uncertainty_score": min(uncertainty / np.log(predictions.shape[-1]), 1.0),  # Normalized
+        "num_samples": predictions.shape[0],
+        "adaptive": adaptive,
+        "converged": converged
+    }
+
+def estimate_uncertainty_batch(model, inputs, clean_outputs, num_samples=NUM_MC_SAMPLES):
+    """`estimate_uncertainty` (fixed mode) for a batch, with each noisy sample run as one forward over all images."""
+    samples = [clean_outputs.detach().to(inputs.device)]
+    with torch.no_grad():
+        for _ in range(max(1, int(num_samples)) - 1):
+            noise = torch.randn_like(inputs)
+            samples.append(_forward_mc_chunk(model, inputs + noise * 0.01))
+    predictions = torch.stack(samples, dim=1)  # [B, N, C]
+    return [_uncertainty_result(image_predictions) for image_predictions in predictions]
+
+def uncertainty_field(adaptive):
+    """Result-cache record field holding the uncertainty of one sampling mode."""
+    return "uncertainty_adaptive" if adaptive else "uncertainty"
+
+def cached_uncertainty(record, adaptive):
+    """The record's uncertainty for the `adaptive` mode, or None if it has none yet."""
+    uncertainty = record.get(uncertainty_field(adaptive))
+    # Records written before the per-mode fields may hold the other mode's result
+    if uncertainty is not None and uncertainty.get("adaptive", False) == adaptive:
+        return uncertainty
+    return None
+
+# ------------------------------------------------------------
+# MODEL SELECTION
+# ------------------------------------------------------------
+ENSEMBLES = {
+    "ensemble": tuple(registry.ensemble),
+    "ensemble-int8": tuple(f"{name}-int8" for name in registry.ensemble)
+}
+if len({tuple(registry.entries[name].class_names.items()) for name in registry.ensemble}) > 1:
+    raise ValueError(f"The ensemble members declared in {MODEL_REGISTRY} must share one class map")
+
+def int8_base_name(model_name):
+    """`model_name` without its "-int8" suffix, if it has one."""
+    return model_name[:-len("-int8")] if model_name.endswith("-int8") else model_name
+
+def base_model_name(model_name):
+    """Registry model behind a single-model name; unknown names fall back to the default model."""
+    if model_name.endswith("-int8"):
+        return model_name[:-len("-int8")]
+    return model_name if model_name in registry.entries else registry.fallback()
+
+def model_state(model_name):
+    """Loaded registry state behind `model_name`, loading it (and its INT8 variant) on first use."""
+    name = base_model_name(model_name)
+    state = registry.get(name) if name is not None else None
+    if state is not None and model_name.endswith("-int8") and ENABLE_INT8 and "int8" not in state.info:
+        registry.update(name, load_int8_variant)
+        state = registry.get(name)
+    return state
+
+def get_model(model_name: str):
+    """Get model by name, loading it on first use (None for ensembles and unavailable models)."""
+    if model_name in ENSEMBLES:
+        return None  # Special handling for ensemble
+    state = model_state(model_name)
+    if state is None:
+        return None
+    return state.int8_model if model_name.endswith("-int8") else state.model
+
+def explain_model_for(model_name):
+    """Model used for the explainability maps of a request (the FP32 default model for ensembles and INT8 variants)."""
+    if model_name.endswith("-int8"):
+        model_name = model_name[:-len("-int8")]
+    state = model_state(model_name)
+    if state is None and registry.fallback() is not None:
+        state = registry.get(registry.fallback())
+    if state is None:
+        return None
+    # Optimized graphs can't backpropagate; use the unfrozen model loaded alongside them
+    return state.explain_model if state.explain_model is not None else state.model
+
+def class_names_for(model_name):
+    """Class index -> name mapping of the model(s) behind `model_name`."""
+    entry = registry.entries.get(base_model_name(ENSEMBLES.get(model_name, (model_name,))[0]))
+    return entry.class_names if entry is not None else CLASS_MAPPING
+
+def model_version(model_name):
+    """File fingerprints of the loaded models behind `model_name`, so cached results expire on reload."""
+    names = {base_model_name(name) for name in ENSEMBLES.get(model_name, (model_name,))}
+    return {name: state.fingerprint for name, state in registry.loaded().items() if name in names}
+
+def models_ready(model_name):
+    """Whether every model a `model_name` request uses is loaded (or can't be)."""
+    names = list(ENSEMBLES.get(model_name, (model_name,)))
+    if model_name in ENSEMBLES and registry.fallback() is not None:
+        names.append(registry.fallback())  # Explains ensemble predictions
+    for name in names:
+        entry = registry.entries.get(base_model_name(name))
+        if entry is None or not entry.available or entry.error:
+            continue
+        state = entry.state
+        if state is None or (name.endswith("-int8") and ENABLE_INT8 and "int8" not in state.info):
+            return False
+    return True
+
+async def ensure_models(model_name):
+    """Load the models a request uses on the CPU executor, so a first use doesn't block the event loop."""
+    if models_ready(model_name):
+        return
     
-    # Ensure mask is 2D and in range [0, 255]
-    if len(mask_np.shape) > 2:
-        mask_np = mask_np.squeeze()
+    def load():
+        for name in ENSEMBLES.get(model_name, (model_name,)):
+            get_model(name)
+        explain_model_for(model_name)
     
-    if mask_np.max() <= 1.0:
-        mask_np = (mask_np * 255).astype(np.uint8)
-    else:
-        mask_np = mask_np.astype(np.uint8)
+    await run_blocking(load)
+
+# ------------------------------------------------------------
+# MICRO-BATCHING SCHEDULER
+# ------------------------------------------------------------
+class MicroBatchScheduler:
+    """Runs queued [N, 3, H, W] inference requests for one model as batches on its own worker thread."""
     
-    # Resize mask to match original image
-    original_size = original_image.size
-    if mask_np.shape[0] != original_size[1] or mask_np.shape[1] != original_size[0]:
-        if cv2_available:
-            mask_np = cv2.resize(mask_np, original_size, interpolation=cv2.INTER_LINEAR)
-        else:
-            mask_img = Image.fromarray(mask_np)
-            mask_img = mask_img.resize(original_size, Image.LANCZOS)
-            mask_np = np.array(mask_img)
+    def __init__(self, name, forward_fn, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 num_threads=0):
+        self.name = name
+        self.forward_fn = forward_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms) / 1000.0)
+        self.num_threads = num_threads
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._images = 0
+        self._batch_size_histogram = {}
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._total_forward = 0.0
+        self._recent_waits = deque(maxlen=1000)
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
     
-    # Convert original image to numpy array (RGB)
-    if isinstance(original_image, Image.Image):
-        img_array = np.array(original_image.convert('RGB'))
-    else:
-        img_array = np.array(original_image)
-        if len(img_array.shape) == 2:
-            img_array = np.stack([img_array] * 3, axis=-1)
+    def submit(self, tensor):
+        """Queue an [N, 3, H, W] tensor; returns a concurrent Future with its softmax rows."""
+        future = concurrent.futures.Future()
+        self._queue.put((tensor, future, time.perf_counter()))
+        return future
     
-    # Create binary mask
-    binary_mask = (mask_np > 127).astype(np.uint8)
+    def _collect(self):
+        batch = []
+        first = self._queue.get()
+        deadline = first[2] + self.max_wait
+        if first[1].set_running_or_notify_cancel():
+            batch.append(first)
+        if self._queue.empty():
+            # Nothing else is waiting and this worker is idle, so don't delay a lone request;
+            # requests arriving during its forward pass are batched behind it
+            return batch
+        while sum(tensor.shape[0] for tensor, _, _ in batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[1].set_running_or_notify_cancel():
+                batch.append(item)
+        return batch
     
-    if cv2_available:
-        # Apply additional smoothing to mask edges for professional look
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        binary_mask = cv2.morphologyEx(binary_mask, cv2.MORPH_CLOSE, kernel)
-        
-        # Create smooth alpha mask with gradient edges
-        alpha_mask = mask_np.astype(np.float32) / 255.0
-        alpha_mask = cv2.GaussianBlur(alpha_mask, (9, 9), 2.0)
-        alpha_mask = np.clip(alpha_mask * overlay_alpha, 0, overlay_alpha)
-        
-        # Create red overlay (medical standard color for lesions)
-        overlay = img_array.copy().astype(np.float32)
-        red_overlay = np.zeros_like(overlay)
-        red_overlay[:, :, 0] = 255  # Red channel
-        red_overlay[:, :, 1] = 0    # Green channel
-        red_overlay[:, :, 2] = 0    # Blue channel
-        
-        # Apply overlay with smooth alpha blending
-        for c in range(3):
-            overlay[:, :, c] = overlay[:, :, c] * (1 - alpha_mask) + red_overlay[:, :, c] * alpha_mask
-        
-        overlay = np.clip(overlay, 0, 255).astype(np.uint8)
-        
-        # Find contours for professional boundary drawing
-        contours, _ = cv2.findContours(binary_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # Filter out very small contours
-        min_contour_area = 50
-        filtered_contours = [c for c in contours if cv2.contourArea(c) >= min_contour_area]
-        
-        # Draw contours with professional medical imaging colors
-        # Use cyan/white for high contrast visibility against red overlay
-        contour_color = (0, 255, 255)  # Cyan for high visibility and medical standard
-        cv2.drawContours(overlay, filtered_contours, -1, contour_color, contour_thickness)
-        
-        # Also draw a thinner white inner contour for better definition
-        if contour_thickness > 1:
-            cv2.drawContours(overlay, filtered_contours, -1, (255, 255, 255), max(1, contour_thickness - 1))
-    else:
-        # Fallback without OpenCV - simple overlay
-        from scipy import ndimage
-        alpha_mask = mask_np.astype(np.float32) / 255.0
-        alpha_mask = ndimage.gaussian_filter(alpha_mask, sigma=2.0)
-        alpha_mask = np.clip(alpha_mask * overlay_alpha, 0, overlay_alpha)
-        
-        overlay = img_array.copy().astype(np.float32)
-        red_overlay = np.zeros_like(overlay)
-        red_overlay[:, :, 0] = 255
-        
-        for c in range(3):
-            overlay[:, :, c] = overlay[:, :, c] * (1 - alpha_mask) + red_overlay[:, :, c] * alpha_mask
-        
-        overlay = np.clip(overlay, 0, 255).astype(np.uint8)
+    def _run(self):
+        if self.num_threads:
+            # The OpenMP thread count is per calling thread, so this only affects this model
+            torch.set_num_threads(self.num_threads)
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                inputs = torch.cat([tensor for tensor, _, _ in batch], dim=0)
+                with torch.no_grad():
+                    probs = F.softmax(self.forward_fn(inputs), dim=1)
+                offset = 0
+                for tensor, future, _ in batch:
+                    future.set_result(probs[offset:offset + tensor.shape[0]])
+                    offset += tensor.shape[0]
+            except Exception as e:
+                print(f"⚠️  Batched inference failed for {self.name} ({e}), running requests one by one")
+                for tensor, future, _ in batch:
+                    if future.done():
+                        continue
+                    try:
+                        with torch.no_grad():
+                            future.set_result(F.softmax(self.forward_fn(tensor), dim=1))
+                    except Exception as single_error:
+                        future.set_exception(single_error)
+            self._record(batch, started, time.perf_counter() - started)
     
-    # Convert back to PIL Image
-    result_image = Image.fromarray(overlay)
+    def _record(self, batch, started, forward_time):
+        waits = [started - enqueued for _, _, enqueued in batch]
+        images = sum(tensor.shape[0] for tensor, _, _ in batch)
+        with self._lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._images += images
+            self._batch_size_histogram[images] = self._batch_size_histogram.get(images, 0) + 1
+            self._total_wait += sum(waits)
+            self._max_wait_seen = max(self._max_wait_seen, max(waits))
+            self._total_forward += forward_time
+            self._recent_waits.extend(waits)
     
-    return result_image
+    def stats(self):
+        """Batch-size and queue-wait statistics for this model."""
+        with self._lock:
+            recent = sorted(self._recent_waits)
+            
+            def percentile(q):
+                if not recent:
+                    return 0.0
+                return round(recent[min(len(recent) - 1, int(q * len(recent)))] * 1000, 2)
+            
+            return {
+                "num_threads": self.num_threads or torch.get_num_threads(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "requests": self._requests,
+                "images": self._images,
+                "mean_batch_size": round(self._images / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_size_histogram.items())),
+                "mean_queue_wait_ms": round(self._total_wait / self._requests * 1000, 2) if self._requests else 0.0,
+                "p50_queue_wait_ms": percentile(0.50),
+                "p95_queue_wait_ms": percentile(0.95),
+                "max_queue_wait_ms": round(self._max_wait_seen * 1000, 2),
+                "mean_forward_ms": round(self._total_forward / self._batches * 1000, 2) if self._batches else 0.0
+            }
+
+batch_schedulers = {}
+
+def model_thread_count():
+    """Intra-op threads of each model worker."""
+    members = [name for name in ENSEMBLES["ensemble"] if registry.entries[name].available]
+    # Split the intra-op pool between the members of an ensemble so it doesn't oversubscribe cores
+    return MODEL_THREADS or max(1, torch.get_num_threads() // max(1, len(members)))
+
+def classifier_for(model_name):
+    """Callable that classifies with `model_name`: its selected backend, else the TorchScript model."""
+    state = model_state(model_name)
+    model = None
+    if state is not None:
+        if model_name.endswith("-int8"):
+            model = state.int8_model
+        else:
+            model = state.classifier if state.classifier is not None else state.model
+    if model is None:
+        raise ModelUnavailable(f"Model {model_name} not available.")
+    return model
+
+def init_batch_schedulers():
+    """Start one scheduler (and worker thread) per declared model whose file exists."""
+    model_names = registry.available_names()
+    if ENABLE_INT8 and DEVICE == "cpu":
+        model_names += [f"{name}-int8" for name in model_names]
+    num_threads = model_thread_count()
+    for model_name in model_names:
+        if model_name not in batch_schedulers:
+            batch_schedulers[model_name] = MicroBatchScheduler(
+                model_name,
+                # Resolve the model at call time so reloads and lazy loads are picked up
+                lambda batch, name=model_name: classifier_for(name)(batch),
+                max_batch_size=BATCH_MAX_SIZE if ENABLE_MICRO_BATCHING else 1,
+                max_wait_ms=BATCH_MAX_WAIT_MS if ENABLE_MICRO_BATCHING else 0,
+                num_threads=num_threads
+            )
+    if batch_schedulers:
+        print(f"✅ Model workers started ({num_threads} threads each, micro-batching "
+              f"{'max batch ' + str(BATCH_MAX_SIZE) if ENABLE_MICRO_BATCHING else 'disabled'})")
+
+def submit_inference(model_name, tensor):
+    """Return a concurrent Future with the softmax output of `model_name` for `tensor`."""
+    scheduler = batch_schedulers.get(model_name)
+    if scheduler is not None:
+        return scheduler.submit(tensor)
+    return cpu_executor.submit(_softmax_inference, model_name, tensor)
+
+def _softmax_inference(model_name, tensor):
+    with torch.no_grad():
+        return F.softmax(classifier_for(model_name)(tensor), dim=1)
+
+async def run_inference(model_name, tensor):
+    """Await the (possibly batched) softmax output without blocking the event loop."""
+    return await asyncio.wrap_future(submit_inference(model_name, tensor))
 
-def smooth_activation_map(activation_map, sigma=2.0):
-    """Apply Gaussian blur to smooth the activation map for continuous heatmap look."""
-    from scipy import ndimage
+# ------------------------------------------------------------
+# RESULT CACHE
+# ------------------------------------------------------------
+def _nbytes(value):
+    """Approximate memory footprint of a cache record."""
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, PreparedImage):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    return 64
+
+class ResultCache:
+    """Content-addressed, byte-bounded LRU cache of per-image model results, with an optional disk tier."""
     
-    # Convert to numpy if tensor
-    if isinstance(activation_map, torch.Tensor):
-        activation_np = activation_map.numpy()
-    else:
-        activation_np = activation_map
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.counters = {
+            "hits": 0, "misses": 0, "evictions": 0, "coalesced": 0,
+            "disk_hits": 0, "disk_writes": 0, "disk_evictions": 0
+        }
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
     
-    # Apply Gaussian blur
-    smoothed = ndimage.gaussian_filter(activation_np, sigma=sigma)
+    @staticmethod
+    def make_key(file_bytes, model_name, **params):
+        digest = hashlib.sha256(file_bytes)
+        digest.update(json.dumps({"model": model_name, **params}, sort_keys=True).encode())
+        return digest.hexdigest()
     
-    # Convert back to tensor if needed
-    if isinstance(activation_map, torch.Tensor):
-        return torch.from_numpy(smoothed).float()
-    return smoothed
-
-def get_attention_contours(activation_map, threshold=0.7):
-    """Get contours for top-attention regions."""
-    try:
-        from scipy import ndimage
-        from skimage import measure
-    except ImportError:
-        # Fallback if skimage not available
-        print("⚠️  skimage not available, skipping contours")
-        return []
-    
-    # Normalize
-    if isinstance(activation_map, torch.Tensor):
-        activation_np = activation_map.numpy()
-    else:
-        activation_np = activation_map
+    @contextlib.asynccontextmanager
+    async def lock(self, key):
+        """Serialize work on one key so identical in-flight requests share one computation."""
+        entry = self._key_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        waited = entry[0].locked()
+        try:
+            async with entry[0]:
+                if waited:
+                    self.counters["coalesced"] += 1
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._key_locks[key]
     
-    if activation_np.max() > 0:
-        normalized = activation_np / activation_np.max()
-    else:
-        normalized = activation_np
+    def get(self, key):
+        """Cached record for `key` (memory first, then disk), or None."""
+        with self._lock:
+            record = self._entries.get(key)
+            if record is not None:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return record
+        
+        record = self._load_from_disk(key)
+        if record is not None:
+            self.counters["disk_hits"] += 1
+            self._store(key, record)
+            return record
+        
+        self.counters["misses"] += 1
+        return None
     
-    # Threshold to get top-attention regions
-    binary = (normalized > threshold).astype(np.uint8)
+    def put(self, key, record):
+        self._store(key, record)
+        self._write_to_disk(key, record)
     
-    # Find contours
-    try:
-        contours = measure.find_contours(binary, 0.5)
-        return contours
-    except Exception as e:
-        print(f"Contour detection error: {e}")
-        return []
-
-def blend_heatmap(original_pil, activation_map, alpha=0.4, smooth=True, sigma=2.0, 
-                  show_contours=True, contour_threshold=0.7, colormap='jet'):
-    """Blend activation map with original image using vivid colormap and optional contours."""
-    import matplotlib.cm as cm
-    import matplotlib.pyplot as plt
-    from PIL import ImageDraw
-    
-    # Normalize activation map
-    if activation_map.max() > 0:
-        activation_map = activation_map / activation_map.max()
-    else:
-        activation_map = torch.zeros_like(activation_map)
-    
-    # Smooth the activation map for continuous heatmap look
-    if smooth:
-        activation_map = smooth_activation_map(activation_map, sigma=sigma)
-        # Re-normalize after smoothing
-        if activation_map.max() > 0:
-            activation_map = activation_map / activation_map.max()
-    
-    # Convert to numpy
-    activation_np = activation_map.numpy()
-    
-    # Apply vivid colormap (jet, plasma, or magma)
-    if colormap == 'jet':
-        cmap = cm.jet
-    elif colormap == 'plasma':
-        cmap = cm.plasma
-    elif colormap == 'magma':
-        cmap = cm.magma
-    else:
-        cmap = cm.jet
+    def _store(self, key, record):
+        size = _nbytes(record)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = record
+            self._sizes[key] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(evicted)
+                self.counters["evictions"] += 1
     
-    heatmap = cmap(activation_np)[:, :, :3]  # vivid colormap
-    heatmap = (heatmap * 255).astype("uint8")
-    heatmap_img = Image.fromarray(heatmap).resize(original_pil.size, Image.LANCZOS)
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pt")
     
-    # Blend with original image
-    result = Image.blend(original_pil.convert("RGB"), heatmap_img, alpha=alpha)
+    def _load_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            record = torch.load(path, map_location="cpu", weights_only=True)
+            os.utime(path)  # Refresh LRU position on disk
+            return record
+        except Exception as e:
+            print(f"⚠️  Could not read cached result {path}: {e}")
+            return None
     
-    # Add contour overlays for top-attention spots
-    if show_contours:
+    def _write_to_disk(self, key, record):
+        if not self.disk_dir:
+            return
         try:
-            contours = get_attention_contours(activation_map, threshold=contour_threshold)
-            
-            # Create a drawing context
-            draw = ImageDraw.Draw(result)
-            
-            # Scale contours to image size
-            scale_x = original_pil.size[0] / activation_np.shape[1]
-            scale_y = original_pil.size[1] / activation_np.shape[0]
-            
-            # Draw contours
-            for contour in contours:
-                if len(contour) > 2:
-                    points = []
-                    for point in contour:
-                        x = int(point[1] * scale_x)
-                        y = int(point[0] * scale_y)
-                        points.append((x, y))
-                    
-                    # Draw contour lines
-                    for i in range(len(points) - 1):
-                        draw.line([points[i], points[i+1]], fill=(255, 255, 0), width=2)
+            tmp_path = self._disk_path(key) + ".tmp"
+            torch.save(record, tmp_path)
+            os.replace(tmp_path, self._disk_path(key))
+            self.counters["disk_writes"] += 1
+            self._trim_disk()
         except Exception as e:
-            print(f"Contour drawing error: {e}")
-            # Continue without contours if there's an error
+            print(f"⚠️  Could not write cached result for {key[:12]}: {e}")
+    
+    def _trim_disk(self):
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".pt"):
+                path = os.path.join(self.disk_dir, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.counters["disk_evictions"] += 1
+            except OSError:
+                pass
     
-    return result
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_enabled": bool(self.disk_dir),
+                "in_flight_keys": len(self._key_locks),
+                **self.counters
+            }
+
+result_cache = ResultCache(
+    RESULT_CACHE_BYTES,
+    disk_dir=RESULT_CACHE_DIR if RESULT_CACHE_DISK else None,
+    disk_max_bytes=RESULT_CACHE_DISK_BYTES
+)
 
 # ------------------------------------------------------------
-# UNCERTAINTY ESTIMATION
+# ARTIFACT STORE
 # ------------------------------------------------------------
-def estimate_uncertainty(model, input_tensor, num_samples=NUM_MC_SAMPLES):
-    """Estimate prediction uncertainty using Monte Carlo Dropout."""
-    predictions = []
+ARTIFACT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+class ArtifactStore:
+    """Short-lived, byte-bounded sessions behind lazy /predict artifacts, /rerender and previews."""
     
-    # For TorchScript models, we'll use multiple forward passes with slight noise
-    with torch.no_grad():
-        for _ in range(num_samples):
-            # Add small noise to simulate uncertainty
-            noisy_input = input_tensor + torch.randn_like(input_tensor) * 0.01
-            output = F.softmax(model(noisy_input), dim=1)
-            predictions.append(output)
+    def __init__(self, ttl_s, max_bytes, disk_dir=None):
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._last_disk_purge = 0.0
+        self.counters = {"created": 0, "expired": 0, "evictions": 0, "disk_loads": 0}
+        if self.disk_dir:
+            # Uploads and specs are also written here, so any pre-forked worker can serve a session
+            os.makedirs(self.disk_dir, exist_ok=True)
     
-    predictions = torch.stack(predictions)
-    mean_pred = predictions.mean(dim=0)
-    std_pred = predictions.std(dim=0)
+    def create(self, file_bytes, spec, inputs=None, maps=None):
+        """Open a session and return its artifact id."""
+        artifact_id = uuid.uuid4().hex
+        expires = time.time() + self.ttl_s
+        session = self._session(file_bytes, spec, expires)
+        session["inputs"], session["maps"] = inputs, maps
+        self._store(artifact_id, session)
+        self.counters["created"] += 1
+        self._write_to_disk(artifact_id, file_bytes, spec, expires)
+        return artifact_id
     
-    # Entropy as uncertainty measure
-    entropy = -torch.sum(mean_pred * torch.log(mean_pred + 1e-8), dim=1)
-    uncertainty = float(entropy.item())
+    def get(self, artifact_id):
+        """Live session for `artifact_id` (memory first, then disk), or None."""
+        if not ARTIFACT_ID_PATTERN.match(artifact_id):
+            return None
+        with self._lock:
+            session = self._sessions.get(artifact_id)
+            if session is not None:
+                self._sessions.move_to_end(artifact_id)
+        if session is None:
+            session = self._load_from_disk(artifact_id)
+            if session is None:
+                return None
+            self.counters["disk_loads"] += 1
+            self._store(artifact_id, session)
+        if session["expires"] <= time.time():
+            self.discard(artifact_id)
+            self.counters["expired"] += 1
+            return None
+        return session
     
-    return {
-        "mean_confidence": float(mean_pred.max()),
-        "std_confidence": float(std_pred.max()),
-        "entropy": uncertainty,
-        "uncertainty_score": min(uncertainty / np.log(len(CLASS_MAPPING)), 1.0)  # Normalized
-    }
-
-# ------------------------------------------------------------
-# MODEL SELECTION
-# ------------------------------------------------------------
-def get_model(model_name: str):
-    """Get model by name."""
-    if model_name == "deit3":
-        return deit_model
-    elif model_name == "vit":
-        return vit_model
-    elif model_name == "ensemble":
-        return None  # Special handling for ensemble
-    else:
-        return vit_model if vit_model is not None else deit_model
-
-# ------------------------------------------------------------
-# API ENDPOINTS
+    def update(self, artifact_id, session):
+        """Re-account a session after its inputs or rendered artifacts changed."""
+        self._store(artifact_id, session)
+    
+    def discard(self, artifact_id):
+        with self._lock:
+            if artifact_id in self._sessions:
+                del self._sessions[artifact_id]
+                self._bytes -= self._sizes.pop(artifact_id)
+        if self.disk_dir:
+            for path in self._disk_paths(artifact_id):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+    
+    @staticmethod
+    def _session(file_bytes, spec, expires):
+        return {
+            "file_bytes": file_bytes,
+            "spec": spec,
+            "expires": expires,
+            "inputs": None,  # (PreparedImage, tensor), decoded on first use
+            "maps": None,  # Raw activation maps; the result cache holds them too
+            "rendered": {},
+            "lock": asyncio.Lock()
+        }
+    
+    def _store(self, artifact_id, session):
+        size = _nbytes({k: v for k, v in session.items() if k != "lock"})
+        with self._lock:
+            if artifact_id in self._sessions:
+                self._bytes -= self._sizes.pop(artifact_id)
+                del self._sessions[artifact_id]
+            self._sessions[artifact_id] = session
+            self._sizes[artifact_id] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                evicted, _ = self._sessions.popitem(last=False)
+                self._bytes -= self._sizes.pop(evicted)
+                self.counters["evictions"] += 1
+    
+    def _disk_paths(self, artifact_id):
+        base = os.path.join(self.disk_dir, artifact_id)
+        return base + ".json", base + ".bin"
+    
+    def _write_to_disk(self, artifact_id, file_bytes, spec, expires):
+        if not self.disk_dir:
+            return
+        spec_path, bytes_path = self._disk_paths(artifact_id)
+        try:
+            with open(bytes_path, "wb") as f:
+                f.write(file_bytes)
+            # The spec is written last, so a readable spec implies a complete upload
+            with open(spec_path + ".tmp", "w") as f:
+                json.dump({"spec": spec, "expires": expires}, f)
+            os.replace(spec_path + ".tmp", spec_path)
+        except OSError as e:
+            print(f"⚠️  Could not persist artifact session {artifact_id}: {e}")
+        self._purge_disk()
+    
+    def _load_from_disk(self, artifact_id):
+        if not self.disk_dir:
+            return None
+        spec_path, bytes_path = self._disk_paths(artifact_id)
+        try:
+            with open(spec_path) as f:
+                stored = json.load(f)
+            with open(bytes_path, "rb") as f:
+                file_bytes = f.read()
+        except (OSError, ValueError):
+            return None
+        return self._session(file_bytes, stored["spec"], stored["expires"])
+    
+    def _purge_disk(self):
+        """Remove expired session files, at most once a minute."""
+        now = time.time()
+        if now - self._last_disk_purge < 60:
+            return
+        self._last_disk_purge = now
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            with contextlib.suppress(OSError):
+                if os.stat(path).st_mtime + self.ttl_s < now:
+                    os.remove(path)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s,
+                "disk_enabled": bool(self.disk_dir),
+                **self.counters
+            }
+
+artifact_store = ArtifactStore(ARTIFACT_TTL_S, ARTIFACT_STORE_BYTES, disk_dir=ARTIFACT_DIR or None)
+preview_store = ArtifactStore(
+    PREVIEW_TTL_S, PREVIEW_STORE_BYTES,
+    disk_dir=os.path.join(ARTIFACT_DIR, "previews") if ARTIFACT_DIR else None
+)
+
+# ------------------------------------------------------------
+# REQUEST PIPELINE
+# ------------------------------------------------------------
+class ServerBusy(Exception):
+    """Raised when a request cannot get a CPU slot; mapped to 429/503 with Retry-After."""
+    
+    def __init__(self, message, status_code=503):
+        super().__init__(message)
+        self.status_code = status_code
+
+class AdmissionController:
+    """Bounds how many requests run at once (429 past `max_queued` waiting, 503 after `timeout`)."""
+    
+    def __init__(self, max_concurrent, max_queued, timeout):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queued = max(0, int(max_queued))
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timed_out = 0
+    
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self.waiting >= self.max_queued:
+            self.rejected += 1
+            raise ServerBusy("Server is busy, please retry shortly.", status_code=429)
+        
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise ServerBusy("Timed out waiting for a free worker, please retry shortly.", status_code=503)
+        finally:
+            self.waiting -= 1
+        
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+    
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "queue_timeout_s": self.timeout,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out
+        }
+
+cpu_executor = concurrent.futures.ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu-stage")
+# PIL releases the GIL while encoding, so one request's overlays encode in parallel
+encode_executor = concurrent.futures.ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+admission = AdmissionController(MAX_CONCURRENT_JOBS, MAX_QUEUED_JOBS, QUEUE_TIMEOUT_S)
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a CPU-bound stage on the dedicated executor instead of the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, functools.partial(fn, *args, **kwargs))
+
+def busy_response(error):
+    return JSONResponse(
+        {"error": str(error)},
+        status_code=error.status_code,
+        headers={"Retry-After": str(RETRY_AFTER_S)}
+    )
+
+class ModelUnavailable(Exception):
+    """Raised when the requested model (or every ensemble member) is not loaded; mapped to 503."""
+
+def parse_ensemble_weights(spec, members):
+    """Parse "deit3:0.4,vit:0.6" (base names of `members`) into weights; ValueError for other names or all zeros."""
+    base_names = {int8_base_name(name) for name in members}
+    weights = {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition(":")
+        name = name.strip()
+        if name not in base_names:
+            raise ValueError(f"{name} is not an ensemble member (expected {', '.join(sorted(base_names))})")
+        weight = float(value)
+        if weight < 0:
+            raise ValueError(f"Ensemble weight for {name} must be non-negative")
+        weights[name] = weight
+    if base_names and all(weights.get(name, 1.0) == 0 for name in base_names):
+        raise ValueError("Ensemble weights must not all be zero")
+    return weights
+
+def _timed_submit(model_name, tensor, timings):
+    """Submit inference and record its submit-to-result latency in `timings` (ms)."""
+    submitted = time.perf_counter()
+    future = submit_inference(model_name, tensor)
+    
+    def record(_):
+        latency = round((time.perf_counter() - submitted) * 1000, 2)
+        timings[model_name] = latency
+        first_request_ms.setdefault(model_name, latency)
+    
+    future.add_done_callback(record)
+    return future
+
+async def classify(model_name, tensor, weights=None):
+    """Softmax, per-model outputs and latencies (ms) for `model_name`; ensembles run their members concurrently."""
+    timings = {}
+    if model_name in ENSEMBLES:
+        # Submit to every model worker before awaiting so they run concurrently
+        pending = [
+            (name, _timed_submit(name, tensor, timings))
+            for name in ENSEMBLES[model_name] if get_model(name) is not None
+        ]
+        
+        if not pending:
+            raise ModelUnavailable("No models available.")
+        
+        results = await asyncio.gather(*(asyncio.wrap_future(fut) for _, fut in pending))
+        outputs = [(name, out) for (name, _), out in zip(pending, results)]
+        
+        # Ensemble (weighted) average; weights are keyed by base name, so "vit" also weighs "vit-int8"
+        weights = weights or {}
+        model_weights = [weights.get(int8_base_name(name), 1.0) for name, _ in outputs]
+        if sum(model_weights) <= 0:
+            raise ModelUnavailable("Every available ensemble member has zero weight")
+        probs = sum(w * out for w, (_, out) in zip(model_weights, outputs)) / sum(model_weights)
+        return probs, {name: out for name, out in outputs}, timings
+    
+    if get_model(model_name) is None:
+        raise ModelUnavailable(f"Model {model_name} not available.")
+    # Unknown names fall back to the default model; run on that model's worker
+    model_key = model_name if model_name.endswith("-int8") else base_model_name(model_name)
+    output = await asyncio.wrap_future(_timed_submit(model_key, tensor, timings))
+    timings = {model_name: timings.get(model_key)}
+    return output, {model_name: output}, timings
+
+def prediction_summary(probs, model_outputs, model_timings=None, class_names=CLASS_MAPPING):
+    """Predicted class, confidence, top-3 and per-model metrics of a classification."""
+    model_timings = model_timings or {}
+    pred_idx = int(probs.argmax())
+    
+    # Top 3 predictions
+    topk_idx = probs.topk(min(3, len(class_names))).indices[0].cpu().numpy()
+    top3 = [
+        {"class": class_names[int(i)], "confidence": float(probs[0][i])}
+        for i in topk_idx
+    ]
+    
+    # Model performance metrics
+    model_metrics = {}
+    for model_name, output in model_outputs.items():
+        model_pred = int(output.argmax())
+        model_conf = float(output.max())
+        model_metrics[model_name] = {
+            "predicted_class": class_names[model_pred],
+            "confidence": round(model_conf * 100, 2),
+            "latency_ms": model_timings.get(model_name)
+        }
+    
+    return {
+        "predicted_class": class_names[pred_idx],
+        "confidence": round(float(probs.max()) * 100, 2),
+        "top3": top3,
+        "model_metrics": model_metrics
+    }
+
+def merge_computation_stats(total, stats):
+    """Accumulate the pass and stage counters of one compute_activation_maps call."""
+    total = total or {"passes": {"forward": 0, "backward": 0}, "stages": {}}
+    if stats:
+        for name, count in stats["passes"].items():
+            total["passes"][name] = total["passes"].get(name, 0) + count
+        for stage, counters in stats["stages"].items():
+            merged = total["stages"].setdefault(stage, {"computed": 0, "cached": 0})
+            for name, count in counters.items():
+                merged[name] += count
+    return total
+
+def activation_maps_missing(maps, use_multilayer=False, use_attention_rollout=False, generate_mask=False):
+    """Whether any requested activation map is absent from `maps`."""
+    return (
+        "gradcam" not in maps
+        or (use_multilayer and "multilayer" not in maps)
+        or (use_attention_rollout and "attention_rollout" not in maps)
+        or (generate_mask and "mask_regions" not in maps)
+    )
+
+def encode_png(img):
+    """Encode a PIL image as PNG bytes."""
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+IMAGE_FORMATS = {"png": ("PNG", "image/png"), "jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+def parse_encoding(image_format="png", image_quality=85, png_compress_level=PNG_COMPRESS_LEVEL, max_image_side=0):
+    """Validated overlay encoding options for `render_explanations`; raises ValueError."""
+    image_format = (image_format or "png").lower()
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"unknown image_format '{image_format}', expected one of {', '.join(IMAGE_FORMATS)}")
+    return dict(
+        image_format=image_format,
+        image_quality=max(1, min(int(image_quality), 95)),
+        png_compress_level=max(0, min(int(png_compress_level), 9)),
+        max_image_side=max(0, int(max_image_side))
+    )
+
+def encode_image(img, image_format="png", image_quality=85, png_compress_level=PNG_COMPRESS_LEVEL,
+                 max_image_side=0):
+    """Encode a PIL image as `(content_type, bytes, stats)`, longest side capped at `max_image_side` (blocking)."""
+    started = time.perf_counter()
+    if max_image_side and max(img.size) > max_image_side:
+        img = img.copy()
+        img.thumbnail((max_image_side, max_image_side), Image.BILINEAR)
+    pil_format, content_type = IMAGE_FORMATS[image_format]
+    if pil_format == "PNG":
+        options = {"compress_level": png_compress_level}
+    else:
+        options = {"quality": image_quality}
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format=pil_format, **options)
+    payload = buf.getvalue()
+    return content_type, payload, {
+        "format": image_format,
+        "width": img.width,
+        "height": img.height,
+        "bytes": len(payload),
+        "encode_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+
+def display_side(max_image_side=0):
+    """Longest side overlays are rendered at: DISPLAY_MAX_SIDE or the request's smaller cap."""
+    sides = [side for side in (DISPLAY_MAX_SIDE, max_image_side) if side]
+    return min(sides) if sides else 0
+
+def encoding_report(encode_stats):
+    """Per-artifact encode stats plus totals, as reported in responses."""
+    return {
+        "artifacts": encode_stats,
+        "total_bytes": sum(stats["bytes"] for stats in encode_stats.values()),
+        "total_encode_ms": round(sum(stats["encode_ms"] for stats in encode_stats.values()), 1)
+    }
+
+def encode_png_base64(img):
+    """Encode a PIL image as a base64 PNG string."""
+    return base64.b64encode(encode_png(img)).decode()
+
+def compute_activation_maps(model_for_cam, tensor, pred_idx, use_multilayer=False,
+                            use_attention_rollout=False, generate_mask=False, maps=None):
+    """Compute the activation maps missing from `maps`, as `(maps, computation_stats)` (blocking)."""
+    maps = dict(maps or {})
+    
+    # Every explainability stage shares one forward/backward through this context, and
+    # the base saliency is kept with the maps so later requests don't recompute it
+    explain_ctx = ExplainContext(model_for_cam, tensor, pred_idx)
+    if maps.get("saliency") is not None:
+        explain_ctx.seed("saliency", maps["saliency"])
+    
+    # Standard Grad-CAM
+    if "gradcam" not in maps:
+        maps["gradcam"] = apply_gradcam(model_for_cam, tensor, pred_idx, ctx=explain_ctx)
+    activation_map = maps["gradcam"]
+    
+    # Multi-layer Grad-CAM
+    if use_multilayer and "multilayer" not in maps:
+        maps["multilayer"] = apply_multilayer_gradcam(model_for_cam, tensor, pred_idx, ctx=explain_ctx)
+    
+    # Attention Rollout (works for any model)
+    if use_attention_rollout and "attention_rollout" not in maps:
+        print("🔄 Computing attention rollout...")
+        try:
+            attention_map = apply_attention_rollout(model_for_cam, tensor, ctx=explain_ctx)
+            
+            if attention_map is not None and attention_map.max() > 0:
+                print("✅ Attention rollout generated successfully")
+            else:
+                print("⚠️  Attention rollout returned empty map, using Grad-CAM")
+                # Fallback to regular Grad-CAM
+                attention_map = activation_map
+        except Exception as e:
+            print(f"❌ Attention rollout failed: {e}, using Grad-CAM fallback")
+            import traceback
+            traceback.print_exc()
+            # Fallback to regular Grad-CAM
+            attention_map = activation_map
+        maps["attention_rollout"] = attention_map
+    
+    # Lesion mask
+    if generate_mask and "mask" not in maps:
+        maps["mask"], maps["mask_overlay_alpha"] = _lesion_mask_with_fallback(activation_map)
+    if generate_mask and "mask_regions" not in maps:
+        maps["mask_regions"] = lesion_regions(maps["mask"], activation_map) if maps["mask"] is not None else []
+    
+    if explain_ctx.cached("saliency") is not None:
+        maps["saliency"] = explain_ctx.cached("saliency")
+    
+    computation_stats = explain_ctx.stats()
+    passes = computation_stats["passes"]
+    print(f"📊 Explainability passes: {passes['forward']} forward, {passes['backward']} backward")
+    
+    return maps, computation_stats
+
+def _lesion_mask_with_fallback(activation_map):
+    """Lesion mask tensor and the overlay alpha to draw it with, or (None, None)."""
+    try:
+        # Use improved mask generation with optimized threshold for professional results
+        mask = generate_lesion_mask(
+            activation_map,
+            threshold=0.35,  # More conservative threshold for cleaner results
+            smooth=True,     # Smooth to remove grid artifacts
+            use_morphology=True  # Apply morphological filtering and noise removal
+        )
+        if not isinstance(mask, torch.Tensor):
+            mask = torch.from_numpy(mask).float()
+        
+        # Ensure mask is 2D
+        mask = mask.squeeze()
+        
+        # Calculate coverage for logging
+        coverage = float(mask.clamp(0, 1).mean()) * 100
+        print(f"✅ Professional lesion mask generated successfully: {coverage:.2f}% coverage")
+        return mask, 0.45  # Semi-transparent red overlay
+    
+    except Exception as e:
+        print(f"❌ Lesion mask generation failed: {e}")
+        import traceback
+        traceback.print_exc()
+        # Create a fallback mask showing activation regions
+        try:
+            activation_np = activation_map.numpy() if isinstance(activation_map, torch.Tensor) else activation_map
+            if activation_np.max() > activation_np.min():
+                # Normalize and threshold
+                activation_normalized = (activation_np - activation_np.min()) / (activation_np.max() - activation_np.min())
+                # Use higher threshold for fallback
+                fallback_mask = (activation_normalized > 0.5).astype(np.float32)
+                return torch.from_numpy(fallback_mask), 0.4
+        except Exception as fallback_error:
+            print(f"❌ Fallback mask generation also failed: {fallback_error}")
+        return None, None
+
+def artifact_kinds(use_multilayer=False, use_attention_rollout=False, generate_mask=False):
+    """Names of the overlay artifacts a request asks for, in response order."""
+    kinds = ["gradcam"]
+    if use_multilayer:
+        kinds += [f"multilayer/{layer}" for layer in MULTILAYER_LAYERS]
+    if use_attention_rollout:
+        kinds.append("attention_rollout")
+    if generate_mask:
+        kinds.append("mask")
+    return kinds
+
+def artifact_map_flags(kind):
+    """compute_activation_maps flags needed to produce artifact `kind`."""
+    return {
+        "use_multilayer": kind.startswith("multilayer/"),
+        "use_attention_rollout": kind == "attention_rollout",
+        "generate_mask": kind in ("mask", "lesion_regions")
+    }
+
+def activation_map_for(maps, kind):
+    """The raw map behind artifact `kind` (`multilayer/<layer>` looks up one layer), or None."""
+    if kind.startswith("multilayer/"):
+        return (maps.get("multilayer") or {}).get(kind.split("/", 1)[1])
+    return maps.get(kind)
+
+RAW_MAP_DTYPES = ("uint8", "float16")
+RAW_MAP_COMPRESSIONS = ("none", "zlib")
+
+def encode_raw_maps(maps, kinds, dtype="uint8", compression="none"):
+    """Activation maps and the lesion mask as raw `(descriptors, parts)` for client-side rendering (blocking)."""
+    # Maps are sent unsmoothed, row-major, with no colormap, resize or blend applied
+    descriptors, parts = {}, []
+    for kind in kinds:
+        activation_map = activation_map_for(maps, kind)
+        if activation_map is None:
+            continue
+        if isinstance(activation_map, torch.Tensor):
+            activation_map = activation_map.detach().cpu().numpy()
+        values = np.asarray(activation_map, dtype=np.float32).squeeze()
+        low, high = float(values.min()), float(values.max())
+        if dtype == "uint8":
+            # 0 and 255 are the ends of the map's range
+            span = high - low
+            data = np.rint((values - low) * (255 / span)) if span > 0 else np.zeros_like(values)
+            data = data.astype(np.uint8)
+        else:
+            data = values.astype("<f2")
+        payload = data.tobytes()
+        if compression == "zlib":
+            payload = zlib.compress(payload, 6)
+        descriptors[kind] = {
+            "shape": list(data.shape),
+            "dtype": dtype,
+            "range": [low, high],
+            "compression": None if compression == "none" else compression
+        }
+        parts.append((kind, "application/octet-stream", payload))
+    return descriptors, parts
+
+def render_explanations(maps, image, use_multilayer=False, use_attention_rollout=False,
+                        generate_mask=False, heatmap_alpha=0.4, heatmap_smooth=True, heatmap_sigma=2.0,
+                        heatmap_colormap="jet", show_contours=True, contour_threshold=0.7, kinds=None,
+                        encode_stats=None, **encoding):
+    """Overlay the requested activation maps on one display-resolution copy of the adjusted upload (blocking)."""
+    if kinds is None:
+        kinds = artifact_kinds(use_multilayer, use_attention_rollout, generate_mask)
+    
+    heatmap_style = dict(
+        alpha=heatmap_alpha,
+        smooth=heatmap_smooth,
+        sigma=heatmap_sigma,
+        colormap=heatmap_colormap,
+        show_contours=show_contours,
+        contour_threshold=contour_threshold
+    )
+    pending = []
+    side = display_side(encoding.get("max_image_side", 0))
+    
+    for kind in kinds:
+        if kind == "mask":
+            if maps.get("mask") is None:
+                continue
+            try:
+                # Create professional overlay with contours
+                img = create_professional_mask_overlay(
+                    maps["mask"].numpy(),
+                    image.display_image(side),
+                    overlay_alpha=maps.get("mask_overlay_alpha") or 0.45,
+                    contour_thickness=2,  # Contour line thickness
+                    max_side=side  # Same size as the heatmaps, so the overlays line up
+                )
+            except Exception as e:
+                print(f"❌ Lesion mask overlay failed: {e}")
+                continue
+        else:
+            activation_map = activation_map_for(maps, kind)
+            if activation_map is None:
+                continue
+            if "renderer" not in heatmap_style:
+                # One renderer converts the display copy once and is shared by every heatmap overlay
+                heatmap_style["renderer"] = OverlayRenderer(image.display_image(side), alpha=heatmap_alpha)
+            img = blend_heatmap(image.display_image(side), activation_map, **heatmap_style)
+        # Encoded on its own pool while the next overlay renders
+        pending.append((kind, encode_executor.submit(encode_image, img, **encoding)))
+    
+    parts = []
+    for kind, future in pending:
+        content_type, payload, stats = future.result()
+        parts.append((kind, content_type, payload))
+        if encode_stats is not None:
+            encode_stats[kind] = stats
+    return parts
+
+def explanations_json(parts):
+    """Artifact parts as the base64 fields of the JSON /predict response."""
+    fields = {
+        "gradcam_base64": None,
+        "attention_rollout_base64": None,
+        "mask_base64": None,
+        "multilayer_gradcam": None
+    }
+    for name, _, payload in parts:
+        encoded = base64.b64encode(payload).decode()
+        if name.startswith("multilayer/"):
+            fields["multilayer_gradcam"] = fields["multilayer_gradcam"] or {}
+            fields["multilayer_gradcam"][name.split("/", 1)[1]] = encoded
+        else:
+            fields[f"{name}_base64"] = encoded
+    return fields
+
+LAZY_ARTIFACT_KINDS = set(artifact_kinds(True, True, True)) | {"lesion_regions"}
+
+async def session_inputs(session):
+    """`(PreparedImage, tensor)` of an ArtifactStore session, prepared on first use."""
+    if session["inputs"] is None:
+        session["inputs"] = await run_blocking(
+            preprocess_image_custom, session["file_bytes"], **session["spec"]["preprocessing"]
+        )
+    return session["inputs"]
+
+async def session_activation_maps(session, use_multilayer=False, use_attention_rollout=False,
+                                  generate_mask=False):
+    """Activation maps of an ArtifactStore session: its own, then the result cache, then one explainability pass for the rest."""
+    flags = dict(use_multilayer=use_multilayer, use_attention_rollout=use_attention_rollout,
+                 generate_mask=generate_mask)
+    if session["maps"] is not None and not activation_maps_missing(session["maps"], **flags):
+        return session["maps"]
+    
+    spec = session["spec"]
+    cache_key = spec["cache_key"]
+    async with result_cache.lock(cache_key):
+        cached = await run_blocking(result_cache.get, cache_key)
+        record = dict(cached) if cached is not None else {}
+        if activation_maps_missing(record.get("maps") or {}, **flags):
+            _, tensor = await session_inputs(session)
+            await ensure_models(spec["model"])
+            model_for_cam = explain_model_for(spec["model"])
+            if model_for_cam is None:
+                raise ModelUnavailable("No model is available for explainability")
+            record["maps"], _ = await run_blocking(
+                compute_activation_maps, model_for_cam, tensor, spec["pred_idx"],
+                maps=record.get("maps") or session["maps"], **flags
+            )
+            await run_blocking(result_cache.put, cache_key, record)
+    session["maps"] = record["maps"]
+    return session["maps"]
+
+async def compute_artifact(session, kind):
+    """Compute one lazy artifact of an ArtifactStore session as `(content_type, bytes)`."""
+    maps = await session_activation_maps(session, **artifact_map_flags(kind))
+    if kind == "lesion_regions":
+        return "application/json", json.dumps(maps.get("mask_regions") or []).encode()
+    
+    image, _ = await session_inputs(session)
+    spec = session["spec"]
+    parts = await run_blocking(
+        render_explanations, maps, image, kinds=[kind], **spec["style"], **spec.get("encoding", {})
+    )
+    if not parts:
+        raise ValueError(f"Artifact '{kind}' could not be generated")
+    _, content_type, payload = parts[0]
+    return content_type, payload
+
+BATCH_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+def upload_size(upload):
+    """Size in bytes of an uploaded file."""
+    if upload.size is not None:
+        return upload.size
+    upload.file.seek(0, os.SEEK_END)
+    return upload.file.tell()
+
+def iter_batch_sources(files):
+    """`(filename, read)` pairs for every image of a /predict/batch request, reading one image per `read()`."""
+    for upload in files:
+        upload.file.seek(0)
+        if zipfile.is_zipfile(upload.file):
+            upload.file.seek(0)
+            archive = zipfile.ZipFile(upload.file)
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/") or not name.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                    continue
+                if info.file_size > MAX_BATCH_ENTRY_BYTES:
+                    yield name, functools.partial(_oversized_entry, info.file_size)
+                    continue
+                yield name, functools.partial(archive.read, info)
+        elif upload_size(upload) > MAX_BATCH_ENTRY_BYTES:
+            yield upload.filename, functools.partial(_oversized_entry, upload_size(upload))
+        else:
+            upload.file.seek(0)
+            yield upload.filename, upload.file.read
+
+def _oversized_entry(size):
+    raise ValueError(f"Image is {size} bytes, above the {MAX_BATCH_ENTRY_BYTES} byte limit")
+
+def decode_batch_images(sources):
+    """Preprocess `(index, filename, read)` sources into `(index, filename, tensor or exception)` (blocking)."""
+    decoded = []
+    for index, filename, read in sources:
+        try:
+            _, tensor = preprocess_image_custom(read())
+            decoded.append((index, filename, tensor))
+        except Exception as e:
+            decoded.append((index, filename, e))
+    return decoded
+
+def spool_upload_to_disk(upload, directory="uploads"):
+    """Copy an upload to a named temporary file for decoders that need a path (blocking)."""
+    os.makedirs(directory, exist_ok=True)
+    suffix = os.path.splitext(upload.filename or "")[1]
+    upload.file.seek(0)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=suffix, delete=False) as f:
+        shutil.copyfileobj(upload.file, f, 1024 * 1024)
+        return f.name
+
+def close_video(sampler, path):
+    """Release a FrameSampler and delete its temporary file (blocking)."""
+    try:
+        if sampler is not None:
+            sampler.close()
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+def render_preprocessed_preview(file_bytes, brightness=1.0, contrast=1.0, rotation=0,
+                                flip_h=False, flip_v=False, enhance=False, sharpen=False):
+    """Preprocessed image as a base64 PNG for the /preprocess preview (blocking)."""
+    image = PreparedImage(
+        file_bytes, brightness=brightness, contrast=contrast, rotation=rotation,
+        flip_h=flip_h, flip_v=flip_v, enhance=enhance, sharpen=sharpen
+    )
+    return encode_png_base64(image.display_image())
+
+PREVIEW_FORMATS = {name: IMAGE_FORMATS[name] for name in ("jpeg", "webp")}
+
+def render_session_preview(session, max_side, image_format="jpeg", quality=PREVIEW_QUALITY, **adjustments):
+    """Preview of a /preprocess session as `(content_type, bytes)` from its working copy (blocking)."""
+    working, _ = session["inputs"]
+    # Downscaled once per size, so each slider change only adjusts and encodes a small image
+    base = session["rendered"].get(max_side)
+    if base is None:
+        base = working.copy()
+        base.thumbnail((max_side, max_side))
+        session["rendered"] = {max_side: base}
+    img = adjust_image(base, **adjustments)
+    img.thumbnail((max_side, max_side))  # Rotation expands the canvas
+    pil_format, content_type = PREVIEW_FORMATS[image_format]
+    buf = io.BytesIO()
+    img.save(buf, format=pil_format, quality=quality)
+    return content_type, buf.getvalue()
+
+def build_report_pdf(data):
+    """Render the PDF explainability report for a /predict result (blocking)."""
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4)
+    story = []
+    styles = getSampleStyleSheet()
+    
+    # Title
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#f97316'),
+        spaceAfter=30,
+        alignment=TA_CENTER
+    )
+    story.append(Paragraph("GI Endoscopy AI Diagnostic Report", title_style))
+    story.append(Spacer(1, 0.2*inch))
+    
+    # Diagnosis
+    story.append(Paragraph(f"<b>Predicted Condition:</b> {data.get('predicted_class', 'N/A').replace('-', ' ').title()}", styles['Normal']))
+    story.append(Paragraph(f"<b>Confidence:</b> {data.get('confidence', 0)}%", styles['Normal']))
+    story.append(Spacer(1, 0.2*inch))
+    
+    # Top 3 predictions
+    story.append(Paragraph("<b>Top 3 Predictions:</b>", styles['Heading2']))
+    top3_data = [['Rank', 'Condition', 'Confidence']]
+    for idx, pred in enumerate(data.get('top3', []), 1):
+        top3_data.append([str(idx), pred['class'].replace('-', ' ').title(), f"{pred['confidence']*100:.2f}%"])
+    
+    top3_table = Table(top3_data)
+    top3_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(top3_table)
+    story.append(Spacer(1, 0.3*inch))
+    
+    # Uncertainty
+    if data.get('uncertainty'):
+        unc = data['uncertainty']
+        story.append(Paragraph(f"<b>Uncertainty Score:</b> {unc.get('uncertainty_score', 0):.3f}", styles['Normal']))
+        story.append(Paragraph(f"<b>Entropy:</b> {unc.get('entropy', 0):.3f}", styles['Normal']))
+        story.append(Spacer(1, 0.2*inch))
+    
+    # Lesion regions
+    if data.get('lesion_regions'):
+        story.append(Paragraph("<b>Lesion Regions:</b>", styles['Heading2']))
+        region_data = [['Region', 'Area', 'Centroid (x, y)', 'Peak Activation']]
+        for region in data['lesion_regions']:
+            peak = region.get('peak_activation')
+            region_data.append([
+                str(region.get('id', '')),
+                f"{region.get('area_pct', 0):.2f}%",
+                f"({region['centroid'][0]:.2f}, {region['centroid'][1]:.2f})",
+                f"{peak:.2f}" if peak is not None else "N/A"
+            ])
+        region_table = Table(region_data)
+        region_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        story.append(region_table)
+        story.append(Spacer(1, 0.3*inch))
+    
+    # Model metrics
+    if data.get('model_metrics'):
+        story.append(Paragraph("<b>Model Performance:</b>", styles['Heading2']))
+        for model_name, metrics in data['model_metrics'].items():
+            story.append(Paragraph(f"{model_name.upper()}: {metrics['predicted_class']} ({metrics['confidence']}%)", styles['Normal']))
+        story.append(Spacer(1, 0.2*inch))
+    
+    # Timestamp
+    from datetime import datetime
+    story.append(Paragraph(f"<i>Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</i>", styles['Normal']))
+    
+    doc.build(story)
+    buf.seek(0)
+    return buf.getvalue()
+
+load_models()
+
+@app.on_event("startup")
+async def startup():
+    # Threads don't survive fork, so schedulers are started per worker rather than at import
+    init_worker()
+
+# ------------------------------------------------------------
+# API ENDPOINTS
 # ------------------------------------------------------------
 @app.post("/predict")
 async def predict(
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    session_id: str = Form(""),
     model: str = Form("ensemble"),
+    ensemble_weights: str = Form(""),
     use_multilayer: bool = Form(False),
     use_attention_rollout: bool = Form(False),
     use_uncertainty: bool = Form(True),
+    adaptive_uncertainty: bool = Form(False),
     generate_mask: bool = Form(False),
+    lazy_artifacts: bool = Form(False),
+    allow_rerender: bool = Form(False),
+    map_format: str = Form(""),
+    map_compression: str = Form("none"),
     brightness: float = Form(1.0),
     contrast: float = Form(1.0),
     rotation: int = Form(0),
@@ -884,270 +2378,775 @@ async def predict(
     heatmap_sigma: float = Form(2.0),
     heatmap_colormap: str = Form("jet"),
     show_contours: bool = Form(True),
-    contour_threshold: float = Form(0.7)
+    contour_threshold: float = Form(0.7),
+    image_format: str = Form("png"),
+    image_quality: int = Form(85),
+    png_compress_level: int = Form(PNG_COMPRESS_LEVEL),
+    max_image_side: int = Form(0),
+    response_format: str = Form(""),
+    accept: Optional[str] = Header(None)
 ):
-    """Advanced prediction endpoint with all features."""
+    """
+    Advanced prediction endpoint with all features.
+    
+    The response transport is negotiated from the Accept header (see transport.py):
+    JSON with base64 images by default, or multipart/mixed or the binary envelope with
+    raw PNG parts. `response_format` ("json", "multipart", "envelope") overrides it.
+    
+    With `lazy_artifacts` the explainability images are not computed here; the response
+    carries an `artifact_id` and `artifact_urls` served by GET /artifacts/{id}/{kind}.
+    With either that or `allow_rerender`, `result_id` lets POST /rerender restyle the
+    overlays without inference; otherwise nothing is kept after the response.
+    
+    With `map_format` ("uint8" or "float16") the activation maps and lesion mask are
+    returned as raw arrays under `activation_maps` instead of overlay images, optionally
+    compressed (`map_compression`: "zlib"); see `encode_raw_maps`.
+    
+    Overlays are PNG by default; `image_format` (png, jpeg, webp), `image_quality`,
+    `png_compress_level` and `max_image_side` choose their encoding, and the response's
+    `encoding` reports each one's size and encode time.
+    
+    Instead of `file`, `session_id` predicts on the image of a /preprocess/sessions
+    preview session, reusing its decoded working copy.
+    """
     start_time = time.time()
     
-    if not file.content_type or not file.content_type.startswith("image/"):
+    session = None
+    if session_id:
+        session = preview_store.get(session_id)
+        if session is None:
+            return JSONResponse({"error": "Unknown or expired session id"}, status_code=404)
+    elif file is None or not file.content_type or not file.content_type.startswith("image/"):
         return JSONResponse(
             {"error": "Invalid file type. Please upload an image."},
             status_code=400
         )
     
     try:
-        file_bytes = await file.read()
-        
-        # Preprocess with custom adjustments
-        original_img, tensor = preprocess_image_custom(
-            file_bytes, brightness, contrast, rotation, flip_h, flip_v,
-            enhance=enhance, sharpen=sharpen
+        fmt = transport.negotiate(accept, response_format)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    
+    try:
+        weights = {}
+        if model in ENSEMBLES:
+            weights = parse_ensemble_weights(ensemble_weights or ENSEMBLE_WEIGHTS, ENSEMBLES[model])
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid ensemble_weights: {e}"}, status_code=400)
+    
+    if map_format and map_format not in RAW_MAP_DTYPES:
+        return JSONResponse(
+            {"error": f"Unknown map_format '{map_format}', expected one of {', '.join(RAW_MAP_DTYPES)}"},
+            status_code=400
         )
-        
-        # Model selection
-        selected_model = get_model(model)
-        
-        with torch.no_grad():
-            if model == "ensemble":
-                outputs = []
-                if deit_model is not None:
-                    out1 = F.softmax(deit_model(tensor), dim=1)
-                    outputs.append(("deit3", out1))
-                if vit_model is not None:
-                    out2 = F.softmax(vit_model(tensor), dim=1)
-                    outputs.append(("vit", out2))
+    if map_compression not in RAW_MAP_COMPRESSIONS:
+        return JSONResponse(
+            {"error": f"Unknown map_compression '{map_compression}', expected one of {', '.join(RAW_MAP_COMPRESSIONS)}"},
+            status_code=400
+        )
+    if map_format and lazy_artifacts:
+        return JSONResponse({"error": "map_format can't be combined with lazy_artifacts"}, status_code=400)
+    try:
+        encoding = parse_encoding(image_format, image_quality, png_compress_level, max_image_side)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    
+    try:
+        file_bytes = session["file_bytes"] if session is not None else await file.read()
+        
+        async with admission.slot():
+            # Preprocess with custom adjustments
+            image, tensor = await run_blocking(
+                preprocess_image_custom,
+                file_bytes, brightness, contrast, rotation, flip_h, flip_v,
+                enhance=enhance, sharpen=sharpen,
+                source=session["inputs"] if session is not None else None
+            )
+            
+            # Model selection (loads the models on first use)
+            await ensure_models(model)
+            selected_model = get_model(model)
+            model_for_cam = explain_model_for(model)
+            
+            # Results are cached per image content + preprocessing + model
+            preprocessing = dict(
+                brightness=brightness, contrast=contrast, rotation=rotation,
+                flip_h=flip_h, flip_v=flip_v, enhance=enhance, sharpen=sharpen
+            )
+            cache_key = ResultCache.make_key(file_bytes, model, **preprocessing, ensemble_weights=weights,
+                                             model_version=model_version(model))
+            model_timings = {}
+            async with result_cache.lock(cache_key):
+                cached = await run_blocking(result_cache.get, cache_key)
+                record = dict(cached) if cached is not None else {}
+                updated = cached is None
+                
+                if "probs" not in record:
+                    record["probs"], record["model_outputs"], model_timings = await classify(model, tensor, weights)
+                probs = record["probs"]
+                model_outputs = record["model_outputs"]
+                pred_idx = int(probs.argmax())
                 
-                if not outputs:
-                    return JSONResponse(
-                        {"error": "No models available."},
-                        status_code=503
+                # Uncertainty estimation, cached per sampling mode
+                if use_uncertainty and selected_model is not None and \
+                        cached_uncertainty(record, adaptive_uncertainty) is None:
+                    record[uncertainty_field(adaptive_uncertainty)] = await run_blocking(
+                        estimate_uncertainty, selected_model, tensor,
+                        clean_output=probs,
+                        adaptive=adaptive_uncertainty
                     )
+                    updated = True
                 
-                # Ensemble average
-                probs = sum(out for _, out in outputs) / len(outputs)
-                model_outputs = {name: out for name, out in outputs}
-            else:
-                if selected_model is None:
-                    return JSONResponse(
-                        {"error": f"Model {model} not available."},
-                        status_code=503
+                # Grad-CAM activation maps
+                computation_stats = None
+                if not lazy_artifacts and model_for_cam is not None and activation_maps_missing(
+                        record.get("maps") or {}, use_multilayer, use_attention_rollout, generate_mask):
+                    record["maps"], computation_stats = await run_blocking(
+                        compute_activation_maps, model_for_cam, tensor, pred_idx,
+                        use_multilayer=use_multilayer,
+                        use_attention_rollout=use_attention_rollout,
+                        generate_mask=generate_mask,
+                        maps=record.get("maps")
                     )
-                output = F.softmax(selected_model(tensor), dim=1)
-                probs = output
-                model_outputs = {model: output}
-        
-        pred_idx = int(probs.argmax())
-        confidence = float(probs.max())
-        
-        # Uncertainty estimation
-        uncertainty_data = None
-        if use_uncertainty and selected_model is not None:
-            uncertainty_data = estimate_uncertainty(selected_model, tensor)
-        
-        # Grad-CAM visualizations
-        gradcam_base64 = None
-        attention_rollout_base64 = None
-        mask_base64 = None
-        multilayer_maps = {}
-        
-        model_for_cam = selected_model if selected_model is not None else (vit_model if vit_model is not None else deit_model)
-        
-        if model_for_cam is not None:
-            # Standard Grad-CAM
-            activation_map = apply_gradcam(model_for_cam, tensor, pred_idx)
-            overlay_img = blend_heatmap(
-                original_img, activation_map,
-                alpha=heatmap_alpha,
-                smooth=heatmap_smooth,
-                sigma=heatmap_sigma,
-                colormap=heatmap_colormap,
+                    updated = True
+                
+                if updated:
+                    await run_blocking(result_cache.put, cache_key, record)
+            
+            uncertainty_data = cached_uncertainty(record, adaptive_uncertainty) if use_uncertainty else None
+            
+            # Grad-CAM visualizations
+            style = dict(
+                heatmap_alpha=heatmap_alpha,
+                heatmap_smooth=heatmap_smooth,
+                heatmap_sigma=heatmap_sigma,
+                heatmap_colormap=heatmap_colormap,
                 show_contours=show_contours,
                 contour_threshold=contour_threshold
             )
+            artifacts = []
+            raw_maps = None
+            encode_stats = {}
+            if map_format:
+                # Raw arrays only: the client colormaps and blends them itself
+                raw_maps, artifacts = await run_blocking(
+                    encode_raw_maps, record.get("maps") or {},
+                    artifact_kinds(use_multilayer, use_attention_rollout, generate_mask),
+                    map_format, map_compression
+                )
+            elif not lazy_artifacts:
+                artifacts = await run_blocking(
+                    render_explanations, record.get("maps") or {}, image,
+                    use_multilayer=use_multilayer,
+                    use_attention_rollout=use_attention_rollout,
+                    generate_mask=generate_mask,
+                    encode_stats=encode_stats,
+                    **style, **encoding
+                )
             
-            buf = io.BytesIO()
-            overlay_img.save(buf, format="PNG")
-            gradcam_base64 = base64.b64encode(buf.getvalue()).decode()
+            # The session serves lazy artifacts and lets /rerender restyle the maps later
+            result_id = None
+            if lazy_artifacts or allow_rerender:
+                result_id = await run_blocking(artifact_store.create, file_bytes, {
+                    "model": model,
+                    "preprocessing": preprocessing,
+                    "pred_idx": pred_idx,
+                    "cache_key": cache_key,
+                    "style": style,
+                    "encoding": encoding,
+                    "kinds": artifact_kinds(use_multilayer, use_attention_rollout, generate_mask)
+                }, inputs=(image, tensor), maps=record.get("maps"))
             
-            # Multi-layer Grad-CAM
-            if use_multilayer:
-                multilayer_maps_raw = apply_multilayer_gradcam(model_for_cam, tensor, pred_idx)
-                for layer_name, layer_map in multilayer_maps_raw.items():
-                    layer_overlay = blend_heatmap(
-                        original_img, layer_map,
-                        alpha=heatmap_alpha,
-                        smooth=heatmap_smooth,
-                        sigma=heatmap_sigma,
-                        colormap=heatmap_colormap,
-                        show_contours=show_contours,
-                        contour_threshold=contour_threshold
-                    )
-                    buf = io.BytesIO()
-                    layer_overlay.save(buf, format="PNG")
-                    multilayer_maps[layer_name] = base64.b64encode(buf.getvalue()).decode()
+            summary = prediction_summary(probs, model_outputs, model_timings, class_names_for(model))
+            result = {
+                "predicted_class": summary["predicted_class"],
+                "confidence": summary["confidence"],
+                "top3": summary["top3"],
+                "gradcam_base64": None,
+                "inference_time": round(time.time() - start_time, 2),
+                "model_used": model,
+                "model_metrics": summary["model_metrics"],
+                "uncertainty": uncertainty_data,
+                "attention_rollout_base64": None,
+                "mask_base64": None,
+                "lesion_regions": (record.get("maps") or {}).get("mask_regions") if generate_mask and not lazy_artifacts else None,
+                "multilayer_gradcam": None,
+                "computation_stats": computation_stats,
+                "cache": {"hit": cached is not None, "key": cache_key[:16]},
+                "result_id": result_id,
+                "result_ttl_s": artifact_store.ttl_s if result_id else None
+            }
+            if raw_maps is not None:
+                result["activation_maps"] = raw_maps
+            if encode_stats:
+                result["encoding"] = encoding_report(encode_stats)
+            if lazy_artifacts:
+                kinds = artifact_kinds(use_multilayer, use_attention_rollout, generate_mask)
+                if generate_mask:
+                    kinds.append("lesion_regions")
+                result["artifact_id"] = result_id
+                result["artifact_urls"] = {kind: f"/artifacts/{result_id}/{kind}" for kind in kinds}
+                result["artifact_ttl_s"] = artifact_store.ttl_s
             
-            # Attention Rollout (works for any model)
-            if use_attention_rollout:
-                print("🔄 Computing attention rollout...")
-                try:
-                    attention_map = apply_attention_rollout(model_for_cam, tensor)
-                    
-                    if attention_map is not None and attention_map.max() > 0:
-                        attention_overlay = blend_heatmap(
-                            original_img, attention_map,
-                            alpha=heatmap_alpha,
-                            smooth=heatmap_smooth,
-                            sigma=heatmap_sigma,
-                            colormap=heatmap_colormap,
-                            show_contours=show_contours,
-                            contour_threshold=contour_threshold
-                        )
-                        buf = io.BytesIO()
-                        attention_overlay.save(buf, format="PNG")
-                        attention_rollout_base64 = base64.b64encode(buf.getvalue()).decode()
-                        print("✅ Attention rollout generated successfully")
-                    else:
-                        print("⚠️  Attention rollout returned empty map, using Grad-CAM")
-                        # Fallback to regular Grad-CAM
-                        attention_map = apply_gradcam(model_for_cam, tensor, pred_idx)
-                        attention_overlay = blend_heatmap(
-                            original_img, attention_map,
-                            alpha=heatmap_alpha,
-                            smooth=heatmap_smooth,
-                            sigma=heatmap_sigma,
-                            colormap=heatmap_colormap,
-                            show_contours=show_contours,
-                            contour_threshold=contour_threshold
-                        )
-                        buf = io.BytesIO()
-                        attention_overlay.save(buf, format="PNG")
-                        attention_rollout_base64 = base64.b64encode(buf.getvalue()).decode()
-                except Exception as e:
-                    print(f"❌ Attention rollout failed: {e}, using Grad-CAM fallback")
-                    import traceback
-                    traceback.print_exc()
-                    # Fallback to regular Grad-CAM
-                    attention_map = apply_gradcam(model_for_cam, tensor, pred_idx)
-                    attention_overlay = blend_heatmap(
-                        original_img, attention_map,
-                        alpha=heatmap_alpha,
-                        smooth=heatmap_smooth,
-                        sigma=heatmap_sigma,
-                        colormap=heatmap_colormap,
-                        show_contours=show_contours,
-                        contour_threshold=contour_threshold
+            headers = {"Vary": "Accept"}
+            if fmt == transport.MULTIPART:
+                return transport.multipart_response(result, artifacts, headers=headers)
+            if fmt == transport.ENVELOPE:
+                return transport.envelope_response(result, artifacts, headers=headers)
+            if raw_maps is not None:
+                for name, _, payload in artifacts:
+                    raw_maps[name]["data"] = base64.b64encode(payload).decode()
+            else:
+                result.update(explanations_json(artifacts))
+            return JSONResponse(result, headers=headers)
+    
+    except ServerBusy as e:
+        return busy_response(e)
+    except ModelUnavailable as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse(
+            {"error": f"Prediction failed: {str(e)}"},
+            status_code=500
+        )
+
+@app.post("/predict/stream")
+async def predict_stream(
+    file: UploadFile = File(...),
+    model: str = Form("ensemble"),
+    ensemble_weights: str = Form(""),
+    use_multilayer: bool = Form(False),
+    use_attention_rollout: bool = Form(False),
+    use_uncertainty: bool = Form(True),
+    adaptive_uncertainty: bool = Form(False),
+    generate_mask: bool = Form(False),
+    brightness: float = Form(1.0),
+    contrast: float = Form(1.0),
+    rotation: int = Form(0),
+    flip_h: bool = Form(False),
+    flip_v: bool = Form(False),
+    enhance: bool = Form(False),
+    sharpen: bool = Form(False),
+    heatmap_alpha: float = Form(0.4),
+    heatmap_smooth: bool = Form(True),
+    heatmap_sigma: float = Form(2.0),
+    heatmap_colormap: str = Form("jet"),
+    show_contours: bool = Form(True),
+    contour_threshold: float = Form(0.7),
+    image_format: str = Form("png"),
+    image_quality: int = Form(85),
+    png_compress_level: int = Form(PNG_COMPRESS_LEVEL),
+    max_image_side: int = Form(0)
+):
+    """
+    /predict as Server-Sent Events, emitted as each stage finishes.
+    
+    Events: `prediction` (class, top-3, per-model metrics), `uncertainty`, one `artifact`
+    per overlay (gradcam, multilayer/<layer>, attention_rollout, mask with its
+    lesion_regions, each with its `encoding` stats), then `done`, or `error`. If the client disconnects the stream is
+    cancelled and the remaining stages never run.
+    
+    Each stage holds an admission slot and the result-cache key lock only while it
+    computes; both are released before its event is sent.
+    """
+    start_time = time.time()
+    
+    if not file.content_type or not file.content_type.startswith("image/"):
+        return JSONResponse(
+            {"error": "Invalid file type. Please upload an image."},
+            status_code=400
+        )
+    
+    try:
+        weights = {}
+        if model in ENSEMBLES:
+            weights = parse_ensemble_weights(ensemble_weights or ENSEMBLE_WEIGHTS, ENSEMBLES[model])
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid ensemble_weights: {e}"}, status_code=400)
+    
+    try:
+        encoding = parse_encoding(image_format, image_quality, png_compress_level, max_image_side)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    
+    file_bytes = await file.read()
+    preprocessing = dict(
+        brightness=brightness, contrast=contrast, rotation=rotation,
+        flip_h=flip_h, flip_v=flip_v, enhance=enhance, sharpen=sharpen
+    )
+    style = dict(
+        heatmap_alpha=heatmap_alpha,
+        heatmap_smooth=heatmap_smooth,
+        heatmap_sigma=heatmap_sigma,
+        heatmap_colormap=heatmap_colormap,
+        show_contours=show_contours,
+        contour_threshold=contour_threshold
+    )
+    
+    async def events():
+        record = {}
+        cache_key = None
+        
+        async def cached_stage(update):
+            """Run `update(record)` under a slot and the cache-key lock, both released before the caller yields."""
+            nonlocal record
+            async with admission.slot():
+                async with result_cache.lock(cache_key):
+                    cached = await run_blocking(result_cache.get, cache_key)
+                    # Identical requests may have added to the record since the last stage
+                    record = {**record, **(cached or {})}
+                    if await update(record):
+                        await run_blocking(result_cache.put, cache_key, record)
+            return cached is not None
+        
+        try:
+            async with admission.slot():
+                image, tensor = await run_blocking(preprocess_image_custom, file_bytes, **preprocessing)
+                await ensure_models(model)
+            selected_model = get_model(model)
+            model_for_cam = explain_model_for(model)
+            cache_key = ResultCache.make_key(file_bytes, model, **preprocessing, ensemble_weights=weights,
+                                             model_version=model_version(model))
+            
+            # Diagnosis first: a single forward pass per model
+            model_timings = {}
+            
+            async def diagnose(record):
+                nonlocal model_timings
+                if "probs" in record:
+                    return False
+                record["probs"], record["model_outputs"], model_timings = await classify(model, tensor, weights)
+                return True
+            
+            hit = await cached_stage(diagnose)
+            probs = record["probs"]
+            pred_idx = int(probs.argmax())
+            yield transport.sse_event("prediction", {
+                **prediction_summary(probs, record["model_outputs"], model_timings, class_names_for(model)),
+                "model_used": model,
+                "cache": {"hit": hit, "key": cache_key[:16]},
+                "elapsed": round(time.time() - start_time, 3)
+            })
+            
+            if use_uncertainty and selected_model is not None:
+                async def add_uncertainty(record):
+                    if cached_uncertainty(record, adaptive_uncertainty) is not None:
+                        return False
+                    record[uncertainty_field(adaptive_uncertainty)] = await run_blocking(
+                        estimate_uncertainty, selected_model, tensor,
+                        clean_output=probs,
+                        adaptive=adaptive_uncertainty
                     )
-                    buf = io.BytesIO()
-                    attention_overlay.save(buf, format="PNG")
-                    attention_rollout_base64 = base64.b64encode(buf.getvalue()).decode()
+                    return True
+                
+                await cached_stage(add_uncertainty)
+                yield transport.sse_event("uncertainty", cached_uncertainty(record, adaptive_uncertainty))
             
-            # Lesion mask - Professional visualization
-            if generate_mask:
-                try:
-                    # Use improved mask generation with optimized threshold for professional results
-                    mask = generate_lesion_mask(
-                        activation_map,
-                        threshold=0.35,  # More conservative threshold for cleaner results
-                        smooth=True,     # Smooth to remove grid artifacts
-                        use_morphology=True  # Apply morphological filtering and noise removal
+            # One artifact at a time; the saliency kept with the maps is shared by all
+            computation_stats = None
+            kinds = artifact_kinds(use_multilayer, use_attention_rollout, generate_mask)
+            for kind in kinds if model_for_cam is not None else []:
+                flags = artifact_map_flags(kind)
+                
+                async def add_maps(record):
+                    nonlocal computation_stats
+                    if not activation_maps_missing(record.get("maps") or {}, **flags):
+                        return False
+                    record["maps"], stats = await run_blocking(
+                        compute_activation_maps, model_for_cam, tensor, pred_idx,
+                        maps=record.get("maps"), **flags
                     )
-                    
-                    # Convert to numpy if tensor
-                    if isinstance(mask, torch.Tensor):
-                        mask_np = mask.numpy()
-                    else:
-                        mask_np = mask
-                    
-                    # Ensure mask is 2D
-                    if len(mask_np.shape) > 2:
-                        mask_np = mask_np.squeeze()
-                    
-                    # Create professional overlay with contours
-                    mask_overlay_img = create_professional_mask_overlay(
-                        mask_np,
-                        original_img,
-                        overlay_alpha=0.45,  # Semi-transparent red overlay
-                        contour_thickness=2  # Contour line thickness
+                    computation_stats = merge_computation_stats(computation_stats, stats)
+                    return True
+                
+                await cached_stage(add_maps)
+                maps = record["maps"]
+                encode_stats = {}
+                async with admission.slot():
+                    parts = await run_blocking(
+                        render_explanations, maps, image, kinds=[kind],
+                        encode_stats=encode_stats, **style, **encoding
                     )
-                    
-                    # Save to base64
-                    buf = io.BytesIO()
-                    mask_overlay_img.save(buf, format="PNG")
-                    mask_base64 = base64.b64encode(buf.getvalue()).decode()
-                    
-                    # Calculate coverage for logging
-                    mask_uint8 = (mask_np * 255).astype(np.uint8) if mask_np.max() <= 1.0 else mask_np.astype(np.uint8)
-                    coverage = mask_uint8.sum() / (mask_uint8.shape[0] * mask_uint8.shape[1] * 255) * 100
-                    print(f"✅ Professional lesion mask generated successfully: {coverage:.2f}% coverage")
-                    
-                except Exception as e:
-                    print(f"❌ Lesion mask generation failed: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    # Create a fallback mask showing activation regions with basic overlay
-                    try:
-                        activation_np = activation_map.numpy() if isinstance(activation_map, torch.Tensor) else activation_map
-                        if activation_np.max() > activation_np.min():
-                            # Normalize and threshold
-                            activation_normalized = (activation_np - activation_np.min()) / (activation_np.max() - activation_np.min())
-                            # Use higher threshold for fallback
-                            fallback_mask = (activation_normalized > 0.5).astype(np.float32)
-                            
-                            # Create basic overlay
-                            mask_overlay_img = create_professional_mask_overlay(
-                                fallback_mask,
-                                original_img,
-                                overlay_alpha=0.4,
-                                contour_thickness=2
-                            )
-                            
-                            buf = io.BytesIO()
-                            mask_overlay_img.save(buf, format="PNG")
-                            mask_base64 = base64.b64encode(buf.getvalue()).decode()
-                        else:
-                            mask_base64 = None
-                    except Exception as fallback_error:
-                        print(f"❌ Fallback mask generation also failed: {fallback_error}")
-                        mask_base64 = None
-        
-        # Top 3 predictions
-        topk_idx = probs.topk(min(3, len(CLASS_MAPPING))).indices[0].cpu().numpy()
-        top3 = [
-            {"class": CLASS_MAPPING[int(i)], "confidence": float(probs[0][i])}
-            for i in topk_idx
-        ]
-        
-        # Model performance metrics
-        model_metrics = {}
-        for model_name, output in model_outputs.items():
-            model_pred = int(output.argmax())
-            model_conf = float(output.max())
-            model_metrics[model_name] = {
-                "predicted_class": CLASS_MAPPING[model_pred],
-                "confidence": round(model_conf * 100, 2)
-            }
+                event = {"kind": kind, "content_type": None, "image_base64": None}
+                if parts:
+                    _, event["content_type"], payload = parts[0]
+                    event["image_base64"] = base64.b64encode(payload).decode()
+                    event["encoding"] = encode_stats[kind]
+                if kind == "mask":
+                    event["lesion_regions"] = maps.get("mask_regions")
+                event["elapsed"] = round(time.time() - start_time, 3)
+                yield transport.sse_event("artifact", event)
+            
+            yield transport.sse_event("done", {
+                "inference_time": round(time.time() - start_time, 2),
+                "computation_stats": computation_stats
+            })
+        except asyncio.CancelledError:
+            print("🔌 Stream client disconnected, remaining stages cancelled")
+            raise
+        except ServerBusy as e:
+            yield transport.sse_event("error", {
+                "error": str(e), "status_code": e.status_code, "retry_after": RETRY_AFTER_S
+            })
+        except ModelUnavailable as e:
+            yield transport.sse_event("error", {"error": str(e), "status_code": 503})
+        except Exception as e:
+            yield transport.sse_event("error", {"error": f"Prediction failed: {str(e)}", "status_code": 500})
+    
+    return StreamingResponse(events(), media_type=transport.SSE_MEDIA_TYPE, headers=transport.STREAM_HEADERS)
+
+@app.post("/predict/batch")
+async def predict_batch(
+    files: List[UploadFile] = File(...),
+    model: str = Form("ensemble"),
+    ensemble_weights: str = Form(""),
+    use_uncertainty: bool = Form(False),
+    batch_size: int = Form(PREDICT_BATCH_SIZE)
+):
+    """
+    Classify many images (individual files and/or zip archives) as NDJSON.
+    
+    Images are decoded at most one batch ahead of the model, classified in tensor batches
+    of `batch_size`, and streamed one JSON line per image as its batch completes: `index`
+    (upload order), `filename`, `predicted_class`, `confidence`, `top3` and optionally
+    `uncertainty`, or `error`. A final line carries `"done": true` and totals. Decoding
+    and classification each hold an admission slot. `use_uncertainty` adds NUM_MC_SAMPLES - 1
+    noisy forward passes per batch, each over the whole batch.
+    """
+    start_time = time.time()
+    
+    total_bytes = sum(upload_size(upload) for upload in files)
+    if total_bytes > MAX_BATCH_UPLOAD_BYTES:
+        return JSONResponse(
+            {"error": f"Uploads total {total_bytes} bytes, above the {MAX_BATCH_UPLOAD_BYTES} byte limit"},
+            status_code=413
+        )
+    
+    try:
+        weights = {}
+        if model in ENSEMBLES:
+            weights = parse_ensemble_weights(ensemble_weights or ENSEMBLE_WEIGHTS, ENSEMBLES[model])
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid ensemble_weights: {e}"}, status_code=400)
+    batch_size = max(1, min(batch_size, 4 * PREDICT_BATCH_SIZE))
+    await ensure_models(model)
+    selected_model = get_model(model)
+    class_names = class_names_for(model)
+    
+    async def results():
+        # Decoded batches waiting for the model: the decoder runs at most one batch ahead
+        pending = asyncio.Queue(maxsize=1)
         
+        async def decode_all():
+            try:
+                sources = ((index, filename, read) for index, (filename, read) in enumerate(iter_batch_sources(files)))
+                while True:
+                    chunk = list(itertools.islice(sources, batch_size))
+                    if not chunk:
+                        break
+                    async with admission.slot():
+                        decoded = await run_blocking(decode_batch_images, chunk)
+                    await pending.put(decoded)
+                await pending.put(None)
+            except Exception as e:
+                await pending.put(e)
+        
+        decoder = asyncio.ensure_future(decode_all())
+        counts = {"images": 0, "errors": 0}
+        try:
+            while True:
+                decoded = await pending.get()
+                if decoded is None:
+                    break
+                if isinstance(decoded, Exception):
+                    raise decoded
+                batch = []
+                for index, filename, tensor in decoded:
+                    if isinstance(tensor, Exception):
+                        counts["errors"] += 1
+                        yield transport.ndjson_line({"index": index, "filename": filename, "error": f"Could not decode image: {tensor}"})
+                    else:
+                        batch.append((index, filename, tensor))
+                if not batch:
+                    continue
+                
+                async with admission.slot():
+                    tensors = torch.cat([tensor for _, _, tensor in batch], dim=0)
+                    probs, model_outputs, _ = await classify(model, tensors, weights)
+                    uncertainties = [None] * len(batch)
+                    if use_uncertainty and selected_model is not None:
+                        # MC sampling runs on the whole batch too, not image by image
+                        uncertainties = await run_blocking(
+                            estimate_uncertainty_batch, selected_model, tensors, probs
+                        )
+                
+                # Lines are sent after the slot is released, so a slow reader doesn't hold it
+                for row, (index, filename, _) in enumerate(batch):
+                    result = prediction_summary(
+                        probs[row:row + 1],
+                        {name: output[row:row + 1] for name, output in model_outputs.items()},
+                        class_names=class_names
+                    )
+                    del result["model_metrics"]
+                    if uncertainties[row] is not None:
+                        result["uncertainty"] = uncertainties[row]
+                    counts["images"] += 1
+                    yield transport.ndjson_line({"index": index, "filename": filename, **result})
+            
+            elapsed = time.time() - start_time
+            yield transport.ndjson_line({
+                "done": True,
+                **counts,
+                "elapsed_s": round(elapsed, 2),
+                "images_per_s": round(counts["images"] / elapsed, 2) if elapsed > 0 else None
+            })
+        except ServerBusy as e:
+            yield transport.ndjson_line({"error": str(e), "status_code": e.status_code, "retry_after": RETRY_AFTER_S})
+        except ModelUnavailable as e:
+            yield transport.ndjson_line({"error": str(e), "status_code": 503})
+        except Exception as e:
+            yield transport.ndjson_line({"error": f"Batch prediction failed: {str(e)}", "status_code": 500})
+        finally:
+            decoder.cancel()
+    
+    return StreamingResponse(results(), media_type=transport.NDJSON_MEDIA_TYPE, headers=transport.STREAM_HEADERS)
+
+@app.post("/predict/video")
+async def predict_video(
+    file: UploadFile = File(...),
+    model: str = Form("ensemble"),
+    ensemble_weights: str = Form(""),
+    sample_fps: float = Form(VIDEO_SAMPLE_FPS),
+    duplicate_threshold: float = Form(VIDEO_DUPLICATE_THRESHOLD),
+    smoothing_alpha: float = Form(VIDEO_SMOOTHING_ALPHA),
+    min_segment_s: float = Form(VIDEO_MIN_SEGMENT_S),
+    include_samples: bool = Form(False)
+):
+    """
+    Full-procedure video analysis as a timeline of segments.
+    
+    Frames are sampled at `sample_fps`, near-duplicates of the last classified frame are
+    skipped (they reuse its probabilities), the remaining frames are classified in
+    batches while the next batch is decoded, and the class probabilities are smoothed
+    over time before being grouped into segments. `include_samples` adds the smoothed
+    class of every sample.
+    """
+    start_time = time.time()
+    
+    if file.content_type and not file.content_type.startswith(("video/", "application/octet-stream")):
+        return JSONResponse(
+            {"error": "Invalid file type. Please upload a video."},
+            status_code=400
+        )
+    
+    try:
+        weights = {}
+        if model in ENSEMBLES:
+            weights = parse_ensemble_weights(ensemble_weights or ENSEMBLE_WEIGHTS, ENSEMBLES[model])
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid ensemble_weights: {e}"}, status_code=400)
+    
+    await ensure_models(model)
+    path = await run_blocking(spool_upload_to_disk, file)
+    sampler = None
+    next_batch = None
+    try:
+        try:
+            sampler = await run_blocking(
+                FrameSampler, path,
+                sample_fps=sample_fps,
+                duplicate_threshold=duplicate_threshold,
+                size=IMG_SIZE
+            )
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        
+        smoother = TemporalSmoother(smoothing_alpha)
+        timestamps, smoothed = [], []
+        last_probs = None
+        
+        next_batch = asyncio.ensure_future(run_blocking(sampler.next_batch, PREDICT_BATCH_SIZE))
+        while True:
+            samples, frames = await next_batch
+            if not samples:
+                break
+            # Decode the next batch while the models run on this one
+            next_batch = asyncio.ensure_future(run_blocking(sampler.next_batch, PREDICT_BATCH_SIZE))
+            
+            probs = None
+            if frames:
+                async with admission.slot():
+                    probs, _, _ = await classify(model, frames_to_tensor(frames), weights)
+                probs = probs.cpu().numpy()
+            
+            kept = 0
+            for timestamp, is_kept in samples:
+                if is_kept:
+                    last_probs = probs[kept]
+                    kept += 1
+                timestamps.append(timestamp)
+                smoothed.append(smoother.update(last_probs).copy())
+        
+        class_map = class_names_for(model)
+        class_names = [class_map[i] for i in range(len(class_map))]
+        smoothed = np.stack(smoothed) if smoothed else np.zeros((0, len(class_names)), dtype=np.float32)
+        counters = sampler.counters
         result = {
-            "predicted_class": CLASS_MAPPING[pred_idx],
-            "confidence": round(confidence * 100, 2),
-            "top3": top3,
-            "gradcam_base64": gradcam_base64,
-            "inference_time": round(time.time() - start_time, 2),
+            "video": {
+                "fps": round(sampler.fps, 3),
+                "frames": counters["frames"],
+                "duration_s": round(counters["frames"] / sampler.fps, 3)
+            },
+            "sampling": {
+                "sample_fps": round(sampler.fps / sampler.step, 3),
+                "sampled": counters["sampled"],
+                "duplicates_skipped": counters["duplicates"],
+                "classified": counters["kept"],
+                "classified_fraction": round(counters["kept"] / counters["frames"], 4) if counters["frames"] else 0.0
+            },
             "model_used": model,
-            "model_metrics": model_metrics,
-            "uncertainty": uncertainty_data,
-            "attention_rollout_base64": attention_rollout_base64,
-            "mask_base64": mask_base64,
-            "multilayer_gradcam": multilayer_maps if multilayer_maps else None
+            "segments": build_segments(
+                timestamps, smoothed, class_names, sampler.sample_interval, min_segment_s=min_segment_s
+            ),
+            "inference_time": round(time.time() - start_time, 2)
         }
-        
+        if include_samples:
+            result["samples"] = [
+                {
+                    "t": round(float(timestamp), 3),
+                    "class": class_names[int(row.argmax())],
+                    "confidence": round(float(row.max()) * 100, 2)
+                }
+                for timestamp, row in zip(timestamps, smoothed)
+            ]
         return JSONResponse(result)
     
+    except ServerBusy as e:
+        return busy_response(e)
+    except ModelUnavailable as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
     except Exception as e:
+        return JSONResponse({"error": f"Video analysis failed: {str(e)}"}, status_code=500)
+    finally:
+        if next_batch is not None and not next_batch.done():
+            next_batch.cancel()
+        # Closing waits for any in-flight decode, so it runs off the event loop
+        cpu_executor.submit(close_video, sampler, path)
+
+@app.get("/artifacts/{artifact_id}/{kind:path}")
+async def get_artifact(artifact_id: str, kind: str):
+    """
+    One explainability artifact of a `lazy_artifacts` prediction, computed on first fetch.
+    
+    `kind` is gradcam, attention_rollout, mask, multilayer/<layer> or lesion_regions (JSON).
+    """
+    if kind not in LAZY_ARTIFACT_KINDS:
         return JSONResponse(
-            {"error": f"Prediction failed: {str(e)}"},
-            status_code=500
+            {"error": f"Unknown artifact kind '{kind}'. Available: {', '.join(sorted(LAZY_ARTIFACT_KINDS))}"},
+            status_code=404
         )
+    session = artifact_store.get(artifact_id)
+    if session is None:
+        return JSONResponse({"error": "Unknown or expired artifact id"}, status_code=404)
+    
+    try:
+        # Concurrent fetches of one session share its inputs and activation maps
+        async with session["lock"]:
+            artifact = session["rendered"].get(kind)
+            if artifact is None:
+                async with admission.slot():
+                    artifact = await compute_artifact(session, kind)
+                session["rendered"][kind] = artifact
+                artifact_store.update(artifact_id, session)
+        
+        content_type, payload = artifact
+        max_age = max(0, int(session["expires"] - time.time()))
+        return Response(payload, media_type=content_type, headers={"Cache-Control": f"private, max-age={max_age}"})
+    except ServerBusy as e:
+        return busy_response(e)
+    except ModelUnavailable as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse({"error": f"Artifact generation failed: {str(e)}"}, status_code=500)
+
+@app.post("/rerender")
+async def rerender(
+    result_id: str = Form(...),
+    heatmap_alpha: float = Form(0.4),
+    heatmap_smooth: bool = Form(True),
+    heatmap_sigma: float = Form(2.0),
+    heatmap_colormap: str = Form("jet"),
+    show_contours: bool = Form(True),
+    contour_threshold: float = Form(0.7),
+    image_format: str = Form("png"),
+    image_quality: int = Form(85),
+    png_compress_level: int = Form(PNG_COMPRESS_LEVEL),
+    max_image_side: int = Form(0),
+    response_format: str = Form(""),
+    accept: Optional[str] = Header(None)
+):
+    """
+    Restyle the heatmap overlays of an earlier /predict without running the models.
+    
+    `result_id` is the one /predict returned; the overlays it asked for are redrawn from
+    the kept activation maps with the new style. The lesion mask overlay doesn't depend on
+    the style and is not returned. Transports and overlay encoding options are as for
+    /predict.
+    """
+    start_time = time.perf_counter()
+    session = artifact_store.get(result_id)
+    if session is None:
+        return JSONResponse({"error": "Unknown or expired result id"}, status_code=404)
+    try:
+        fmt = transport.negotiate(accept, response_format)
+        encoding = parse_encoding(image_format, image_quality, png_compress_level, max_image_side)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    
+    kinds = [kind for kind in session["spec"].get("kinds", ["gradcam"]) if kind != "mask"]
+    style = dict(
+        heatmap_alpha=heatmap_alpha,
+        heatmap_smooth=heatmap_smooth,
+        heatmap_sigma=heatmap_sigma,
+        heatmap_colormap=heatmap_colormap,
+        show_contours=show_contours,
+        contour_threshold=contour_threshold
+    )
+    try:
+        async with session["lock"]:
+            async with admission.slot():
+                # Maps are only recomputed if the session came from another worker and the
+                # result cache no longer has them
+                maps = await session_activation_maps(
+                    session,
+                    use_multilayer=any(kind.startswith("multilayer/") for kind in kinds),
+                    use_attention_rollout="attention_rollout" in kinds
+                )
+                image, _ = await session_inputs(session)
+                encode_stats = {}
+                artifacts = await run_blocking(
+                    render_explanations, maps, image, kinds=kinds, encode_stats=encode_stats, **style, **encoding
+                )
+            artifact_store.update(result_id, session)
+        
+        result = {
+            "result_id": result_id,
+            "render_time_ms": round((time.perf_counter() - start_time) * 1000, 1),
+            "encoding": encoding_report(encode_stats)
+        }
+        headers = {"Vary": "Accept"}
+        if fmt == transport.MULTIPART:
+            return transport.multipart_response(result, artifacts, headers=headers)
+        if fmt == transport.ENVELOPE:
+            return transport.envelope_response(result, artifacts, headers=headers)
+        result.update({name: value for name, value in explanations_json(artifacts).items() if value is not None})
+        return JSONResponse(result, headers=headers)
+    except ServerBusy as e:
+        return busy_response(e)
+    except ModelUnavailable as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse({"error": f"Re-render failed: {str(e)}"}, status_code=500)
 
 @app.post("/preprocess")
 async def preprocess_image_endpoint(
@@ -1163,91 +3162,126 @@ async def preprocess_image_endpoint(
     """Preprocess image and return preview."""
     try:
         file_bytes = await file.read()
-        img, _ = preprocess_image_custom(
-            file_bytes, brightness, contrast, rotation, flip_h, flip_v,
-            enhance=enhance, sharpen=sharpen
-        )
-        
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        b64 = base64.b64encode(buf.getvalue()).decode()
+        async with admission.slot():
+            b64 = await run_blocking(
+                render_preprocessed_preview,
+                file_bytes, brightness, contrast, rotation, flip_h, flip_v,
+                enhance=enhance, sharpen=sharpen
+            )
         
         return JSONResponse({"preprocessed_image": b64})
+    except ServerBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.post("/preprocess/sessions")
+async def create_preprocess_session(file: UploadFile = File(...)):
+    """
+    Upload an image once for interactive preprocessing.
+    
+    The image is decoded into a working copy of at most PREVIEW_WORKING_SIDE pixels. The
+    returned `session_id` serves previews at `preview_url` and can replace the file in
+    /predict until it expires.
+    """
+    if not file.content_type or not file.content_type.startswith("image/"):
+        return JSONResponse(
+            {"error": "Invalid file type. Please upload an image."},
+            status_code=400
+        )
+    try:
+        file_bytes = await file.read()
+        async with admission.slot():
+            try:
+                working = await run_blocking(decode_working_copy, file_bytes, PREVIEW_WORKING_SIDE)
+            except Exception as e:
+                return JSONResponse({"error": f"Could not decode image: {e}"}, status_code=400)
+        
+        session_id = await run_blocking(preview_store.create, file_bytes, {"filename": file.filename}, inputs=working)
+        working_img, scale = working
+        return JSONResponse({
+            "session_id": session_id,
+            "width": round(working_img.width * scale),
+            "height": round(working_img.height * scale),
+            "expires_in_s": round(PREVIEW_TTL_S),
+            "preview_url": f"/preprocess/sessions/{session_id}/preview"
+        })
+    except ServerBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.get("/preprocess/sessions/{session_id}/preview")
+async def preprocess_session_preview(
+    session_id: str,
+    brightness: float = 1.0,
+    contrast: float = 1.0,
+    rotation: int = 0,
+    flip_h: bool = False,
+    flip_v: bool = False,
+    enhance: bool = False,
+    sharpen: bool = False,
+    max_side: int = PREVIEW_MAX_SIDE,
+    image_format: str = Query("jpeg", alias="format"),
+    quality: int = PREVIEW_QUALITY
+):
+    """Downscaled JPEG or WebP preview of a preprocessing session with the given adjustments."""
+    if image_format not in PREVIEW_FORMATS:
+        return JSONResponse(
+            {"error": f"Unsupported preview format '{image_format}'. Available: {', '.join(PREVIEW_FORMATS)}"},
+            status_code=400
+        )
+    session = preview_store.get(session_id)
+    if session is None:
+        return JSONResponse({"error": "Unknown or expired session id"}, status_code=404)
+    max_side = max(64, min(max_side, PREVIEW_WORKING_SIDE))
+    quality = max(1, min(quality, 95))
+    
+    try:
+        # One preview at a time per session; they share its working copy
+        async with session["lock"]:
+            async with admission.slot():
+                if session["inputs"] is None:
+                    # Session written by another worker: decode its working copy here once
+                    session["inputs"] = await run_blocking(
+                        decode_working_copy, session["file_bytes"], PREVIEW_WORKING_SIDE
+                    )
+                content_type, payload = await run_blocking(
+                    render_session_preview, session, max_side, image_format, quality,
+                    brightness=brightness, contrast=contrast, rotation=rotation,
+                    flip_h=flip_h, flip_v=flip_v, enhance=enhance, sharpen=sharpen
+                )
+            preview_store.update(session_id, session)
+        
+        max_age = max(0, int(session["expires"] - time.time()))
+        return Response(payload, media_type=content_type, headers={"Cache-Control": f"private, max-age={max_age}"})
+    except ServerBusy as e:
+        return busy_response(e)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+@app.delete("/preprocess/sessions/{session_id}")
+async def delete_preprocess_session(session_id: str):
+    """Discard a preprocessing session before it expires."""
+    if preview_store.get(session_id) is None:
+        return JSONResponse({"error": "Unknown or expired session id"}, status_code=404)
+    preview_store.discard(session_id)
+    return {"deleted": session_id}
+
 @app.post("/generate-report")
 async def generate_report(data: dict):
     """Generate PDF explainability report."""
     try:
-        buf = io.BytesIO()
-        doc = SimpleDocTemplate(buf, pagesize=A4)
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#f97316'),
-            spaceAfter=30,
-            alignment=TA_CENTER
-        )
-        story.append(Paragraph("GI Endoscopy AI Diagnostic Report", title_style))
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Diagnosis
-        story.append(Paragraph(f"<b>Predicted Condition:</b> {data.get('predicted_class', 'N/A').replace('-', ' ').title()}", styles['Normal']))
-        story.append(Paragraph(f"<b>Confidence:</b> {data.get('confidence', 0)}%", styles['Normal']))
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Top 3 predictions
-        story.append(Paragraph("<b>Top 3 Predictions:</b>", styles['Heading2']))
-        top3_data = [['Rank', 'Condition', 'Confidence']]
-        for idx, pred in enumerate(data.get('top3', []), 1):
-            top3_data.append([str(idx), pred['class'].replace('-', ' ').title(), f"{pred['confidence']*100:.2f}%"])
-        
-        top3_table = Table(top3_data)
-        top3_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(top3_table)
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Uncertainty
-        if data.get('uncertainty'):
-            unc = data['uncertainty']
-            story.append(Paragraph(f"<b>Uncertainty Score:</b> {unc.get('uncertainty_score', 0):.3f}", styles['Normal']))
-            story.append(Paragraph(f"<b>Entropy:</b> {unc.get('entropy', 0):.3f}", styles['Normal']))
-            story.append(Spacer(1, 0.2*inch))
-        
-        # Model metrics
-        if data.get('model_metrics'):
-            story.append(Paragraph("<b>Model Performance:</b>", styles['Heading2']))
-            for model_name, metrics in data['model_metrics'].items():
-                story.append(Paragraph(f"{model_name.upper()}: {metrics['predicted_class']} ({metrics['confidence']}%)", styles['Normal']))
-            story.append(Spacer(1, 0.2*inch))
-        
-        # Timestamp
-        from datetime import datetime
-        story.append(Paragraph(f"<i>Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</i>", styles['Normal']))
-        
-        doc.build(story)
-        buf.seek(0)
+        async with admission.slot():
+            pdf_bytes = await run_blocking(build_report_pdf, data)
         
         return Response(
-            content=buf.getvalue(),
+            content=pdf_bytes,
             media_type="application/pdf",
             headers={"Content-Disposition": "attachment; filename=diagnosis_report.pdf"}
         )
+    except ServerBusy as e:
+        return busy_response(e)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -1264,6 +3298,16 @@ async def root():
             "attention_rollout",
             "uncertainty_estimation",
             "lesion_mask",
+            "lesion_region_stats",
+            "lazy_artifacts",
+            "preview_sessions",
+            "rerender",
+            "raw_activation_maps",
+            "streaming_predict",
+            "batch_predict",
+            "video_analysis",
+            "int8_models",
+            "model_registry",
             "image_preprocessing",
             "pdf_reports"
         ]
@@ -1272,10 +3316,29 @@ async def root():
 @app.get("/health")
 async def health():
     """Detailed health check."""
+    loaded = registry.loaded()
     return {
         "status": "healthy",
         "device": DEVICE,
+        "worker_pid": os.getpid(),
+        "torch_threads": torch.get_num_threads(),
         "models_loaded": models_loaded,
-        "deit3_available": deit_model is not None,
-        "vit_available": vit_model is not None
+        "deit3_available": "deit3" in registry.available_names(),
+        "vit_available": "vit" in registry.available_names(),
+        "models": registry.stats(),
+        "capabilities": {name: state.capabilities for name, state in loaded.items()},
+        "startup": dict(startup_report, first_request_ms=first_request_ms),
+        "backends": {name: state.info["backend"] for name, state in loaded.items() if "backend" in state.info},
+        "int8": {
+            "enabled": ENABLE_INT8,
+            "models": {f"{name}-int8": state.info["int8"] for name, state in loaded.items() if "int8" in state.info}
+        },
+        "admission": admission.stats(),
+        "result_cache": result_cache.stats(),
+        "artifacts": artifact_store.stats(),
+        "preview_sessions": preview_store.stats(),
+        "micro_batching": {
+            "enabled": ENABLE_MICRO_BATCHING,
+            "models": {name: scheduler.stats() for name, scheduler in batch_schedulers.items()}
+        }
     }
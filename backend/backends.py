@@ -0,0 +1,182 @@
+"""
+Pluggable inference backends for the classification forward pass.
+
+A backend wraps one model and is called like a TorchScript module: a normalized
+[N, 3, H, W] float tensor in, an [N, num_classes] logits tensor out, without gradients.
+Backends are built by factories registered under a name with `register_backend`, and
+`select_fastest` benchmarks the candidates for a model so the fastest one serves it, after
+`agreement_check` has compared their outputs with the TorchScript model's.
+Gradient-based explanations always run on the TorchScript model, whatever backend
+classifies.
+
+The ONNX Runtime backend runs an ONNX export of the TorchScript file, cached next to it
+as ``<name>_ort.onnx`` (see model_cache.py), on the CPU execution provider.
+"""
+import inspect
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import model_cache
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+ONNX_OPSET = 17
+ORT_OPTIMIZATION_LEVELS = {
+    "disabled": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+BACKEND_FACTORIES = {}
+
+
+def register_backend(name):
+    """
+    Register `factory(model_name, path, model, options)` as the backend called `name`.
+
+    `path` is the TorchScript file, `model` the loaded TorchScript model and `options` a
+    dict of per-model settings (`threads`, `input_size`, `device` and backend-specific
+    keys). The factory raises when the backend can't serve the model.
+    """
+    def decorator(factory):
+        BACKEND_FACTORIES[name] = factory
+        return factory
+    return decorator
+
+
+def create_backend(name, model_name, path, model, options=None):
+    factory = BACKEND_FACTORIES.get(name)
+    if factory is None:
+        raise ValueError(f"unknown backend '{name}', expected one of {', '.join(BACKEND_FACTORIES)}")
+    return factory(model_name, path, model, options or {})
+
+
+class TorchScriptBackend:
+    name = "torchscript"
+
+    def __init__(self, model):
+        self.model = model
+        self.info = {}
+
+    def __call__(self, batch):
+        return self.model(batch)
+
+
+class OnnxRuntimeBackend:
+    name = "onnxruntime"
+
+    def __init__(self, onnx_path, threads=0, optimization="all"):
+        if optimization not in ORT_OPTIMIZATION_LEVELS:
+            raise ValueError(f"unknown optimization level '{optimization}', "
+                             f"expected one of {', '.join(ORT_OPTIMIZATION_LEVELS)}")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads  # 0 lets ONNX Runtime use every core
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, ORT_OPTIMIZATION_LEVELS[optimization])
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.info = {"path": onnx_path, "threads": threads, "optimization": optimization}
+
+    def __call__(self, batch):
+        inputs = np.ascontiguousarray(batch.detach().cpu().numpy(), dtype=np.float32)
+        return torch.from_numpy(self.session.run(None, {self.input_name: inputs})[0])
+
+
+def export_onnx(path, input_size=384, force=False):
+    """Export the TorchScript model at `path` to ONNX with a dynamic batch axis (cached)."""
+    def build(target):
+        model = torch.jit.load(path, map_location="cpu").eval()
+        example = torch.zeros(1, 3, input_size, input_size)
+        # Newer torch defaults to the dynamo exporter, which can't take TorchScript modules
+        kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+        torch.onnx.export(
+            model, (example,), target,
+            input_names=["input"], output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=ONNX_OPSET, **kwargs
+        )
+
+    return model_cache.cached_file(path, "ort", ".onnx", build, force=force,
+                                   opset=ONNX_OPSET, input_size=input_size)
+
+
+@register_backend("torchscript")
+def _torchscript_backend(model_name, path, model, options):
+    return TorchScriptBackend(model)
+
+
+@register_backend("onnxruntime")
+def _onnxruntime_backend(model_name, path, model, options):
+    if ort is None:
+        raise RuntimeError("onnxruntime is not installed")
+    if options.get("device", "cpu") != "cpu":
+        raise RuntimeError("the ONNX Runtime backend is CPU-only")
+    onnx_path, _ = export_onnx(path, options.get("input_size", 384))
+    return OnnxRuntimeBackend(onnx_path, threads=int(options.get("threads", 0)),
+                              optimization=options.get("optimization", "all"))
+
+
+def parse_session_options(spec):
+    """Parse "vit:threads=4,optimization=extended;deit3:threads=2" into {model: {option: value}}."""
+    options = {}
+    for model_spec in (spec or "").split(";"):
+        if not model_spec.strip():
+            continue
+        model_name, _, settings = model_spec.partition(":")
+        model_options = options.setdefault(model_name.strip(), {})
+        for setting in settings.split(","):
+            if not setting.strip():
+                continue
+            key, _, value = setting.partition("=")
+            key, value = key.strip(), value.strip()
+            model_options[key] = int(value) if key == "threads" else value
+    return options
+
+
+def time_backend(backend, batch, runs=3, num_threads=0):
+    """Median no-grad forward latency (ms) of `backend` after one warm-up run."""
+    previous = torch.get_num_threads()
+    if num_threads:
+        # Time torch with the same per-thread cap its model worker will use
+        torch.set_num_threads(num_threads)
+    try:
+        times = []
+        with torch.no_grad():
+            backend(batch)
+            for _ in range(runs):
+                started = time.perf_counter()
+                backend(batch)
+                times.append((time.perf_counter() - started) * 1000)
+        return round(float(np.median(times)), 2)
+    finally:
+        torch.set_num_threads(previous)
+
+
+def agreement_check(reference, backend, inputs):
+    """Top-1 agreement and largest absolute softmax difference of `backend` against `reference`."""
+    with torch.no_grad():
+        expected = F.softmax(reference(inputs), dim=1)
+        actual = F.softmax(backend(inputs), dim=1).to(expected.device)
+    return {
+        "samples": len(inputs),
+        "top1_agreement": round((expected.argmax(1) == actual.argmax(1)).float().mean().item(), 4),
+        "max_abs_prob_diff": float((expected - actual).abs().max()),
+    }
+
+
+def select_fastest(candidates, batch, runs=3, num_threads=0):
+    """`(name, backend, latencies_ms)` for the fastest of the `{name: backend}` candidates."""
+    if len(candidates) == 1:
+        name, backend = next(iter(candidates.items()))
+        return name, backend, {}
+    latencies = {name: time_backend(backend, batch, runs, num_threads) for name, backend in candidates.items()}
+    best = min(latencies, key=latencies.get)
+    return best, candidates[best], latencies
@@ -0,0 +1,100 @@
+"""
+Microbenchmark: per-overlay heatmap rendering cost, before and after rendering.py.
+
+Renders the same five activation maps a full /predict produces (gradcam, three
+multilayer maps, rollout) over one synthetic endoscopy-sized frame, first with the
+previous per-call matplotlib/LANCZOS/Image.blend/per-segment-contour implementation,
+then with OverlayRenderer sharing one base image.
+
+Usage (from backend/):
+    python benchmarks/bench_rendering.py [--width 1920] [--height 1080] [--repeats 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+from scipy import ndimage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rendering import OverlayRenderer, attention_contours  # noqa: E402
+
+IMG_SIZE = 384
+
+
+def legacy_blend_heatmap(original_pil, activation_np, alpha=0.4, smooth=True, sigma=2.0,
+                         show_contours=True, contour_threshold=0.7, colormap="jet"):
+    """The blend_heatmap implementation that rendering.py replaced, kept for comparison."""
+    import matplotlib.cm as cm
+
+    activation_np = activation_np / activation_np.max() if activation_np.max() > 0 else np.zeros_like(activation_np)
+    if smooth:
+        activation_np = ndimage.gaussian_filter(activation_np, sigma=sigma)
+        if activation_np.max() > 0:
+            activation_np = activation_np / activation_np.max()
+
+    cmap = {"jet": cm.jet, "plasma": cm.plasma, "magma": cm.magma}.get(colormap, cm.jet)
+    heatmap = (cmap(activation_np)[:, :, :3] * 255).astype("uint8")
+    heatmap_img = Image.fromarray(heatmap).resize(original_pil.size, Image.LANCZOS)
+    result = Image.blend(original_pil.convert("RGB"), heatmap_img, alpha=alpha)
+
+    if show_contours:
+        draw = ImageDraw.Draw(result)
+        scale_x = original_pil.size[0] / activation_np.shape[1]
+        scale_y = original_pil.size[1] / activation_np.shape[0]
+        for contour in attention_contours(activation_np, threshold=contour_threshold):
+            if len(contour) > 2:
+                points = [(int(p[1] * scale_x), int(p[0] * scale_y)) for p in contour]
+                for i in range(len(points) - 1):
+                    draw.line([points[i], points[i + 1]], fill=(255, 255, 0), width=2)
+    return result
+
+
+def synthetic_maps(count, seed=0):
+    rng = np.random.default_rng(seed)
+    maps = []
+    for _ in range(count):
+        noise = rng.random((IMG_SIZE, IMG_SIZE)).astype(np.float32)
+        maps.append(ndimage.gaussian_filter(noise, sigma=12).astype(np.float32))
+    return maps
+
+
+def time_per_overlay(render_all, overlays, repeats):
+    render_all()  # Warm-up (imports, LUT construction)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        render_all()
+    return (time.perf_counter() - start) / (repeats * overlays) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--overlays", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    base = Image.fromarray(rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8))
+    maps = synthetic_maps(args.overlays)
+
+    def legacy():
+        return [legacy_blend_heatmap(base, m) for m in maps]
+
+    def fast():
+        renderer = OverlayRenderer(base, alpha=0.4)
+        return [renderer.render(m) for m in maps]
+
+    before = time_per_overlay(legacy, args.overlays, args.repeats)
+    after = time_per_overlay(fast, args.overlays, args.repeats)
+    print(f"Frame {args.width}x{args.height}, {args.overlays} overlays per request")
+    print(f"  legacy blend_heatmap : {before:8.2f} ms/overlay")
+    print(f"  OverlayRenderer      : {after:8.2f} ms/overlay")
+    print(f"  speed-up             : {before / after:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
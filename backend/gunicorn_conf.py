@@ -0,0 +1,40 @@
+"""
+Gunicorn configuration for pre-fork serving.
+
+The master imports app_gradcam once (preload_app), which loads the TorchScript models,
+then forks WORKERS uvicorn workers. Model weights are shared with the workers
+copy-on-write, or through shared memory with WEIGHT_SHARING=shm, so adding workers
+does not duplicate the DeiT3/ViT parameters. Each worker pins its torch thread count
+so the workers together use the available cores without oversubscribing them.
+
+Usage:
+    gunicorn -c gunicorn_conf.py app_gradcam:app
+"""
+import gc
+import os
+
+workers = int(os.environ.get("WORKERS", "2"))
+cpu_count = os.cpu_count() or 1
+
+# Set before the app is imported so app_gradcam sees it during model loading
+os.environ["GI_PREFORK"] = "1"
+os.environ.setdefault("TORCH_THREADS", str(max(1, cpu_count // workers)))
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.environ.get("WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+
+
+def when_ready(server):
+    server.log.info(
+        f"Serving with {workers} workers, {os.environ['TORCH_THREADS']} torch threads each, "
+        f"weight sharing: {os.environ.get('WEIGHT_SHARING', 'cow')}"
+    )
+
+
+def pre_fork(server, worker):
+    # Move everything allocated during preload into the permanent generation so the
+    # garbage collector never writes to those pages and breaks copy-on-write sharing
+    gc.freeze()
@@ -0,0 +1,117 @@
+"""
+On-disk cache of models and exports derived from the TorchScript files in models/.
+
+A derived model (frozen graph, INT8 copy, ONNX export, ...) is saved next to its source as
+``<name>_<suffix>.pt`` (or another extension) with a JSON sidecar fingerprinting what it
+was built from: the source file's size and mtime, the torch version and any extra keys the
+caller adds. It is reused only while the fingerprint still matches, otherwise it is
+rebuilt and rewritten.
+"""
+import json
+import os
+import time
+
+import torch
+
+
+def cache_path(path, suffix, ext=None):
+    """Location of the `suffix` variant of the model at `path`."""
+    stem, source_ext = os.path.splitext(path)
+    return f"{stem}_{suffix}{ext or source_ext or '.pt'}"
+
+
+def _meta_path(model_path):
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def fingerprint(path, **extra):
+    """What a model derived from `path` depends on."""
+    stat = os.stat(path)
+    return dict(
+        source=os.path.basename(path),
+        source_size=stat.st_size,
+        source_mtime_ns=stat.st_mtime_ns,
+        torch=torch.__version__,
+        **extra
+    )
+
+
+def _matches(model_path, expected):
+    meta_path = _meta_path(model_path)
+    if not (os.path.exists(model_path) and os.path.exists(meta_path)):
+        return False
+    try:
+        with open(meta_path) as f:
+            return json.load(f) == expected
+    except (OSError, ValueError):
+        return False
+
+
+def _write(model_path, meta, write):
+    """Write a file with `write(target)` and then its sidecar, each replacing the old one atomically."""
+    meta_path = _meta_path(model_path)
+    # Write to temporary names first so concurrent starts never read a partial file
+    tmp_suffix = f".{os.getpid()}.tmp"
+    write(model_path + tmp_suffix)
+    with open(meta_path + tmp_suffix, "w") as f:
+        json.dump(meta, f)
+    os.replace(model_path + tmp_suffix, model_path)
+    os.replace(meta_path + tmp_suffix, meta_path)
+
+
+def load(model_path, expected, map_location="cpu"):
+    """The cached model at `model_path` if its sidecar matches `expected`, else None."""
+    if not _matches(model_path, expected):
+        return None
+    try:
+        return torch.jit.load(model_path, map_location=map_location).eval()
+    except Exception as e:
+        print(f"⚠️  Ignoring unreadable cached model {model_path}: {e}")
+        return None
+
+
+def save(model, model_path, meta):
+    """Write `model` and its sidecar; failures are logged, not raised."""
+    try:
+        _write(model_path, meta, lambda target: torch.jit.save(model, target))
+    except OSError as e:
+        print(f"⚠️  Could not cache model at {model_path}: {e}")
+
+
+def load_or_build(path, suffix, build, map_location="cpu", force=False, **extra):
+    """
+    Load the cached `suffix` variant of the model at `path`, calling `build()` on a miss.
+
+    Returns `(model, info)`, where `info` has the cache `path`, whether it was `cached`
+    and the preparation time in `prepare_s`.
+    """
+    started = time.perf_counter()
+    model_path = cache_path(path, suffix)
+    expected = fingerprint(path, **extra)
+
+    model = None if force else load(model_path, expected, map_location)
+    cached = model is not None
+    if not cached:
+        model = build().eval()
+        save(model, model_path, expected)
+    return model, {"path": model_path, "cached": cached,
+                   "prepare_s": round(time.perf_counter() - started, 2)}
+
+
+def cached_file(path, suffix, ext, build, force=False, **extra):
+    """
+    A non-TorchScript file derived from the model at `path` (e.g. an ONNX export).
+
+    `build(target)` writes the file; it runs only when the cached copy is missing or its
+    fingerprint changed, and its errors propagate. Returns `(file_path, info)` with the
+    same `info` keys as `load_or_build`.
+    """
+    started = time.perf_counter()
+    file_path = cache_path(path, suffix, ext)
+    expected = fingerprint(path, **extra)
+
+    cached = not force and _matches(file_path, expected)
+    if not cached:
+        _write(file_path, expected, build)
+    return file_path, {"path": file_path, "cached": cached,
+                       "prepare_s": round(time.perf_counter() - started, 2)}
@@ -0,0 +1,301 @@
+"""
+Registry of the models a deployment serves, declared in a JSON config file::
+
+    {
+      "default": "vit",
+      "ensemble": ["deit3", "vit"],
+      "models": {
+        "vit": {
+          "path": "models/vit_best_traced.pt",
+          "backend": "auto",
+          "input_size": 384,
+          "class_map": "models/vit_classes.json",
+          "preload": false
+        }
+      }
+    }
+
+Models are loaded on first use through a loader callback. When the estimated footprint of
+the loaded models exceeds the memory budget, models idle for at least `idle_s` are evicted,
+least recently used first. A watcher thread reloads a model whose file changed, once the
+file has stopped changing for one polling interval, and swaps the new state in.
+
+Requests keep references to the state they started with, so neither an eviction nor a
+reload interrupts them. The old weights are freed when the last of those requests finishes.
+"""
+import json
+import os
+import threading
+import time
+
+
+def file_fingerprint(path):
+    """`(size, mtime_ns)` of `path`; changes whenever the file is replaced or rewritten."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_class_names(class_map, default):
+    """Class index -> name from a JSON file path, a list or a dict (`default` when None)."""
+    if class_map is None:
+        return default
+    if isinstance(class_map, str):
+        with open(class_map) as f:
+            class_map = json.load(f)
+    if isinstance(class_map, list):
+        return dict(enumerate(class_map))
+    return {int(index): name for index, name in class_map.items()}
+
+
+class ModelState:
+    """What a loader returns for one model; loaders add the loaded objects as attributes."""
+
+    def __init__(self):
+        self.fingerprint = None
+        self.nbytes = 0  # Estimated memory footprint
+        self.info = {}  # Loader report, shown in stats()
+        self.load_s = None
+        self.loaded_at = time.time()
+
+
+class ModelEntry:
+    """A declared model and its loaded state (None while unloaded)."""
+
+    def __init__(self, name, spec, defaults):
+        self.name = name
+        self.path = spec["path"]
+        self.backend = spec.get("backend", "auto")
+        self.input_size = int(spec.get("input_size", defaults["input_size"]))
+        self.class_names = load_class_names(spec.get("class_map"), defaults["class_names"])
+        self.session_options = spec.get("session_options", {})
+        self.preload = bool(spec.get("preload", defaults["preload"]))
+        self.state = None
+        self.lock = threading.RLock()
+        self.last_used = 0.0
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.error = None
+        self._failed_fingerprint = None
+        self._pending_fingerprint = None
+
+    @property
+    def available(self):
+        return os.path.exists(self.path)
+
+
+class ModelRegistry:
+    """
+    Declared models, loaded lazily by `loader(entry, previous_state)`.
+
+    `max_bytes` of 0 disables eviction; `reload_interval_s` of 0 disables the file watcher.
+    If `config_path` doesn't exist, `fallback_config` (same format) is used instead.
+    """
+
+    def __init__(self, config_path, loader, defaults, fallback_config, max_bytes=0, idle_s=60.0,
+                 reload_interval_s=5.0):
+        self.config_path = config_path
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.idle_s = idle_s
+        self.reload_interval_s = reload_interval_s
+        self._budget_lock = threading.Lock()
+        self._watcher = None
+
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                config = json.load(f)
+        else:
+            print(f"ℹ️  {config_path} not found, serving the built-in model list")
+            config = fallback_config
+        self.entries = {name: ModelEntry(name, spec, defaults) for name, spec in config["models"].items()}
+        self.default = config.get("default") if config.get("default") in self.entries else next(iter(self.entries), None)
+        self.ensemble = [name for name in config.get("ensemble", self.entries) if name in self.entries]
+
+    def available_names(self):
+        return [name for name, entry in self.entries.items() if entry.available]
+
+    def fallback(self):
+        """The default model if its file exists, else the first available one (or None)."""
+        if self.default is not None and self.entries[self.default].available:
+            return self.default
+        return next(iter(self.available_names()), None)
+
+    def loaded(self):
+        """`{name: state}` of the models loaded right now."""
+        states = {name: entry.state for name, entry in self.entries.items()}
+        return {name: state for name, state in states.items() if state is not None}
+
+    def get(self, name):
+        """Loaded state of `name`, loading it on first use; None if undeclared, missing or failing."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        entry.last_used = time.time()
+        state = entry.state
+        if state is not None:
+            return state
+        if not entry.available:
+            return None
+
+        with entry.lock:
+            state = entry.state
+            if state is None:
+                state = self._load(entry)
+        if state is not None:
+            self.enforce_budget(keep={name})
+        return state
+
+    def _load(self, entry, previous=None):
+        fingerprint = file_fingerprint(entry.path)
+        if entry.error is not None and entry._failed_fingerprint == fingerprint:
+            return None  # Don't retry a broken file on every request
+        started = time.perf_counter()
+        try:
+            state = self.loader(entry, previous)
+        except Exception as e:
+            entry.error, entry._failed_fingerprint = str(e), fingerprint
+            print(f"❌ Could not load {entry.name} from {entry.path}: {e}")
+            return None
+        state.fingerprint = fingerprint
+        state.load_s = round(time.perf_counter() - started, 2)
+        entry.error = None
+        entry.loads += 1
+        entry.state = state
+        print(f"✅ {entry.name} loaded from {entry.path} in {state.load_s}s")
+        return state
+
+    def update(self, name, fn):
+        """Run `fn(entry, state)` on a loaded model under its lock (e.g. to load extra variants)."""
+        entry = self.entries[name]
+        with entry.lock:
+            if entry.state is not None:
+                fn(entry, entry.state)
+        self.enforce_budget(keep={name})
+
+    def unload(self, name):
+        entry = self.entries[name]
+        with entry.lock:
+            state, entry.state = entry.state, None
+        return state.nbytes if state is not None else 0
+
+    def memory_used(self):
+        return sum(state.nbytes for state in self.loaded().values())
+
+    def enforce_budget(self, keep=()):
+        """Evict idle models, least recently used first, until the loaded ones fit `max_bytes`."""
+        if not self.max_bytes:
+            return
+        with self._budget_lock:
+            used = self.memory_used()
+            now = time.time()
+            candidates = sorted(
+                (entry for entry in self.entries.values() if entry.state is not None),
+                key=lambda entry: entry.last_used
+            )
+            for entry in candidates:
+                if used <= self.max_bytes:
+                    break
+                if entry.name in keep or now - entry.last_used < self.idle_s:
+                    continue
+                used -= self.unload(entry.name)
+                entry.evictions += 1
+                print(f"♻️  Evicted idle model {entry.name} ({used / 1024 ** 2:.0f} MB now loaded)")
+            if used > self.max_bytes:
+                print(f"⚠️  Loaded models use {used / 1024 ** 2:.0f} MB, over the "
+                      f"{self.max_bytes / 1024 ** 2:.0f} MB budget, and none is idle")
+
+    def check_for_changes(self):
+        """Reload every loaded model whose file changed and has been stable for one poll."""
+        for entry in list(self.entries.values()):
+            state = entry.state
+            if state is None or not entry.available:
+                continue
+            try:
+                fingerprint = file_fingerprint(entry.path)
+            except OSError:
+                continue
+            if fingerprint == state.fingerprint:
+                entry._pending_fingerprint = None
+                continue
+            if fingerprint != entry._pending_fingerprint:
+                # Still being written (or just replaced); reload on the next poll if unchanged
+                entry._pending_fingerprint = fingerprint
+                continue
+
+            print(f"🔄 {entry.name} changed on disk, reloading")
+            entry._pending_fingerprint = None
+            # Load outside the entry lock so requests keep using the current state meanwhile
+            new_state = self._reload(entry, state)
+            if new_state is not None:
+                self.enforce_budget(keep={entry.name})
+
+    def _reload(self, entry, previous):
+        started = time.perf_counter()
+        fingerprint = file_fingerprint(entry.path)
+        try:
+            state = self.loader(entry, previous)
+        except Exception as e:
+            entry.error, entry._failed_fingerprint = str(e), fingerprint
+            print(f"❌ Reloading {entry.name} failed, still serving the previous version: {e}")
+            return None
+        state.fingerprint = fingerprint
+        state.load_s = round(time.perf_counter() - started, 2)
+        with entry.lock:
+            entry.state = state
+            entry.error = None
+            entry.reloads += 1
+        print(f"✅ {entry.name} reloaded in {state.load_s}s")
+        return state
+
+    def start_watcher(self):
+        """Poll model files for changes on a daemon thread (once per process)."""
+        if self.reload_interval_s <= 0 or self._watcher is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(self.reload_interval_s)
+                try:
+                    self.check_for_changes()
+                except Exception as e:
+                    print(f"⚠️  Model file watcher error: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="model-watcher", daemon=True)
+        self._watcher.start()
+
+    def stats(self):
+        models = {}
+        for name, entry in self.entries.items():
+            state = entry.state
+            if state is not None:
+                status = "loaded"
+            elif not entry.available:
+                status = "missing"
+            else:
+                status = "error" if entry.error else "unloaded"
+            models[name] = {
+                "state": status,
+                "path": entry.path,
+                "backend": entry.backend,
+                "input_size": entry.input_size,
+                "num_classes": len(entry.class_names),
+                "preload": entry.preload,
+                "memory_bytes": state.nbytes if state is not None else 0,
+                "load_s": state.load_s if state is not None else None,
+                "loaded_at": round(state.loaded_at, 3) if state is not None else None,
+                "last_used": round(entry.last_used, 3) if entry.last_used else None,
+                "loads": entry.loads,
+                "reloads": entry.reloads,
+                "evictions": entry.evictions,
+                "error": entry.error,
+                "details": state.info if state is not None else None,
+            }
+        return {
+            "config": self.config_path,
+            "default": self.default,
+            "memory_budget_bytes": self.max_bytes,
+            "memory_used_bytes": self.memory_used(),
+            "reload_interval_s": self.reload_interval_s,
+            "models": models,
+        }
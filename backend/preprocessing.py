@@ -0,0 +1,255 @@
+"""
+Image preprocessing at model resolution.
+
+Endoscope captures are 1920x1080 or larger, while the models see 384x384. `PreparedImage`
+builds the model input without touching most of those pixels:
+- JPEGs are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that still covers the
+  model size (PIL's draft mode), and other formats are decoded as they are.
+- The (cropped) image is resized to model resolution straight after decoding.
+- Rotation, flips, brightness, contrast and the edge-enhance/sharpen filters then run as
+  tensor operations on the small image. They are followed by the normalization, in place
+  where possible.
+
+Adjustments therefore apply at model resolution, so the 3x3 filters act on 384-pixel
+detail rather than on full-resolution detail. The adjusted image that overlays are drawn
+on is decoded only when `display_image()` is called, at display resolution when a maximum
+side is given.
+"""
+import io
+import math
+import threading
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image, ImageEnhance, ImageFilter
+
+# PIL's ImageFilter.EDGE_ENHANCE and ImageFilter.SHARPEN kernels, divided by their scale
+EDGE_ENHANCE_KERNEL = torch.tensor([[-1.0, -1.0, -1.0], [-1.0, 10.0, -1.0], [-1.0, -1.0, -1.0]]) / 2
+SHARPEN_KERNEL = torch.tensor([[-2.0, -2.0, -2.0], [-2.0, 32.0, -2.0], [-2.0, -2.0, -2.0]]) / 16
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)  # ITU-R 601-2, as PIL's "L" conversion
+
+
+def adjust_image(img, brightness=1.0, contrast=1.0, rotation=0, flip_h=False, flip_v=False,
+                 crop_box=None, enhance=False, sharpen=False):
+    """Apply the adjustments to a PIL image at its own resolution (used for display)."""
+    # Crop if specified
+    if crop_box:
+        img = img.crop(crop_box)
+
+    # Rotate
+    if rotation != 0:
+        img = img.rotate(rotation, expand=True)
+
+    # Flip
+    if flip_h:
+        img = img.transpose(Image.FLIP_LEFT_RIGHT)
+    if flip_v:
+        img = img.transpose(Image.FLIP_TOP_BOTTOM)
+
+    # Brightness and contrast
+    if brightness != 1.0:
+        img = ImageEnhance.Brightness(img).enhance(brightness)
+    if contrast != 1.0:
+        img = ImageEnhance.Contrast(img).enhance(contrast)
+
+    # Filters
+    if enhance:
+        img = img.filter(ImageFilter.EDGE_ENHANCE)
+    if sharpen:
+        img = img.filter(ImageFilter.SHARPEN)
+    return img
+
+
+def decode(file_bytes, min_size=None, crop_box=None):
+    """
+    Decode an upload to RGB, as `(image, scale)`.
+
+    With `min_size`, a JPEG is decoded at the smallest DCT scale that keeps the cropped
+    region at least `min_size` pixels on each side. `scale` is the full-resolution width
+    divided by the decoded width.
+    """
+    img = Image.open(io.BytesIO(file_bytes))
+    full_width, full_height = img.size
+    if min_size and img.format == "JPEG":
+        region_width, region_height = full_width, full_height
+        if crop_box:
+            region_width = max(1, crop_box[2] - crop_box[0])
+            region_height = max(1, crop_box[3] - crop_box[1])
+        img.draft("RGB", (math.ceil(min_size * full_width / region_width),
+                          math.ceil(min_size * full_height / region_height)))
+    return img.convert("RGB"), full_width / img.size[0]
+
+
+def decode_working_copy(file_bytes, max_side):
+    """
+    Decode an upload at most `max_side` pixels on its longer side, as `(image, scale)`.
+
+    JPEGs use the smallest DCT scale that keeps the longer side at least `max_side`.
+    `scale` is the full-resolution width divided by the decoded width, as for `decode`.
+    """
+    img = Image.open(io.BytesIO(file_bytes))
+    full_width, full_height = img.size
+    ratio = max_side / max(full_width, full_height)
+    if img.format == "JPEG" and ratio < 1:
+        img.draft("RGB", (math.ceil(full_width * ratio), math.ceil(full_height * ratio)))
+    img = img.convert("RGB")
+    img.thumbnail((max_side, max_side))
+    return img, full_width / img.width
+
+
+def _rotated_size(width, height, degrees):
+    """Size of the canvas PIL's rotate(expand=True) produces."""
+    radians = math.radians(degrees)
+    cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+    return width * cos + height * sin, width * sin + height * cos
+
+
+def _rotate(x, degrees, size):
+    """
+    Rotate [1, C, H, W] counter-clockwise onto the expanded canvas, resized to `size`.
+
+    Rotation, expansion and the final resize are one sampling pass, with black outside the source.
+    """
+    height, width = x.shape[-2:]
+    out_width, out_height = _rotated_size(width, height, degrees)
+    radians = math.radians(degrees)
+    cos, sin = math.cos(radians), math.sin(radians)
+    # Output (normalized) -> source (normalized) coordinates
+    theta = torch.tensor([[
+        [cos * out_width / width, -sin * out_height / width, 0.0],
+        [sin * out_width / height, cos * out_height / height, 0.0],
+    ]], dtype=x.dtype)
+    grid = F.affine_grid(theta, (1, x.shape[1], size, size), align_corners=False)
+    return F.grid_sample(x, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+
+
+def _filter3x3(x, kernel):
+    """PIL-style 3x3 filter on every channel of [1, C, H, W] in [0, 1]."""
+    weight = kernel.to(x.dtype).expand(x.shape[1], 1, 3, 3)
+    return F.conv2d(F.pad(x, (1, 1, 1, 1), mode="replicate"), weight, groups=x.shape[1]).clamp_(0, 1)
+
+
+def model_tensor(img, size, mean, std, scale=1.0, brightness=1.0, contrast=1.0, rotation=0,
+                 flip_h=False, flip_v=False, crop_box=None, enhance=False, sharpen=False):
+    """
+    Normalized [1, 3, size, size] float tensor of a decoded image with the adjustments applied.
+
+    `scale` maps `crop_box`, given in full-resolution pixels, onto the decoded image.
+    """
+    if crop_box:
+        img = img.crop(tuple(round(c / scale) for c in crop_box))
+
+    rotation = rotation % 360
+    quarter_turns, remainder = divmod(rotation, 90)
+    if remainder:
+        # Resize so the rotated canvas is at least `size` on its shorter side, then sample
+        # rotation and squash together
+        short_side = min(_rotated_size(img.width, img.height, rotation))
+        factor = min(1.0, size / short_side)
+        resized = (max(1, round(img.width * factor)), max(1, round(img.height * factor)))
+    else:
+        # Right angles only transpose, so resize straight to the model size
+        resized = (size, size)
+    if img.size != resized:
+        img = img.resize(resized, Image.BILINEAR)
+
+    # At model resolution the pixels are small; the float buffer below is what later steps modify
+    x = torch.from_numpy(np.array(img)).permute(2, 0, 1).unsqueeze(0)
+    x = x.to(torch.float32, memory_format=torch.contiguous_format).div_(255)
+    if remainder:
+        x = _rotate(x, rotation, size)
+    elif quarter_turns:
+        x = torch.rot90(x, int(quarter_turns), dims=(2, 3))
+
+    flip_dims = [dim for dim, flip in ((3, flip_h), (2, flip_v)) if flip]
+    if flip_dims:
+        x = torch.flip(x, flip_dims)
+
+    # Brightness blends with black and contrast with the mean gray level, as PIL does
+    if brightness != 1.0:
+        x.mul_(brightness).clamp_(0, 1)
+    if contrast != 1.0:
+        luma = torch.tensor(LUMA_WEIGHTS, dtype=x.dtype).view(1, 3, 1, 1)
+        gray_mean = float((x * luma).sum(dim=1).mean())
+        x.sub_(gray_mean).mul_(contrast).add_(gray_mean).clamp_(0, 1)
+
+    if enhance:
+        x = _filter3x3(x, EDGE_ENHANCE_KERNEL)
+    if sharpen:
+        x = _filter3x3(x, SHARPEN_KERNEL)
+
+    x.sub_(torch.tensor(mean, dtype=x.dtype).view(1, 3, 1, 1))
+    x.div_(torch.tensor(std, dtype=x.dtype).view(1, 3, 1, 1))
+    return x
+
+
+class PreparedImage:
+    """
+    An uploaded image with its adjustments, decoded as little as each consumer needs.
+
+    `tensor()` builds the model input from a reduced decode, or from `source`: an
+    `(image, scale)` pair already decoded from `file_bytes`, such as a preview working copy,
+    when it covers the model size. `display_image()` decodes the image at display resolution
+    and applies the same adjustments to it, once per size.
+    """
+
+    def __init__(self, file_bytes, source=None, **adjustments):
+        self.file_bytes = file_bytes
+        self.source = source
+        self.adjustments = adjustments
+        self._display = {}  # max_side -> adjusted image
+        self._lock = threading.Lock()
+
+    def _source_covers(self, size):
+        img, scale = self.source
+        crop_box = self.adjustments.get("crop_box")
+        if crop_box:
+            return min(crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]) / scale >= size
+        return min(img.size) >= size
+
+    def tensor(self, size, mean, std):
+        if self.source is not None and self._source_covers(size):
+            img, scale = self.source
+        else:
+            img, scale = decode(self.file_bytes, size, self.adjustments.get("crop_box"))
+        return model_tensor(img, size, mean, std, scale=scale, **self.adjustments)
+
+    @property
+    def nbytes(self):
+        """Memory held by the decoded display images."""
+        return sum(img.width * img.height * len(img.getbands()) for img in list(self._display.values()))
+
+    def display_image(self, max_side=0):
+        """The adjusted image, at most `max_side` pixels on its longer side (0: full resolution)."""
+        with self._lock:
+            img = self._display.get(max_side)
+            if img is None:
+                img = self._display[max_side] = self._decode_display(max_side)
+            return img
+
+    def _decode_display(self, max_side):
+        adjustments = dict(self.adjustments)
+        crop_box = adjustments.pop("crop_box", None)
+        img = Image.open(io.BytesIO(self.file_bytes))
+        full_width, full_height = img.size
+        if max_side and img.format == "JPEG":
+            region_width, region_height = full_width, full_height
+            if crop_box:
+                region_width = max(1, crop_box[2] - crop_box[0])
+                region_height = max(1, crop_box[3] - crop_box[1])
+            ratio = max_side / max(region_width, region_height)
+            if ratio < 1:
+                img.draft("RGB", (math.ceil(full_width * ratio), math.ceil(full_height * ratio)))
+        img = img.convert("RGB")
+        if crop_box:
+            scale = full_width / img.width
+            img = img.crop(tuple(round(c / scale) for c in crop_box))
+
+        # Downscale before adjusting, so the adjustments run on display-size pixels
+        if max_side and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.BILINEAR)
+        img = adjust_image(img, **adjustments)
+        if max_side and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.BILINEAR)  # Rotation expands the canvas
+        return img
@@ -0,0 +1,143 @@
+"""
+INT8 dynamic quantization of the TorchScript classifiers for CPU inference.
+
+The ViT/DeiT3 forward pass is dominated by its Linear layers (QKV/projection and MLP).
+Graph-mode dynamic quantization stores their weights as INT8 and quantizes activations
+per batch at run time, which roughly halves CPU latency with a small probability drift.
+Quantized models are cached next to the FP32 file as ``<name>_int8.pt`` (see
+model_cache.py), so later starts load them instead of re-quantizing.
+
+Quantized Linear layers have no backward pass, so explainability maps must be computed
+on the FP32 model.
+
+Measure the agreement with the FP32 models on validation images (from backend/):
+    python quantization.py --images path/to/val_images [--samples 64] [--force]
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+import torch.nn.functional as F
+
+import model_cache
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+def quantize_model(model):
+    """Dynamically quantized (INT8 Linear) copy of a TorchScript model."""
+    from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic_jit
+
+    return quantize_dynamic_jit(model.eval(), {"": default_dynamic_qconfig})
+
+
+def load_or_quantize(path, fp32_model=None, force=False):
+    """
+    Load the cached INT8 variant of the model at `path`, building it if needed.
+
+    The cache is rebuilt when the FP32 file, the torch version or the quantized engine
+    changed since it was written. `fp32_model` must be the unfrozen model loaded from
+    `path` (it is loaded from disk when omitted). Returns `(model, info)` as
+    `model_cache.load_or_build` does.
+    """
+    def build():
+        source = fp32_model if fp32_model is not None else torch.jit.load(path, map_location="cpu")
+        return quantize_model(source)
+
+    return model_cache.load_or_build(
+        path, "int8", build, force=force, engine=torch.backends.quantized.engine
+    )
+
+
+def synthetic_inputs(samples, size=384, seed=0):
+    """Deterministic smooth random images, normalized like the training data."""
+    generator = torch.Generator().manual_seed(seed)
+    coarse = torch.rand(samples, 3, 12, 12, generator=generator)
+    images = F.interpolate(coarse, size=(size, size), mode="bicubic", align_corners=False).clamp_(0, 1)
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+    return (images - mean) / std
+
+
+def image_inputs(image_dir, transform, samples):
+    """Up to `samples` images from `image_dir` (recursively, sorted), as one batch."""
+    from PIL import Image
+
+    paths = []
+    for root, _, files in os.walk(image_dir):
+        paths.extend(os.path.join(root, name) for name in files
+                     if name.lower().endswith(IMAGE_EXTENSIONS))
+    paths = sorted(paths)[:samples]
+    if not paths:
+        raise ValueError(f"No images found in {image_dir}")
+    return torch.stack([transform(Image.open(p).convert("RGB")) for p in paths])
+
+
+def agreement_check(fp32_model, int8_model, inputs):
+    """
+    Compare INT8 with FP32 outputs image by image.
+
+    Reports top-1 agreement, the largest and mean absolute softmax difference, and the
+    per-image latency of both models (after one warm-up forward each).
+    """
+    fp32_probs, int8_probs = [], []
+    fp32_s = int8_s = 0.0
+    with torch.no_grad():
+        fp32_model(inputs[:1])
+        int8_model(inputs[:1])
+        for image in inputs.split(1):
+            started = time.perf_counter()
+            fp32_probs.append(F.softmax(fp32_model(image), dim=1))
+            fp32_s += time.perf_counter() - started
+
+            started = time.perf_counter()
+            int8_probs.append(F.softmax(int8_model(image), dim=1))
+            int8_s += time.perf_counter() - started
+
+    fp32_probs, int8_probs = torch.cat(fp32_probs), torch.cat(int8_probs)
+    diff = (fp32_probs - int8_probs).abs()
+    samples = len(inputs)
+    return {
+        "samples": samples,
+        "top1_agreement": round((fp32_probs.argmax(1) == int8_probs.argmax(1)).float().mean().item(), 4),
+        "max_abs_prob_diff": round(diff.max().item(), 4),
+        "mean_abs_prob_diff": round(diff.mean().item(), 6),
+        "fp32_ms_per_image": round(fp32_s / samples * 1000, 2),
+        "int8_ms_per_image": round(int8_s / samples * 1000, 2),
+        "speedup": round(fp32_s / int8_s, 2) if int8_s > 0 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("models", nargs="*",
+                        default=["models/deit3_best_traced.pt", "models/vit_best_traced.pt"])
+    parser.add_argument("--images", help="Directory of validation images (synthetic inputs if omitted)")
+    parser.add_argument("--samples", type=int, default=32)
+    parser.add_argument("--force", action="store_true", help="Re-quantize even if a cached model is valid")
+    args = parser.parse_args()
+
+    if args.images:
+        import torchvision.transforms as T
+
+        transform = T.Compose([T.Resize((384, 384)), T.ToTensor(), T.Normalize(IMAGENET_MEAN, IMAGENET_STD)])
+        inputs = image_inputs(args.images, transform, args.samples)
+    else:
+        inputs = synthetic_inputs(args.samples)
+
+    for path in args.models:
+        if not os.path.exists(path):
+            print(f"⚠️  {path} not found, skipping")
+            continue
+        fp32_model = torch.jit.load(path, map_location="cpu").eval()
+        int8_model, info = load_or_quantize(path, fp32_model, force=args.force)
+        report = dict(info, **agreement_check(fp32_model, int8_model, inputs))
+        print(f"{path}: {json.dumps(report, indent=2)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Fast heatmap overlay rendering.
+
+Activation maps are colorized through precomputed 256-entry uint8 lookup tables, blended
+with integer arithmetic against a base image that is converted once and shared by every
+overlay of a request, and contour polylines are drawn with one call per contour.
+"""
+import functools
+
+import numpy as np
+from PIL import Image, ImageDraw
+from scipy import ndimage
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    from skimage import measure
+except ImportError:
+    measure = None
+
+COLORMAPS = ("jet", "plasma", "magma")
+CONTOUR_COLOR = (255, 255, 0)
+CONTOUR_WIDTH = 2
+
+
+@functools.lru_cache(maxsize=None)
+def colormap_lut(name):
+    """256x3 uint8 lookup table for a matplotlib colormap (built once per name)."""
+    import matplotlib
+
+    if name not in COLORMAPS:
+        name = "jet"
+    cmap = matplotlib.colormaps[name].resampled(256)
+    return (cmap(np.arange(256))[:, :3] * 255).astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=None)
+def colormap_palette(name):
+    """The LUT flattened into a PIL palette, so colorizing runs in PIL's C code."""
+    return colormap_lut(name).tobytes()
+
+
+def _to_numpy(activation_map):
+    if hasattr(activation_map, "detach"):
+        activation_map = activation_map.detach().cpu().numpy()
+    return np.asarray(activation_map, dtype=np.float32)
+
+
+def normalize_activation(activation_map, smooth=True, sigma=2.0):
+    """Scale to [0, 1], optionally Gaussian-smooth and re-normalize (float32)."""
+    activation_np = _to_numpy(activation_map)
+    peak = activation_np.max()
+    activation_np = activation_np / peak if peak > 0 else np.zeros_like(activation_np)
+
+    if smooth:
+        activation_np = ndimage.gaussian_filter(activation_np, sigma=sigma)
+        peak = activation_np.max()
+        if peak > 0:
+            activation_np = activation_np / peak
+    return activation_np
+
+
+def to_lut_indices(activation_np):
+    """Map [0, 1] floats to uint8 LUT indices the same way matplotlib quantizes them."""
+    return np.clip(activation_np * 256, 0, 255).astype(np.uint8)
+
+
+def attention_contours(activation_np, threshold=0.7):
+    """Contours (arrays of (row, col) points) around regions above `threshold`."""
+    if measure is None:
+        return []
+    peak = activation_np.max()
+    normalized = activation_np / peak if peak > 0 else activation_np
+    try:
+        return measure.find_contours((normalized > threshold).astype(np.uint8), 0.5)
+    except Exception as e:
+        print(f"Contour detection error: {e}")
+        return []
+
+
+class OverlayRenderer:
+    """
+    Renders activation-map overlays onto one shared base image.
+
+    The base image is converted to RGB and pre-multiplied by `(1 - alpha)` once, so each
+    additional overlay only pays for the colorize, resize and a fused add.
+    """
+
+    def __init__(self, base_image, alpha=0.4):
+        self.size = base_image.size
+        self.alpha = float(min(max(alpha, 0.0), 1.0))
+        self._weight = int(round(self.alpha * 256))
+        base = np.asarray(base_image.convert("RGB"), dtype=np.uint16)
+        # (base * (256 - a) + 128) is shared by every overlay blended at this alpha
+        self._base_term = base * (256 - self._weight) + 128
+
+    def colorize(self, activation_np, colormap="jet"):
+        """Colorized heatmap at base-image resolution as a uint8 RGB array."""
+        # Quantize at map resolution, resize the single-channel index image, then
+        # colorize it with a LUT at display resolution
+        indices = to_lut_indices(activation_np)
+        if cv2 is not None:
+            if (indices.shape[1], indices.shape[0]) != self.size:
+                indices = cv2.resize(indices, self.size, interpolation=cv2.INTER_LINEAR)
+            return cv2.LUT(cv2.merge([indices, indices, indices]), colormap_lut(colormap).reshape(1, 256, 3))
+
+        indices = Image.fromarray(indices, mode="L")
+        if indices.size != self.size:
+            indices = indices.resize(self.size, Image.BILINEAR)
+        indices.putpalette(colormap_palette(colormap))
+        return np.asarray(indices.convert("RGB"))
+
+    def render(self, activation_map, colormap="jet", smooth=True, sigma=2.0,
+               show_contours=True, contour_threshold=0.7):
+        """Blend one activation map over the base image and return a PIL image."""
+        activation_np = normalize_activation(activation_map, smooth=smooth, sigma=sigma)
+        heatmap = self.colorize(activation_np, colormap)
+
+        blended = heatmap.astype(np.uint16)
+        blended *= self._weight
+        blended += self._base_term
+        blended >>= 8
+        result = Image.fromarray(blended.astype(np.uint8), mode="RGB")
+
+        if show_contours:
+            self.draw_contours(result, activation_np, contour_threshold)
+        return result
+
+    def draw_contours(self, image, activation_np, threshold=0.7):
+        """Draw each top-attention contour as a single polyline call."""
+        try:
+            contours = attention_contours(activation_np, threshold=threshold)
+            if not contours:
+                return
+
+            draw = ImageDraw.Draw(image)
+            scale = np.array([
+                image.size[1] / activation_np.shape[0],
+                image.size[0] / activation_np.shape[1]
+            ])
+            for contour in contours:
+                if len(contour) > 2:
+                    # (row, col) -> (x, y) at output resolution
+                    points = (contour * scale).astype(np.int32)[:, ::-1]
+                    draw.line(points.ravel().tolist(), fill=CONTOUR_COLOR, width=CONTOUR_WIDTH)
+        except Exception as e:
+            print(f"Contour drawing error: {e}")
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import pytest
+import torch
+
+import app_gradcam
+from app_gradcam import AdmissionController, MicroBatchScheduler, ServerBusy
+
+
+def test_slots_bound_concurrency():
+    admission = AdmissionController(max_concurrent=2, max_queued=8, timeout=5)
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        async with admission.slot():
+            peak = max(peak, admission.active)
+            await asyncio.sleep(0.02)
+
+    async def main():
+        await asyncio.gather(*(job() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert admission.stats()["active"] == 0
+    assert admission.stats()["waiting"] == 0
+
+
+def test_full_queue_is_rejected_with_429():
+    admission = AdmissionController(max_concurrent=1, max_queued=1, timeout=5)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def holder():
+            async with admission.slot():
+                await release.wait()
+
+        tasks = [asyncio.create_task(holder()) for _ in range(2)]
+        await asyncio.sleep(0.01)  # One holds the slot, the other waits for it
+        with pytest.raises(ServerBusy) as busy:
+            async with admission.slot():
+                pass
+        release.set()
+        await asyncio.gather(*tasks)
+        return busy.value
+
+    error = asyncio.run(main())
+    assert error.status_code == 429
+    assert admission.stats()["rejected"] == 1
+
+
+def test_queue_timeout_is_503():
+    admission = AdmissionController(max_concurrent=1, max_queued=4, timeout=0.05)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def holder():
+            async with admission.slot():
+                await release.wait()
+
+        task = asyncio.create_task(holder())
+        await asyncio.sleep(0.01)
+        with pytest.raises(ServerBusy) as busy:
+            async with admission.slot():
+                pass
+        release.set()
+        await task
+        return busy.value
+
+    error = asyncio.run(main())
+    assert error.status_code == 503
+    assert admission.stats()["timed_out"] == 1
+    assert admission.stats()["waiting"] == 0
+
+
+def test_default_config_forms_batches():
+    # /predict holds its slot while it waits for the batcher, as here
+    admission = AdmissionController(app_gradcam.MAX_CONCURRENT_JOBS, app_gradcam.MAX_QUEUED_JOBS, 5)
+
+    def forward(batch):
+        time.sleep(0.05)
+        return batch
+
+    scheduler = MicroBatchScheduler(
+        "defaults", forward, max_batch_size=app_gradcam.BATCH_MAX_SIZE, max_wait_ms=app_gradcam.BATCH_MAX_WAIT_MS
+    )
+
+    async def request():
+        async with admission.slot():
+            await asyncio.wrap_future(scheduler.submit(torch.zeros(1, 4)))
+
+    async def main():
+        await asyncio.gather(*(request() for _ in range(app_gradcam.BATCH_MAX_SIZE)))
+
+    asyncio.run(main())
+    assert max(scheduler.stats()["batch_size_histogram"]) > 1
@@ -0,0 +1,43 @@
+import time
+
+from app_gradcam import ArtifactStore
+
+
+def test_session_round_trip():
+    store = ArtifactStore(ttl_s=60, max_bytes=1 << 20)
+    artifact_id = store.create(b"upload", {"model": "vit"})
+    session = store.get(artifact_id)
+    assert session["file_bytes"] == b"upload"
+    assert session["spec"] == {"model": "vit"}
+    assert store.get("not-an-id") is None
+
+
+def test_sessions_expire():
+    store = ArtifactStore(ttl_s=0.05, max_bytes=1 << 20)
+    artifact_id = store.create(b"upload", {})
+    time.sleep(0.1)
+    assert store.get(artifact_id) is None
+    assert store.stats()["expired"] == 1
+    assert store.stats()["sessions"] == 0
+
+
+def test_least_recently_used_session_is_evicted():
+    store = ArtifactStore(ttl_s=60, max_bytes=2500)
+    first = store.create(b"x" * 1000, {})
+    second = store.create(b"x" * 1000, {})
+    store.get(first)
+    store.create(b"x" * 1000, {})
+    assert store.get(second) is None
+    assert store.get(first) is not None
+
+
+def test_disk_sessions_are_shared(tmp_path):
+    writer = ArtifactStore(ttl_s=60, max_bytes=1 << 20, disk_dir=str(tmp_path))
+    artifact_id = writer.create(b"upload", {"model": "vit"}, maps={"gradcam": None})
+    # Another worker process sees the upload and spec, but not the in-memory inputs and maps
+    reader = ArtifactStore(ttl_s=60, max_bytes=1 << 20, disk_dir=str(tmp_path))
+    session = reader.get(artifact_id)
+    assert session["file_bytes"] == b"upload"
+    assert session["spec"] == {"model": "vit"}
+    assert session["maps"] is None
+    assert reader.stats()["disk_loads"] == 1
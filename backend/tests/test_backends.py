@@ -0,0 +1,61 @@
+import types
+
+import torch
+
+import app_gradcam
+import backends
+
+
+class Linear:
+    def __init__(self, weight, bias=0.0):
+        self.weight = weight
+        self.bias = bias
+
+    def __call__(self, batch):
+        return batch.flatten(1)[:, :5] @ self.weight + self.bias
+
+
+WEIGHT = torch.randn(5, 4, generator=torch.Generator().manual_seed(0))
+
+
+def test_agreement_check_reports_differences():
+    inputs = torch.randn(6, 3, 8, 8)
+    same = backends.agreement_check(Linear(WEIGHT), Linear(WEIGHT), inputs)
+    assert same["samples"] == 6
+    assert same["top1_agreement"] == 1.0
+    assert same["max_abs_prob_diff"] == 0.0
+
+    shifted = backends.agreement_check(Linear(WEIGHT), Linear(WEIGHT, torch.tensor([5.0, 0, 0, 0])), inputs)
+    assert shifted["max_abs_prob_diff"] > 0.1
+
+
+def check(candidate):
+    entry = types.SimpleNamespace(name="m", input_size=8)
+    state = types.SimpleNamespace(graph=Linear(WEIGHT))
+    candidates = {"torchscript": backends.TorchScriptBackend(state.graph), "onnxruntime": candidate}
+    errors = {}
+    agreement = app_gradcam.check_backend_agreement(entry, state, candidates, errors)
+    return candidates, errors, agreement
+
+
+def test_matching_backend_is_kept():
+    candidates, errors, agreement = check(Linear(WEIGHT.clone()))
+    assert set(candidates) == {"torchscript", "onnxruntime"}
+    assert agreement["onnxruntime"]["passed"]
+    assert not errors
+
+
+def test_disagreeing_backend_falls_back_to_torchscript():
+    candidates, errors, agreement = check(Linear(-WEIGHT))
+    assert set(candidates) == {"torchscript"}
+    assert not agreement["onnxruntime"]["passed"]
+    assert "onnxruntime" in errors
+
+
+def test_failing_backend_is_dropped():
+    def broken(batch):
+        raise RuntimeError("no kernel")
+
+    candidates, errors, agreement = check(broken)
+    assert set(candidates) == {"torchscript"}
+    assert agreement["onnxruntime"] == {"passed": False, "error": "no kernel"}
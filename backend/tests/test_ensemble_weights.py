@@ -0,0 +1,48 @@
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import app_gradcam
+from app_gradcam import parse_ensemble_weights
+
+MEMBERS = ("deit3", "vit")
+
+
+def test_weights_are_parsed():
+    assert parse_ensemble_weights("", MEMBERS) == {}
+    assert parse_ensemble_weights("deit3:0.4, vit:0.6", MEMBERS) == {"deit3": 0.4, "vit": 0.6}
+    assert parse_ensemble_weights("vit:0", MEMBERS) == {"vit": 0.0}
+
+
+def test_int8_members_use_base_names():
+    assert parse_ensemble_weights("vit:2", ("deit3-int8", "vit-int8")) == {"vit": 2.0}
+
+
+@pytest.mark.parametrize("spec", ["deit:2", "deit3:0,vit:0", "vit:-1", "vit:heavy", "ensemble:1"])
+def test_invalid_weights_are_rejected(spec):
+    with pytest.raises(ValueError):
+        parse_ensemble_weights(spec, MEMBERS)
+
+
+@pytest.mark.parametrize("endpoint", ["/predict", "/predict/stream", "/predict/batch"])
+@pytest.mark.parametrize("spec", ["deit:2", "deit3:0,vit:0"])
+def test_invalid_weights_are_400(endpoint, spec):
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32)).save(buf, format="JPEG")
+    field = "files" if endpoint == "/predict/batch" else "file"
+    response = TestClient(app_gradcam.app).post(
+        endpoint,
+        files={field: ("a.jpg", buf.getvalue(), "image/jpeg")},
+        data={"model": "ensemble", "ensemble_weights": spec}
+    )
+    assert response.status_code == 400
+    assert "ensemble_weights" in response.json()["error"]
+
+
+def test_hyphenated_member_names():
+    members = ("deit3-small", "vit-base-int8")
+    assert parse_ensemble_weights("deit3-small:1,vit-base:3", members) == {"deit3-small": 1.0, "vit-base": 3.0}
+    with pytest.raises(ValueError):
+        parse_ensemble_weights("deit3:1", members)
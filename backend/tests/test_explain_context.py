@@ -0,0 +1,36 @@
+import torch
+
+from app_gradcam import ExplainContext
+
+
+class Tiny(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.linear = torch.nn.Linear(3 * 8 * 8, 5)
+
+    def forward(self, batch):
+        return self.linear(batch.flatten(1))
+
+
+def test_logits_are_computed_once():
+    context = ExplainContext(Tiny(), torch.randn(1, 3, 8, 8))
+    first = context.logits()
+    assert context.logits() is first
+    assert context.pred_idx == int(first.argmax())
+    assert context.stats()["passes"] == {"forward": 1, "backward": 0}
+    assert context.stats()["stages"]["logits"] == {"computed": 1, "cached": 2}
+
+
+def test_memo_and_seed():
+    context = ExplainContext(Tiny(), torch.randn(1, 3, 8, 8), pred_idx=2)
+    calls = []
+    compute = lambda: calls.append(1) or "map"
+    assert context.memo("multilayer", compute) == "map"
+    assert context.memo("multilayer", compute) == "map"
+    assert len(calls) == 1
+    context.seed("saliency", "seeded")
+    assert context.cached("saliency") == "seeded"
+    assert context.memo("saliency", compute) == "seeded"
+    assert context.pred_idx == 2
+    assert context.stats()["passes"]["forward"] == 0
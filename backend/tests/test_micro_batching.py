@@ -0,0 +1,80 @@
+import threading
+import time
+
+import torch
+import torch.nn.functional as F
+
+from app_gradcam import MicroBatchScheduler
+
+
+def slow_forward(delay, started=None):
+    def forward(batch):
+        if started is not None:
+            started.set()
+        time.sleep(delay)
+        return batch * 2
+    return forward
+
+
+def test_lone_request_is_not_delayed():
+    scheduler = MicroBatchScheduler("lone", slow_forward(0), max_batch_size=8, max_wait_ms=2000)
+    started = time.perf_counter()
+    scheduler.submit(torch.zeros(1, 4)).result(timeout=5)
+    assert time.perf_counter() - started < 1.0
+    assert scheduler.stats()["batch_size_histogram"] == {1: 1}
+
+
+def test_concurrent_requests_are_batched():
+    scheduler = MicroBatchScheduler("burst", slow_forward(0.05), max_batch_size=8, max_wait_ms=20)
+    inputs = [torch.randn(1, 4) for _ in range(8)]
+    results = [None] * len(inputs)
+    barrier = threading.Barrier(len(inputs))
+
+    def request(i):
+        barrier.wait()
+        results[i] = scheduler.submit(inputs[i]).result(timeout=5)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(scheduler.stats()["batch_size_histogram"]) > 1
+    for tensor, probs in zip(inputs, results):
+        assert torch.allclose(probs, F.softmax(tensor * 2, dim=1))
+
+
+def test_requests_get_their_own_rows():
+    started = threading.Event()
+    scheduler = MicroBatchScheduler("rows", slow_forward(0.1, started), max_batch_size=8, max_wait_ms=50)
+    # Keep the worker busy so the next two requests queue behind it and share a batch
+    busy = scheduler.submit(torch.zeros(1, 4))
+    started.wait(timeout=5)
+    first, second = torch.randn(2, 4), torch.randn(3, 4)
+    futures = [scheduler.submit(first), scheduler.submit(second)]
+    busy.result(timeout=5)
+
+    assert futures[0].result(timeout=5).shape == (2, 4)
+    assert torch.allclose(futures[1].result(timeout=5), F.softmax(second * 2, dim=1))
+    assert scheduler.stats()["batch_size_histogram"] == {1: 1, 5: 1}
+
+
+def test_failed_batch_falls_back_to_single_requests():
+    started = threading.Event()
+
+    def forward(batch):
+        started.set()
+        time.sleep(0.1)
+        if batch.shape[0] > 1:
+            raise RuntimeError("batch too large")
+        return batch
+
+    scheduler = MicroBatchScheduler("fallback", forward, max_batch_size=8, max_wait_ms=50)
+    busy = scheduler.submit(torch.zeros(1, 4))
+    started.wait(timeout=5)
+    futures = [scheduler.submit(torch.randn(1, 4)) for _ in range(3)]
+    busy.result(timeout=5)
+    for future in futures:
+        assert future.result(timeout=5).shape == (1, 4)
+    assert scheduler.stats()["batch_size_histogram"] == {1: 1, 3: 1}
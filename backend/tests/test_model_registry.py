@@ -0,0 +1,102 @@
+import json
+import os
+import time
+
+import pytest
+
+import model_registry
+
+
+class Loaded(model_registry.ModelState):
+    def __init__(self, entry, version):
+        super().__init__()
+        self.nbytes = 100
+        self.version = version
+
+
+@pytest.fixture
+def make_registry(tmp_path):
+    def make(names=("a", "b", "c"), max_bytes=0, idle_s=0.0, loader=None):
+        models = {}
+        for name in names:
+            path = tmp_path / f"{name}.pt"
+            path.write_bytes(b"weights")
+            models[name] = {"path": str(path)}
+        config = tmp_path / "models.json"
+        config.write_text(json.dumps({"default": names[0], "ensemble": list(names), "models": models}))
+        loads = []
+
+        def default_loader(entry, previous):
+            loads.append(entry.name)
+            return Loaded(entry, len(loads))
+
+        registry = model_registry.ModelRegistry(
+            str(config), loader or default_loader,
+            defaults={"input_size": 384, "class_names": {0: "x"}, "preload": False},
+            fallback_config={}, max_bytes=max_bytes, idle_s=idle_s, reload_interval_s=0
+        )
+        return registry, loads
+    return make
+
+
+def test_models_load_once_on_first_use(make_registry):
+    registry, loads = make_registry()
+    assert registry.loaded() == {}
+    assert registry.get("a") is registry.get("a")
+    assert loads == ["a"]
+    assert registry.get("missing") is None
+
+
+def test_least_recently_used_idle_model_is_evicted(make_registry):
+    registry, _ = make_registry(max_bytes=250)
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")  # "b" is now the least recently used
+    registry.get("c")
+    assert set(registry.loaded()) == {"a", "c"}
+    assert registry.entries["b"].evictions == 1
+    assert registry.memory_used() == 200
+
+
+def test_recently_used_models_are_not_evicted(make_registry):
+    registry, _ = make_registry(max_bytes=250, idle_s=60)
+    for name in ("a", "b", "c"):
+        registry.get(name)
+    assert set(registry.loaded()) == {"a", "b", "c"}
+    assert registry.stats()["memory_used_bytes"] == 300
+
+
+def test_evicted_model_loads_again(make_registry):
+    registry, loads = make_registry(max_bytes=150)
+    registry.get("a")
+    registry.get("b")
+    assert registry.get("a").version == 3
+    assert loads == ["a", "b", "a"]
+
+
+def test_changed_file_is_reloaded_once_stable(make_registry):
+    registry, _ = make_registry()
+    path = registry.entries["a"].path
+    assert registry.get("a").version == 1
+    with open(path, "ab") as f:
+        f.write(b" v2")
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+    registry.check_for_changes()  # Seen changing; waits one more poll
+    assert registry.get("a").version == 1
+    registry.check_for_changes()
+    assert registry.get("a").version == 2
+    assert registry.entries["a"].reloads == 1
+
+
+def test_broken_file_is_not_retried(make_registry):
+    attempts = []
+
+    def loader(entry, previous):
+        attempts.append(entry.name)
+        raise ValueError("bad graph")
+
+    registry, _ = make_registry(loader=loader)
+    assert registry.get("a") is None
+    assert registry.get("a") is None
+    assert attempts == ["a"]
+    assert registry.stats()["models"]["a"]["state"] == "error"
@@ -0,0 +1,70 @@
+import asyncio
+
+import torch
+
+from app_gradcam import ResultCache, cached_uncertainty, uncertainty_field
+
+PREPROCESSING = dict(brightness=1.0, contrast=1.0, rotation=0, flip_h=False, flip_v=False,
+                     enhance=False, sharpen=False)
+
+
+def key(file_bytes=b"image", model="vit", **overrides):
+    params = {**PREPROCESSING, "ensemble_weights": {}, "model_version": "v1", **overrides}
+    return ResultCache.make_key(file_bytes, model, **params)
+
+
+def test_key_is_stable_and_order_independent():
+    assert key() == key()
+    reordered = dict(reversed(list({**PREPROCESSING, "ensemble_weights": {}, "model_version": "v1"}.items())))
+    assert ResultCache.make_key(b"image", "vit", **reordered) == key()
+
+
+def test_key_covers_content_model_and_parameters():
+    keys = {
+        key(),
+        key(file_bytes=b"other image"),
+        key(model="deit3"),
+        key(brightness=1.2),
+        key(flip_h=True),
+        key(ensemble_weights={"deit3": 0.4, "vit": 0.6}),
+        key(model_version="v2"),
+    }
+    assert len(keys) == 7
+
+
+def test_lru_eviction_by_bytes():
+    record = {"probs": torch.zeros(1, 256)}  # 1 KiB
+    cache = ResultCache(max_bytes=2500)
+    cache.put("a", record)
+    cache.put("b", record)
+    assert cache.get("a") is not None  # "b" is now the least recently used
+    cache.put("c", record)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_identical_requests_are_coalesced():
+    cache = ResultCache(max_bytes=1 << 20)
+    computed = []
+
+    async def request():
+        async with cache.lock("k"):
+            if cache.get("k") is None:
+                await asyncio.sleep(0.01)
+                computed.append(1)
+                cache.put("k", {"probs": torch.zeros(1, 4)})
+
+    async def main():
+        await asyncio.gather(*(request() for _ in range(4)))
+
+    asyncio.run(main())
+    assert len(computed) == 1
+    assert cache.stats()["coalesced"] == 3
+    assert cache.stats()["in_flight_keys"] == 0
+
+
+def test_uncertainty_is_kept_per_sampling_mode():
+    record = {uncertainty_field(False): {"adaptive": False, "num_samples": 10}}
+    assert cached_uncertainty(record, False)["num_samples"] == 10
+    assert cached_uncertainty(record, True) is None
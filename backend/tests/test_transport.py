@@ -0,0 +1,65 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import transport
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, transport.JSON),
+    ("", transport.JSON),
+    ("application/json", transport.JSON),
+    ("multipart/mixed", transport.MULTIPART),
+    (transport.ENVELOPE_MEDIA_TYPE, transport.ENVELOPE),
+    ("text/html, image/png", transport.JSON),
+    ("application/json;q=0.5, multipart/mixed", transport.MULTIPART),
+    ("multipart/mixed;q=0.2, application/vnd.gi-endoscopy.envelope;q=0.9", transport.ENVELOPE),
+    ("multipart/mixed;q=bogus", transport.JSON),
+    ("*/*, multipart/mixed;q=0.5", transport.JSON),
+    ("multipart/mixed, */*", transport.MULTIPART),
+    ("*/*;q=0.1, multipart/mixed;q=0.5", transport.MULTIPART),
+    ("application/json, multipart/mixed", transport.JSON),
+])
+def test_negotiate(accept, expected):
+    assert transport.negotiate(accept) == expected
+
+
+def test_override_wins():
+    assert transport.negotiate("multipart/mixed", " Envelope ") == transport.ENVELOPE
+    with pytest.raises(ValueError):
+        transport.negotiate("application/json", "xml")
+
+
+def test_envelope_round_trip():
+    parts = [("gradcam", "image/png", b"\x89PNG..."), ("mask", "image/webp", b"RIFF....")]
+    app = FastAPI()
+
+    @app.get("/")
+    def envelope():
+        return transport.envelope_response({"predicted_class": "polyps"}, parts)
+
+    response = TestClient(app).get("/")
+    assert response.headers["content-type"] == transport.ENVELOPE_MEDIA_TYPE
+    metadata, artifacts = transport.read_envelope(response.content)
+    assert metadata["predicted_class"] == "polyps"
+    assert artifacts == {name: payload for name, _, payload in parts}
+
+
+def test_multipart_parts():
+    app = FastAPI()
+
+    @app.get("/")
+    def multipart():
+        return transport.multipart_response({"ok": True}, [("gradcam", "image/png", b"abc")])
+
+    response = TestClient(app).get("/")
+    boundary = response.headers["content-type"].split("boundary=")[1]
+    sections = response.content.split(f"--{boundary}".encode())
+    assert sections[-1] == b"--\r\n"
+    assert b'name="metadata"' in sections[1] and b'"ok":true' in sections[1]
+    assert sections[2].endswith(b"\r\n\r\nabc\r\n")
+
+
+def test_stream_framing():
+    assert transport.sse_event("prediction", {"a": 1}) == 'event: prediction\ndata: {"a":1}\n\n'
+    assert transport.ndjson_line({"done": True}) == '{"done":true}\n'
@@ -0,0 +1,48 @@
+import torch
+import torch.nn.functional as F
+
+from app_gradcam import estimate_uncertainty, estimate_uncertainty_batch
+
+
+class Tiny(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.linear = torch.nn.Linear(3 * 4 * 4, 5)
+
+    def forward(self, batch):
+        return self.linear(batch.flatten(1))
+
+
+def test_clean_output_is_reused_as_first_sample():
+    model, image = Tiny(), torch.randn(1, 3, 4, 4)
+    calls = []
+    counted = lambda batch: calls.append(batch.shape[0]) or model(batch)
+    with torch.no_grad():
+        clean = F.softmax(model(image), dim=1)
+    result = estimate_uncertainty(counted, image, num_samples=10, clean_output=clean, chunk_size=5)
+    assert result["num_samples"] == 10
+    assert sum(calls) == 9
+    assert 0.0 <= result["uncertainty_score"] <= 1.0
+    assert not result["adaptive"]
+
+
+def test_adaptive_sampling_stops_when_converged():
+    model, image = Tiny(), torch.randn(1, 3, 4, 4)
+    result = estimate_uncertainty(model, image, num_samples=40, adaptive=True, tolerance=1.0)
+    assert result["converged"]
+    assert result["num_samples"] < 40
+
+
+def test_batch_matches_single_image_shape():
+    model, images = Tiny(), torch.randn(3, 3, 4, 4)
+    with torch.no_grad():
+        clean = F.softmax(model(images), dim=1)
+    results = estimate_uncertainty_batch(model, images, clean, num_samples=6)
+    single = estimate_uncertainty(model, images[:1], num_samples=6, clean_output=clean[:1])
+    assert len(results) == 3
+    assert set(results[0]) == set(single)
+    assert all(result["num_samples"] == 6 for result in results)
+    # The noise is small, so each image keeps (about) its own clean confidence
+    for result, probs in zip(results, clean):
+        assert abs(result["mean_confidence"] - float(probs.max())) < 0.05
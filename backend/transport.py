@@ -0,0 +1,159 @@
+"""
+Response transports for endpoints that return JSON metadata plus binary artifacts.
+
+Clients choose a transport through the Accept header (or an explicit override):
+
+- ``application/json`` (default): artifacts are base64 strings inside the JSON body.
+- ``multipart/mixed``: a JSON part followed by one raw part per artifact.
+- ``application/vnd.gi-endoscopy.envelope``: a compact binary envelope::
+
+      b"GIEV" | version (u8) | 3 reserved bytes | metadata length (u32, big-endian)
+      | metadata JSON (UTF-8) | artifact bytes, concatenated
+
+  The metadata's ``artifacts`` list gives each artifact's ``name``, ``content_type``,
+  ``offset`` (from the first byte after the metadata) and ``length``.
+
+Streaming endpoints emit Server-Sent Events (``text/event-stream``) built with `sse_event`,
+or newline-delimited JSON (``application/x-ndjson``) built with `ndjson_line`.
+"""
+import json
+import struct
+import uuid
+
+from fastapi.responses import StreamingResponse
+
+JSON = "json"
+MULTIPART = "multipart"
+ENVELOPE = "envelope"
+FORMATS = (JSON, MULTIPART, ENVELOPE)
+
+SSE_MEDIA_TYPE = "text/event-stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Stop reverse proxies (nginx) from buffering streamed responses until they end
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+ENVELOPE_MEDIA_TYPE = "application/vnd.gi-endoscopy.envelope"
+ENVELOPE_MAGIC = b"GIEV"
+ENVELOPE_VERSION = 1
+
+MEDIA_TYPES = {
+    "application/json": JSON,
+    "multipart/mixed": MULTIPART,
+    ENVELOPE_MEDIA_TYPE: ENVELOPE,
+    "*/*": JSON,  # A wildcard accepts the default at its own q-value
+}
+
+
+def negotiate(accept, override=None):
+    """
+    Pick a transport from an Accept header, honouring q-values.
+
+    `override` (one of FORMATS) wins when given; anything unrecognised falls back to JSON.
+    """
+    if override:
+        override = override.strip().lower()
+        if override not in FORMATS:
+            raise ValueError(f"unknown response format '{override}', expected one of {', '.join(FORMATS)}")
+        return override
+
+    best, best_q = JSON, 0.0
+    for media_range in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        fmt = MEDIA_TYPES.get(media_type.lower())
+        # Ties keep the earlier entry, so JSON (or "*/*") listed first stays JSON
+        if fmt is not None and q > best_q:
+            best, best_q = fmt, q
+    return best
+
+
+def sse_event(event, data):
+    """One Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def ndjson_line(data):
+    """One newline-terminated JSON record."""
+    return json.dumps(data, separators=(",", ":")) + "\n"
+
+
+def describe_parts(parts):
+    """Artifact descriptors (name, content type, offset, length) for `(name, type, bytes)` parts."""
+    descriptors, offset = [], 0
+    for name, content_type, payload in parts:
+        descriptors.append({
+            "name": name,
+            "content_type": content_type,
+            "offset": offset,
+            "length": len(payload)
+        })
+        offset += len(payload)
+    return descriptors
+
+
+def _json_bytes(metadata):
+    return json.dumps(metadata, separators=(",", ":")).encode()
+
+
+def multipart_response(metadata, parts, status_code=200, headers=None):
+    """Stream `metadata` as a JSON part followed by one raw part per artifact."""
+    boundary = uuid.uuid4().hex
+    metadata = dict(metadata, artifacts=describe_parts(parts))
+
+    def _part(name, content_type, payload):
+        head = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f'Content-Disposition: inline; name="{name}"\r\n'
+            f"Content-Length: {len(payload)}\r\n\r\n"
+        ).encode()
+        return head, payload, b"\r\n"
+
+    def _body():
+        yield from _part("metadata", "application/json", _json_bytes(metadata))
+        for part in parts:
+            yield from _part(*part)
+        yield f"--{boundary}--\r\n".encode()
+
+    return StreamingResponse(
+        _body(),
+        status_code=status_code,
+        media_type=f"multipart/mixed; boundary={boundary}",
+        headers=headers
+    )
+
+
+def envelope_response(metadata, parts, status_code=200, headers=None):
+    """Stream `metadata` and the artifacts in the binary envelope format."""
+    metadata_bytes = _json_bytes(dict(metadata, artifacts=describe_parts(parts)))
+
+    def _body():
+        yield ENVELOPE_MAGIC + struct.pack(">B3xI", ENVELOPE_VERSION, len(metadata_bytes))
+        yield metadata_bytes
+        for _, _, payload in parts:
+            yield payload
+
+    return StreamingResponse(_body(), status_code=status_code, media_type=ENVELOPE_MEDIA_TYPE, headers=headers)
+
+
+def read_envelope(data):
+    """Decode an envelope into `(metadata, {name: bytes})` (for clients and tooling)."""
+    if data[:4] != ENVELOPE_MAGIC:
+        raise ValueError("not a GI envelope")
+    version, length = struct.unpack(">B3xI", data[4:12])
+    if version != ENVELOPE_VERSION:
+        raise ValueError(f"unsupported envelope version {version}")
+    metadata = json.loads(data[12:12 + length])
+    body = memoryview(data)[12 + length:]
+    artifacts = {
+        artifact["name"]: bytes(body[artifact["offset"]:artifact["offset"] + artifact["length"]])
+        for artifact in metadata.get("artifacts", [])
+    }
+    return metadata, artifacts
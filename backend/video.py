@@ -0,0 +1,176 @@
+"""
+Endoscopy video analysis: frame sampling, near-duplicate skipping and temporal smoothing.
+
+`FrameSampler` decodes a video as a stream. Frames between samples are only grabbed, not
+decoded into images. Each sampled frame is compared with the last frame that went to the
+models on a small grayscale thumbnail, and near-duplicates are reported without being
+resized or classified. `TemporalSmoother` and `build_segments` turn the per-sample class
+probabilities into a timeline of segments.
+"""
+import threading
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+THUMB_SIZE = 32  # Side of the grayscale thumbnail used for duplicate detection
+
+
+class FrameSampler:
+    """
+    Streams the frames of a video file sampled at `sample_fps`.
+
+    A sampled frame is a duplicate when the mean absolute difference between its thumbnail
+    and the last kept frame's thumbnail is below `duplicate_threshold` (0-255 scale, 0
+    disables skipping). Kept frames are returned as RGB uint8 arrays of `size` x `size`.
+    """
+
+    def __init__(self, path, sample_fps=2.0, duplicate_threshold=2.0, size=384):
+        if cv2 is None:
+            raise RuntimeError("OpenCV is required for video analysis")
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError("Could not open video")
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else 25.0
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        self.step = max(1, round(self.fps / sample_fps)) if sample_fps > 0 else 1
+        self.duplicate_threshold = duplicate_threshold
+        self.size = size
+        self.exhausted = False
+        self.counters = {"frames": 0, "sampled": 0, "duplicates": 0, "kept": 0}
+        self._index = 0
+        self._last_thumb = None
+        self._lock = threading.Lock()
+
+    @property
+    def sample_interval(self):
+        """Seconds between two samples."""
+        return self.step / self.fps
+
+    def next_batch(self, max_frames):
+        """
+        The next samples, up to and including the `max_frames`-th kept frame (blocking).
+
+        Returns `(samples, frames)`: `samples` lists `(timestamp_s, kept)` for every sampled
+        frame in order, and `frames` holds the images of the kept ones. Both are empty once
+        the video is exhausted.
+        """
+        samples, frames = [], []
+        with self._lock:
+            while len(frames) < max_frames and not self.exhausted:
+                index = self._index
+                self._index += 1
+                if index % self.step:
+                    # Not sampled: advance without decoding the frame into an image
+                    if not self.capture.grab():
+                        self.exhausted = True
+                    else:
+                        self.counters["frames"] += 1
+                    continue
+
+                ok, frame = self.capture.read()
+                if not ok:
+                    self.exhausted = True
+                    break
+                self.counters["frames"] += 1
+                self.counters["sampled"] += 1
+                timestamp = index / self.fps
+
+                thumb = cv2.resize(
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (THUMB_SIZE, THUMB_SIZE),
+                    interpolation=cv2.INTER_AREA
+                ).astype(np.int16)
+                if (self._last_thumb is not None
+                        and np.abs(thumb - self._last_thumb).mean() < self.duplicate_threshold):
+                    self.counters["duplicates"] += 1
+                    samples.append((timestamp, False))
+                    continue
+
+                self._last_thumb = thumb
+                self.counters["kept"] += 1
+                resized = cv2.resize(frame, (self.size, self.size), interpolation=cv2.INTER_AREA)
+                samples.append((timestamp, True))
+                frames.append(cv2.cvtColor(resized, cv2.COLOR_BGR2RGB))
+        return samples, frames
+
+    def close(self):
+        # Waits for an in-flight next_batch, which runs on another thread
+        with self._lock:
+            self.capture.release()
+            self.exhausted = True
+
+
+class TemporalSmoother:
+    """
+    Causal exponential moving average over per-sample class probabilities.
+
+    `alpha` is the weight of the newest sample (1.0 disables smoothing).
+    """
+
+    def __init__(self, alpha=0.4):
+        self.alpha = float(min(max(alpha, 0.0), 1.0)) or 1.0
+        self._state = None
+
+    def update(self, probs):
+        probs = np.asarray(probs, dtype=np.float32)
+        if self._state is None:
+            self._state = probs.copy()
+        else:
+            self._state = self.alpha * probs + (1.0 - self.alpha) * self._state
+        return self._state
+
+
+def _runs(labels):
+    """`(start, end)` index ranges of consecutive equal labels."""
+    if len(labels) == 0:
+        return []
+    boundaries = np.flatnonzero(np.diff(labels)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(labels)]))
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def build_segments(timestamps, probs, class_names, interval, min_segment_s=0.0):
+    """
+    Timeline segments from smoothed per-sample probabilities ([T, num_classes]).
+
+    Runs of samples sharing the same top class form a segment. Runs shorter than
+    `min_segment_s` are absorbed into the preceding segment (or the following one at the
+    start of the video).
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    probs = np.asarray(probs, dtype=np.float32)
+    if len(timestamps) == 0:
+        return []
+    labels = probs.argmax(axis=1)
+
+    if min_segment_s > 0:
+        runs = _runs(labels)
+        for i, (start, end) in enumerate(runs):
+            if len(runs) == 1:
+                break
+            duration = timestamps[end - 1] + interval - timestamps[start]
+            if duration >= min_segment_s:
+                continue
+            if start > 0:
+                labels[start:end] = labels[start - 1]
+            elif i + 1 < len(runs):
+                labels[start:end] = labels[runs[i + 1][0]]
+
+    segments = []
+    for start, end in _runs(labels):
+        label = int(labels[start])
+        confidence = probs[start:end, label]
+        segments.append({
+            "start_s": round(float(timestamps[start]), 3),
+            "end_s": round(float(timestamps[end - 1] + interval), 3),
+            "class": class_names[label],
+            "mean_confidence": round(float(confidence.mean()) * 100, 2),
+            "peak_confidence": round(float(confidence.max()) * 100, 2),
+            "samples": end - start
+        })
+    return segments
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import axios from "axios";
 import UploadSection from "./components/UploadSection";
 import ModelSelector from "./components/ModelSelector";
@@ -39,6 +39,8 @@ function App() {
     contour_threshold: 0.7,
   });
 
+  const rerenderTimer = useRef(null);
+
   // Check available models on mount
   useEffect(() => {
     checkModels();
@@ -75,6 +77,36 @@ function App() {
     setPreprocessSettings(settings);
   };
 
+  // Restyle the current result's overlays on the server without re-running the models
+  const handleHeatmapSettingsChange = (settings) => {
+    setHeatmapSettings(settings);
+    if (!result || !result.result_id) return;
+
+    clearTimeout(rerenderTimer.current);
+    rerenderTimer.current = setTimeout(async () => {
+      const formData = new FormData();
+      formData.append("result_id", result.result_id);
+      formData.append("heatmap_alpha", settings.alpha);
+      formData.append("heatmap_smooth", settings.smooth);
+      formData.append("heatmap_sigma", settings.sigma);
+      formData.append("heatmap_colormap", settings.colormap);
+      formData.append("show_contours", settings.show_contours);
+      formData.append("contour_threshold", settings.contour_threshold);
+
+      try {
+        const res = await axios.post(`${API_BASE_URL}/rerender`, formData, {
+          headers: { "Content-Type": "multipart/form-data" },
+        });
+        setResult((current) =>
+          current && current.result_id === res.data.result_id ? { ...current, ...res.data } : current
+        );
+      } catch (err) {
+        // An expired result keeps its current overlays; the next prediction applies the settings
+        console.error("Re-render error:", err);
+      }
+    }, 250);
+  };
+
   const handleUpload = async () => {
     if (!selectedFile) {
       setError("Please select an image file");
@@ -105,6 +137,8 @@ function App() {
     formData.append("heatmap_colormap", heatmapSettings.colormap);
     formData.append("show_contours", heatmapSettings.show_contours);
     formData.append("contour_threshold", heatmapSettings.contour_threshold);
+    // Keep the maps so heatmap changes can be re-rendered without inference
+    formData.append("allow_rerender", true);
 
     try {
       const res = await axios.post(`${API_BASE_URL}/predict`, formData, {
@@ -230,7 +264,7 @@ function App() {
             advancedOptions={advancedOptions}
             onAdvancedOptionsChange={setAdvancedOptions}
             heatmapSettings={heatmapSettings}
-            onHeatmapSettingsChange={setHeatmapSettings}
+            onHeatmapSettingsChange={handleHeatmapSettingsChange}
           />
         </div>
       </div>